@@ -8,12 +8,21 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import re
+import sys
 import math
+import mmap
 import types
+import locale
+import hashlib
+import threading
+import multiprocessing
+import loadworker
 
 import undo
 import Unicode
 import pickle
+import shutil
+import tempfile
 import json
 #import binascii
 
@@ -21,9 +30,16 @@ from dxf	import DXF
 from bstl	import Binary_STL_Writer
 from bpath	import eq,Path, Segment
 from bmath	import *
-from copy	import deepcopy
+from copy	import copy, deepcopy
 from svgcode	import SVGcode
 
+# The columnar toolpath store and the planner need numpy
+try:
+	import numpy
+	import planner
+except ImportError:
+	numpy = None
+
 IDPAT    = re.compile(r".*\bid:\s*(.*?)\)")
 PARENPAT = re.compile(r"(\(.*?\))")
 SEMIPAT  = re.compile(r"(;.*)")
@@ -31,6 +47,20 @@ OPPAT    = re.compile(r"(.*)\[(.*)\]")
 CMDPAT   = re.compile(r"([A-Za-z]+)")
 BLOCKPAT = re.compile(r"^\(Block-([A-Za-z]+):\s*(.*)\)")
 AUXPAT   = re.compile(r"^(%[A-Za-z0-9]+)\b *(.*)$")
+# Block-name lines and header lines dropped by Block.append on raw bytes
+BLOCKNAMEPAT = re.compile(br"^\(Block-name:[^\n]*\)", re.M)
+HEADERPAT    = re.compile(br"^\(Block-(?:name|expand|enable|tab|color):[^\n]*\)", re.M)
+# units, feed mode and feed words of the lines before a chunk of the
+# parallel load
+MODALPAT     = re.compile(r"[Gg]\s*(2[01])(?![\d.])|[Gg]\s*(9[345])(?![\d.])|[Ff]\s*([-+]?\d*\.?\d+)")
+COMMENTPAT   = re.compile(r"\([^)\n]*\)|;[^\n]*")
+# types of variables whose values can be used to cache expressions
+DATATYPES = (int, float, str, bool, type(None))
+# builtin functions returning always the same result for the same arguments
+PUREFUNCS = ("abs", "min", "max", "round", "int", "float", "pow", "str",
+		"len", "bool")
+
+TOKENPAT = re.compile(r"\(([^()]*)\)|;(.*)|[()]")
 
 STOP   = 0
 SKIP   = 1
@@ -133,8 +163,36 @@ def getValue(name,new,old,default=0.0):
 
 #===============================================================================
 # Probing class and linear interpolation
+# When numpy is available the matrix is a 2D numpy array and whole blocks
+# can be split and interpolated at once with splitSegments()
+#
+# Besides the bilinear interpolation the surface can be interpolated with
+# bicubic patches, with the derivatives on the grid nodes estimated either
+# with finite differences (bicubic) or from a thin plate spline fitted over
+# all probed points (thin-plate). The 4x4 coefficients of every cell are
+# precomputed, so the evaluation remains O(1). Requires numpy
+#
+# The spline is a dense solve of (N+3)^2, grids larger than TPS_MAX nodes
+# use the finite differences and the adaptive probing fits the spline only
+# on the TPS_LOCAL probed points nearest to the nodes evaluated
 #===============================================================================
+BILINEAR   = "bilinear"
+BICUBIC    = "bicubic"
+THINPLATE  = "thin-plate"
+
+# Hermite basis for the bicubic patches
+_HERMITE = [[ 1, 0, 0, 0],
+	    [ 0, 0, 1, 0],
+	    [-3, 3,-2,-1],
+	    [ 2,-2, 1, 1]]
+
 class Probe:
+	INTERPOLATION = (BILINEAR, BICUBIC, THINPLATE)
+	SUBDIVIDE     = 4	# cell subdivisions when splitting on curved surfaces
+	TPS_MAX       = 1000	# largest number of points of a thin plate spline
+	TPS_LOCAL     = 100	# points of the local splines above TPS_MAX
+	TPS_TILE      = 8	# nodes filled at once by the local splines
+
 	def __init__(self):
 		self.init()
 
@@ -160,11 +218,23 @@ class Probe:
 		self.zeroed = False	# if probe was zeroed at any location
 		self.start  = False	# start collecting probes
 		self.saved  = False
+		self.method = BILINEAR	# interpolation method
+		self._coef  = None	# (method, coefficients) of the cells
+
+		self.tolerance = 0.02	# adaptive probing tolerance
+		self.merge     = 0.0	# Z tolerance to merge split segments, 0=off
+		self._probed   = None	# set of probed nodes (i,j) while adaptive
+		self._expect   = None	# nodes expected from the current pass
+		self._cells    = None	# cells (i0,i1,j0,j1) to check for refinement
 
 	#----------------------------------------------------------------------
 	def clear(self):
 		del self.points[:]
-		del self.matrix[:]
+		self.matrix = []
+		self._coef  = None
+		self._probed = None
+		self._expect = None
+		self._cells  = None
 		self.zeroed = False
 		self.start  = False
 		self.saved  = False
@@ -174,7 +244,11 @@ class Probe:
 
 	#----------------------------------------------------------------------
 	def makeMatrix(self):
-		del self.matrix[:]
+		self._coef = None
+		if numpy is not None:
+			self.matrix = numpy.zeros((self.yn, self.xn))
+			return
+		self.matrix = []
 		for j in range(self.yn):
 			self.matrix.append([0.0]*(self.xn))
 
@@ -192,13 +266,19 @@ class Probe:
 				line = f.readline()
 				assert line , "Read an empty line, please check file IO settings"
 				line = line.strip()
-				if line: return map(float, line.split())
+				if line: return line.split()
 
 		f = open(self.filename,"r")
-		self.xmin, self.xmax, self.xn = read(f)
-		self.ymin, self.ymax, self.yn = read(f)
-		self.zmin, self.zmax, feed    = read(f)
+		self.xmin, self.xmax, self.xn = map(float, read(f))
+		self.ymin, self.ymax, self.yn = map(float, read(f))
+		line = read(f)
+		self.zmin, self.zmax, feed    = map(float, line[:3])
 		CNC.vars["prbfeed"] = feed
+		# optional interpolation method
+		if len(line)>3 and line[3] in Probe.INTERPOLATION:
+			self.method = line[3]
+		else:
+			self.method = BILINEAR
 
 		self.xn = max(2,int(self.xn))
 		self.yn = max(2,int(self.yn))
@@ -211,7 +291,7 @@ class Probe:
 		try:
 			for j in range(self.yn):
 				for i in range(self.xn):
-					self.add(*read(f))
+					self.add(*map(float, read(f)))
 		except:
 			raise
 			#print "Error reading probe file",self.filename
@@ -232,7 +312,10 @@ class Probe:
 			self.filename = filename
 			f.write("%g %g %d\n"%(self.xmin, self.xmax, self.xn))
 			f.write("%g %g %d\n"%(self.ymin, self.ymax, self.yn))
-			f.write("%g %g %g\n"%(self.zmin, self.zmax, CNC.vars["prbfeed"]))
+			f.write("%g %g %g"%(self.zmin, self.zmax, CNC.vars["prbfeed"]))
+			if self.method != BILINEAR:
+				f.write(" %s"%(self.method))
+			f.write("\n")
 			f.write("\n\n")
 		for j in range(self.yn):
 			y = self.ymin + self._ystep*j
@@ -296,25 +379,230 @@ class Probe:
 		self.clear()
 		self.start = True
 		self.makeMatrix()
-		x = self.xmin
-		xstep = self._xstep
-		lines = ["G0Z%.4f"%(CNC.vars["safe"]),
-			 "G0X%.4fY%.4f"%(self.xmin, self.ymin)]
-		for j in range(self.yn):
+		return self.scanNodes([(i,j) for j in range(self.yn)
+						for i in range(self.xn)])
+
+	#----------------------------------------------------------------------
+	# Return the code needed to probe the grid nodes (i,j) in serpentine
+	# order, or in the order given if serpentine is False
+	#----------------------------------------------------------------------
+	def scanNodes(self, nodes, home=True, serpentine=True):
+		if serpentine:
+			rows = {}
+			for i,j in nodes:
+				rows.setdefault(j,[]).append(i)
+			nodes = []
+			for n,j in enumerate(sorted(rows)):
+				nodes.extend([(i,j) for i in sorted(rows[j], reverse=n&1)])
+
+		lines = ["G0Z%.4f"%(CNC.vars["safe"])]
+		if home:
+			lines.append("G0X%.4fY%.4f"%(self.xmin, self.ymin))
+		for i,j in nodes:
+			x = self.xmin + self._xstep*i
 			y = self.ymin + self._ystep*j
-			for i in range(self.xn):
-				lines.append("G0Z%.4f"%(self.zmax))
-				lines.append("G0X%.4fY%.4f"%(x,y))
-				lines.append("%wait")	# added for smoothie
-				lines.append("%sZ%.4fF%g"%(CNC.vars["prbcmd"], self.zmin, CNC.vars["prbfeed"]))
-				lines.append("%wait")	# added for smoothie
-				x += xstep
-			x -= xstep
-			xstep = -xstep
+			lines.append("G0Z%.4f"%(self.zmax))
+			lines.append("G0X%.4fY%.4f"%(x,y))
+			lines.append("%wait")	# added for smoothie
+			lines.append("%sZ%.4fF%g"%(CNC.vars["prbcmd"], self.zmin, CNC.vars["prbfeed"]))
+			lines.append("%wait")	# added for smoothie
 		lines.append("G0Z%.4f"%(self.zmax))
 		lines.append("G0X%.4fY%.4f"%(self.xmin,self.ymin))
 		return lines
 
+	#----------------------------------------------------------------------
+	# Adaptive probing. Probe first every stride nodes and then refine
+	# with refine() only the cells where the surface bends more than the
+	# tolerance. The nodes not probed are filled at the end from the
+	# surface fitted on the probed ones. Requires numpy
+	#----------------------------------------------------------------------
+	def scanAdaptive(self, stride, tolerance=None):
+		if numpy is None or stride <= 1:
+			return self.scan()
+		if tolerance is not None: self.tolerance = tolerance
+		self.clear()
+		self.start = True
+		self.makeMatrix()
+
+		xs = sorted(set(range(0, self.xn, stride)) | set([self.xn-1]))
+		ys = sorted(set(range(0, self.yn, stride)) | set([self.yn-1]))
+		self._probed = set()
+		self._expect = set([(i,j) for j in ys for i in xs])
+		self._cells  = [(xs[a],xs[a+1],ys[b],ys[b+1])
+					for b in range(len(ys)-1)
+					for a in range(len(xs)-1)]
+		return self.scanNodes(self._expect)
+
+	#----------------------------------------------------------------------
+	# Probe only the nodes around the cells crossed by the segments
+	# start-end (the toolpath), visiting them in a short order.
+	# The rest of the nodes are filled from the fitted surface by refine()
+	# at the end of the pass. Requires numpy
+	#----------------------------------------------------------------------
+	def scanMasked(self, start, end):
+		if numpy is None: return self.scan()
+		self.clear()
+		self.start = True
+		self.makeMatrix()
+		nodes = self.footprint(start, end)
+		if not nodes: return self.scan()
+		self._probed = set()
+		self._expect = set(nodes)
+		self._cells  = []
+		return self.scanNodes(self.tour(nodes), serpentine=False)
+
+	#----------------------------------------------------------------------
+	# Rasterize the XY segments on the grid
+	# @return the list of nodes (i,j) of the cells crossed by the segments
+	# and their neighbors
+	#----------------------------------------------------------------------
+	def footprint(self, start, end):
+		start = numpy.asarray(start, dtype=numpy.float64).reshape(-1,3)[:,:2]
+		end   = numpy.asarray(end,   dtype=numpy.float64).reshape(-1,3)[:,:2]
+		if not len(start): return []
+
+		# sample the segments at half cell
+		h = 0.5*min(self._xstep, self._ystep)
+		n = numpy.ceil(numpy.hypot(*(end-start).T) / h).astype(int) + 1
+		seg = numpy.repeat(numpy.arange(len(start)), n)
+		k = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n)-n, n)
+		t = (k / numpy.maximum(n-1,1)[seg].astype(numpy.float64))[:,None]
+		xy = start[seg] + t*(end[seg]-start[seg])
+
+		i = numpy.clip(numpy.floor((xy[:,0]-self.xmin)/self._xstep), 0, self.xn-2).astype(int)
+		j = numpy.clip(numpy.floor((xy[:,1]-self.ymin)/self._ystep), 0, self.yn-2).astype(int)
+		cells = numpy.zeros((self.yn-1, self.xn-1), dtype=bool)
+		cells[j,i] = True
+
+		# corners of the cells plus one node around
+		mask = numpy.zeros((self.yn+2, self.xn+2), dtype=bool)
+		for dj in range(4):
+			for di in range(4):
+				mask[dj:dj+self.yn-1, di:di+self.xn-1] |= cells
+		j,i = numpy.nonzero(mask[1:-1,1:-1])
+		return list(zip(i.tolist(), j.tolist()))
+
+	#----------------------------------------------------------------------
+	# Order the nodes for a short rapid travel starting from (xmin,ymin),
+	# nearest neighbor followed by 2-opt improvements
+	#----------------------------------------------------------------------
+	def tour(self, nodes, passes=10):
+		if len(nodes) < 3: return list(nodes)
+		p = numpy.array([(self.xmin + self._xstep*i, self.ymin + self._ystep*j)
+					for i,j in nodes])
+		p = numpy.vstack(([self.xmin, self.ymin], p))	# fixed start
+		n = len(p)
+
+		# nearest neighbor
+		order = [0]
+		left  = numpy.ones(n, dtype=bool)
+		left[0] = False
+		for k in range(n-1):
+			d = numpy.hypot(*(p-p[order[-1]]).T)
+			d[~left] = numpy.inf
+			nxt = int(d.argmin())
+			order.append(nxt)
+			left[nxt] = False
+		order = numpy.array(order)
+
+		# 2-opt on the open path, reverse order[i+1:j+1] if shorter
+		for it in range(passes):
+			improved = False
+			for i in range(n-2):
+				q  = p[order]
+				a  = q[i]
+				b  = q[i+1]
+				c  = q[i+2:]
+				d  = numpy.vstack((q[i+3:], [q[-1]]))
+				dab = math.hypot(*(b-a))
+				delta = numpy.hypot(*(c-a).T) - dab
+				# the last node has no next edge
+				delta[:-1] += numpy.hypot(*(d[:-1]-b).T) - numpy.hypot(*(d[:-1]-c[:-1]).T)
+				j = int(delta.argmin())
+				if delta[j] < -1e-9:
+					j += i+2
+					order[i+1:j+1] = order[i+1:j+1][::-1].copy()
+					improved = True
+			if not improved: break
+		return [nodes[k-1] for k in order[1:]]
+
+	#----------------------------------------------------------------------
+	# @return True when an adaptive pass finished and refine() has to be
+	# called for the next one
+	#----------------------------------------------------------------------
+	def refining(self):
+		return self.start and self._expect is not None and not self._expect
+
+	#----------------------------------------------------------------------
+	# Check the cells of the last adaptive pass comparing the thin plate
+	# spline fitted on all probed points with the bilinear interpolation
+	# of the cell corners, on the nodes in the middle of the cell.
+	# @return the code to probe the nodes of the cells exceeding the
+	# tolerance, or an empty list when the probing is complete
+	#----------------------------------------------------------------------
+	def refine(self):
+		nodes = sorted(self._probed)
+		i = numpy.array([n[0] for n in nodes], dtype=numpy.float64)
+		j = numpy.array([n[1] for n in nodes], dtype=numpy.float64)
+		m = numpy.asarray(self.matrix, dtype=numpy.float64)
+		z = m[j.astype(int), i.astype(int)]
+		if len(z) <= Probe.TPS_MAX:
+			fit = Probe._tpsSolve(i, j, z)
+		else:
+			fit = None
+
+		cells = []
+		probe = set()
+		for i0,i1,j0,j1 in self._cells:
+			if i1-i0 <= 1 and j1-j0 <= 1: continue
+			# nodes of the next level inside the cell
+			im = sorted(set((i0, (i0+i1)//2, i1)))
+			jm = sorted(set((j0, (j0+j1)//2, j1)))
+			new = [(a,b) for b in jm for a in im if (a,b) not in self._probed]
+			if not new: continue
+
+			u = numpy.array([n[0] for n in new], dtype=numpy.float64)
+			v = numpy.array([n[1] for n in new], dtype=numpy.float64)
+			a = (u-i0) / float(i1-i0)
+			b = (v-j0) / float(j1-j0)
+			bilinear = (1.0-a)*(1.0-b) * m[j0,i0] + \
+				   (1.0-a)*b       * m[j1,i0] + \
+				   a*(1.0-b)       * m[j0,i1] + \
+				   a*b             * m[j1,i1]
+			spline = Probe._tpsSpline(i, j, z, fit, u, v)
+			if numpy.abs(spline-bilinear).max() <= self.tolerance:
+				continue
+			probe.update(new)
+			for a in range(len(im)-1):
+				for b in range(len(jm)-1):
+					cells.append((im[a],im[a+1],jm[b],jm[b+1]))
+
+		if probe:
+			self._cells  = cells
+			self._expect = probe
+			return self.scanNodes(probe, False)
+
+		# fill the nodes not probed from the fitted surface
+		nj, ni = numpy.mgrid[0:self.yn, 0:self.xn].astype(numpy.float64)
+		fill = numpy.empty(m.shape)
+		T = max(self.xn, self.yn) if fit is not None else Probe.TPS_TILE
+		for j0 in range(0, self.yn, T):
+			for i0 in range(0, self.xn, T):
+				u = ni[j0:j0+T, i0:i0+T]
+				v = nj[j0:j0+T, i0:i0+T]
+				fill[j0:j0+T, i0:i0+T] = Probe._tpsSpline(i, j, z, fit,
+						u.ravel(), v.ravel()).reshape(u.shape)
+		for jj in range(self.yn):
+			for ii in range(self.xn):
+				if (ii,jj) not in self._probed:
+					self.matrix[jj][ii] = fill[jj,ii]
+		self._coef   = None
+		self._probed = None
+		self._expect = None
+		self._cells  = None
+		self.start   = False
+		return []
+
 	#----------------------------------------------------------------------
 	# Add a probed point to the list and the 3D matrix
 	#----------------------------------------------------------------------
@@ -335,10 +623,14 @@ class Probe:
 		try:
 			self.matrix[int(j)][int(i)] = z
 			self.points.append([x,y,z])
+			self._coef = None
 		except IndexError:
 			pass
 
-		if len(self.points) >= self.xn*self.yn:
+		if self._probed is not None:
+			self._probed.add((int(i),int(j)))
+			self._expect.discard((int(i),int(j)))
+		elif len(self.points) >= self.xn*self.yn:
 			self.start = False
 
 	#----------------------------------------------------------------------
@@ -352,6 +644,7 @@ class Probe:
 		zero = self.interpolate(x,y)
 		self.xstep()
 		self.ystep()
+		self._coef = None
 		for j,row in enumerate(self.matrix):
 			y = self.ymin + self._ystep*j
 			for i in range(len(row)):
@@ -379,6 +672,15 @@ class Probe:
 
 		a = ix - i
 		b = jy - j
+
+		coef = self.coefficients()
+		if coef is not None:
+			# no extrapolation of the cubic outside the grid
+			a = min(max(a,0.0),1.0)
+			b = min(max(b,0.0),1.0)
+			return float(numpy.dot((1.0, a, a*a, a*a*a),
+				coef[j,i].dot((1.0, b, b*b, b*b*b))))
+
 		a1 = 1.0 - a
 		b1 = 1.0 - b
 
@@ -387,6 +689,154 @@ class Probe:
 		       a *b1 * self.matrix[j][i+1] + \
 		       a *b  * self.matrix[j+1][i+1]
 
+	#----------------------------------------------------------------------
+	# Vectorized interpolate() for numpy arrays of x and y
+	#----------------------------------------------------------------------
+	def interpolateArray(self, x, y):
+		ix = (numpy.asarray(x)-self.xmin) / self._xstep
+		jy = (numpy.asarray(y)-self.ymin) / self._ystep
+		i = numpy.clip(numpy.floor(ix), 0, self.xn-2).astype(int)
+		j = numpy.clip(numpy.floor(jy), 0, self.yn-2).astype(int)
+
+		a  = ix - i
+		b  = jy - j
+
+		coef = self.coefficients()
+		if coef is not None:
+			a = numpy.clip(a, 0.0, 1.0)
+			b = numpy.clip(b, 0.0, 1.0)
+			av = numpy.stack((numpy.ones_like(a), a, a*a, a*a*a), axis=-1)
+			bv = numpy.stack((numpy.ones_like(b), b, b*b, b*b*b), axis=-1)
+			return numpy.einsum("...k,...kl,...l->...", av, coef[j,i], bv)
+
+		a1 = 1.0 - a
+		b1 = 1.0 - b
+
+		m = numpy.asarray(self.matrix, dtype=numpy.float64)
+		return a1*b1 * m[j,i]   + \
+		       a1*b  * m[j+1,i] + \
+		       a *b1 * m[j,i+1] + \
+		       a *b  * m[j+1,i+1]
+
+	#----------------------------------------------------------------------
+	# Return the bicubic coefficients of every cell as an (yn-1,xn-1,4,4)
+	# array, where z = sum(c[j,i,k,l] * a^k * b^l) with (a,b) the local
+	# coordinates in the cell. None for the bilinear interpolation
+	#----------------------------------------------------------------------
+	def coefficients(self):
+		if self.method == BILINEAR or numpy is None or self.isEmpty():
+			return None
+		if self._coef is not None and self._coef[0] == self.method:
+			return self._coef[1]
+
+		# derivatives on the nodes in units of cells
+		f = numpy.asarray(self.matrix, dtype=numpy.float64)
+		if self.method == THINPLATE and f.size <= Probe.TPS_MAX:
+			fx, fy, fxy = self._thinPlate(f)
+		else:
+			fx  = numpy.gradient(f, axis=1)
+			fy  = numpy.gradient(f, axis=0)
+			fxy = numpy.gradient(fx, axis=0)
+
+		# F[k,l] matrix of every cell with
+		#	k: value, value, d/dx, d/dx on the x corners 0,1
+		#	l: value, value, d/dy, d/dy on the y corners 0,1
+		yn, xn = f.shape
+		F = numpy.empty((yn-1, xn-1, 4, 4))
+		for k,(v,vy) in enumerate(((f,fy), (f,fy), (fx,fxy), (fx,fxy))):
+			i = k%2
+			for j in (0,1):
+				F[...,k,j]   = v [j:j+yn-1, i:i+xn-1]
+				F[...,k,j+2] = vy[j:j+yn-1, i:i+xn-1]
+		M = numpy.array(_HERMITE, dtype=numpy.float64)
+		coef = numpy.einsum("ik,...kl,jl->...ij", M, F, M)
+		self._coef = (self.method, coef)
+		return coef
+
+	#----------------------------------------------------------------------
+	# Fit a thin plate spline over all the grid nodes
+	# @return the x, y and cross derivatives on the nodes in units of cells
+	#----------------------------------------------------------------------
+	@staticmethod
+	def _thinPlate(f):
+		yn, xn = f.shape
+		j, i = numpy.mgrid[0:yn, 0:xn]
+		x = i.ravel().astype(numpy.float64)
+		y = j.ravel().astype(numpy.float64)
+		w, c = Probe._tpsSolve(x, y, f.ravel())
+		dx = x[:,None] - x[None,:]
+		dy = y[:,None] - y[None,:]
+		r2 = dx*dx + dy*dy
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			logr2 = numpy.where(r2>0.0, numpy.log(r2), 0.0)
+			inv2  = numpy.where(r2>0.0, 1.0/r2, 0.0)
+
+		# dU/dx = dx (2 log(r) + 1),  d2U/dxdy = 2 dx dy / r^2
+		g   = logr2 + numpy.where(r2>0.0, 1.0, 0.0)
+		fx  = c[1] + (dx*g).dot(w)
+		fy  = c[2] + (dy*g).dot(w)
+		fxy = (2.0*dx*dy*inv2).dot(w)
+		return fx.reshape(f.shape), fy.reshape(f.shape), fxy.reshape(f.shape)
+
+	#----------------------------------------------------------------------
+	# Thin plate spline kernel U(r) = r^2 log(r) = r^2 log(r^2)/2
+	#----------------------------------------------------------------------
+	@staticmethod
+	def _tpsKernel(dx, dy):
+		r2 = dx*dx + dy*dy
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			return numpy.where(r2>0.0, 0.5*r2*numpy.log(r2), 0.0)
+
+	#----------------------------------------------------------------------
+	# Fit a thin plate spline passing through the points (x,y,z)
+	# @return the weights of the points and the linear coefficients
+	#----------------------------------------------------------------------
+	@staticmethod
+	def _tpsSolve(x, y, z):
+		n = len(x)
+		A = numpy.zeros((n+3,n+3))
+		A[:n,:n] = Probe._tpsKernel(x[:,None]-x[None,:], y[:,None]-y[None,:])
+		A[:n,n]  = A[n,:n] = 1.0
+		A[:n,n+1]= A[n+1,:n] = x
+		A[:n,n+2]= A[n+2,:n] = y
+		rhs = numpy.zeros(n+3)
+		rhs[:n] = z
+		try:
+			w = numpy.linalg.solve(A, rhs)
+		except numpy.linalg.LinAlgError:
+			w = numpy.linalg.lstsq(A, rhs, rcond=None)[0]
+		return w[:n], w[n:]
+
+	#----------------------------------------------------------------------
+	# Evaluate on (u,v) the thin plate spline fitted on the points (x,y)
+	#----------------------------------------------------------------------
+	@staticmethod
+	def _tpsEval(x, y, w, c, u, v):
+		U = Probe._tpsKernel(u[:,None]-x[None,:], v[:,None]-y[None,:])
+		return c[0] + c[1]*u + c[2]*v + U.dot(w)
+
+	#----------------------------------------------------------------------
+	# Evaluate on (u,v) the spline fit=(w,c) of all the points (x,y,z), or
+	# when fit is None the spline of the TPS_LOCAL points nearest to (u,v)
+	#----------------------------------------------------------------------
+	@staticmethod
+	def _tpsSpline(x, y, z, fit, u, v):
+		if fit is None:
+			d = (x-u.mean())**2 + (y-v.mean())**2
+			near = numpy.argsort(d, kind="stable")[:Probe.TPS_LOCAL]
+			x, y, z = x[near], y[near], z[near]
+			fit = Probe._tpsSolve(x, y, z)
+		w, c = fit
+		return Probe._tpsEval(x, y, w, c, u, v)
+
+	#----------------------------------------------------------------------
+	# Number of cell subdivisions needed to follow the surface
+	#----------------------------------------------------------------------
+	def subdivisions(self):
+		if self.method == BILINEAR or numpy is None:
+			return 1
+		return Probe.SUBDIVIDE
+
 	#----------------------------------------------------------------------
 	# Split line into multiple segments correcting for Z if needed
 	# return only end points
@@ -409,24 +859,28 @@ class Probe:
 		dy /= rxy
 		dz /= rxy	# add correction for the slope in Z, versus the travel in XY
 
-		i = int(math.floor((x1-self.xmin) / self._xstep))
-		j = int(math.floor((y1-self.ymin) / self._ystep))
+		# split on the cell boundaries or on the subdivisions
+		sub   = self.subdivisions()
+		xstep = self._xstep / sub
+		ystep = self._ystep / sub
+		i = int(math.floor((x1-self.xmin) / xstep))
+		j = int(math.floor((y1-self.ymin) / ystep))
 		if dx > 1e-10:
-			tx  = (float(i+1)*self._xstep+self.xmin - x1)/ dx	# distance to next cell
-			tdx = self._xstep / dx
+			tx  = (float(i+1)*xstep+self.xmin - x1)/ dx	# distance to next cell
+			tdx = xstep / dx
 		elif dx < -1e-10:
-			tx  = (float(i)*self._xstep+self.xmin - x1)/ dx		# distance to next cell
-			tdx = -self._xstep / dx
+			tx  = (float(i)*xstep+self.xmin - x1)/ dx		# distance to next cell
+			tdx = -xstep / dx
 		else:
 			tx  = 1e10
 			tdx = 0.0
 
 		if dy > 1e-10:
-			ty  = (float(j+1)*self._ystep+self.ymin - y1)/ dy	# distance to next cell
-			tdy = self._ystep / dy
+			ty  = (float(j+1)*ystep+self.ymin - y1)/ dy	# distance to next cell
+			tdy = ystep / dy
 		elif dy < -1e-10:
-			ty  = (float(j)*self._ystep+self.ymin - y1)/ dy		# distance to next cell
-			tdy = -self._ystep / dy
+			ty  = (float(j)*ystep+self.ymin - y1)/ dy		# distance to next cell
+			tdy = -ystep / dy
 		else:
 			ty  = 1e10
 			tdy = 0.0
@@ -452,6 +906,110 @@ class Probe:
 		segments.append((x2,y2,z2+self.interpolate(x2,y2)))
 		return segments
 
+	#----------------------------------------------------------------------
+	# Merge the consecutive split points of a straight line, as returned
+	# by splitLine(), while the Z deviation of the dropped points from the
+	# merged line remains within the tolerance.
+	#
+	# anchor:	corrected (x,y,z) start of the line
+	# points:	list of the corrected (x,y,z) split points
+	# @return the indices of the points to keep, the last is always kept
+	#----------------------------------------------------------------------
+	@staticmethod
+	def mergeLine(anchor, points, tolerance):
+		ax,ay,az = anchor
+		lo = -1e30	# feasible slope range from the anchor
+		hi =  1e30
+		keep = []
+		prev = None
+		for c,(x,y,z) in enumerate(points):
+			d = math.hypot(x-ax, y-ay)
+			if d < 1e-10:
+				# vertical, no merging
+				if prev is not None: keep.append(prev)
+				keep.append(c)
+				ax,ay,az = x,y,z
+				lo,hi = -1e30, 1e30
+				prev = None
+				continue
+			slope = (z-az)/d
+			if prev is not None and not lo <= slope <= hi:
+				# previous point becomes the new anchor
+				keep.append(prev)
+				ax,ay,az = points[prev]
+				lo,hi = -1e30, 1e30
+				d = max(math.hypot(x-ax, y-ay), 1e-10)
+			lo = max(lo, (z-tolerance-az)/d)
+			hi = min(hi, (z+tolerance-az)/d)
+			prev = c
+		if prev is not None: keep.append(prev)
+		return keep
+
+	#----------------------------------------------------------------------
+	# Vectorized splitLine() for many segments at once
+	#
+	# start, end:	(n,3) arrays with the segment end points
+	# @return	(points, seg) where points is a (m,3) array with the
+	#		end points of all the split segments in order, corrected
+	#		for Z, and seg the index of the originating segment
+	#----------------------------------------------------------------------
+	def splitSegments(self, start, end):
+		start = numpy.asarray(start, dtype=numpy.float64).reshape(-1,3)
+		end   = numpy.asarray(end,   dtype=numpy.float64).reshape(-1,3)
+		n     = len(start)
+		d     = end - start
+		d[numpy.abs(d)<1e-10] = 0.0
+
+		rxy  = numpy.hypot(d[:,0], d[:,1])
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			u = d / rxy[:,None]	# direction cosines along XY plane
+		u[rxy==0.0] = 0.0
+		rxy *= 0.999999999	# just reduce a bit to avoid precision errors
+
+		# parameters t of the crossings with the grid lines of every axis
+		seg = [numpy.arange(n)]
+		par = [numpy.full(n, numpy.inf)]	# the end point, always last
+		sub = float(self.subdivisions())
+		for axis,vmin,step in ((0, self.xmin, self._xstep/sub),
+				       (1, self.ymin, self._ystep/sub)):
+			v0 = start[:,axis]
+			du = u[:,axis]
+			i  = numpy.floor((v0-vmin) / step)
+			with numpy.errstate(divide="ignore", invalid="ignore"):
+				t0 = numpy.where(du > 1e-10, ((i+1.0)*step+vmin - v0) / du,
+				     numpy.where(du < -1e-10, (i*step+vmin - v0) / du,
+					numpy.inf))
+				dt = step / numpy.abs(du)
+				cnt = numpy.where(t0 < rxy, numpy.ceil((rxy-t0)/dt), 0.0)
+			cnt = cnt.astype(int)
+			total = cnt.sum()
+			if total == 0: continue
+			s = numpy.repeat(numpy.arange(n), cnt)
+			k = numpy.arange(total) - numpy.repeat(numpy.cumsum(cnt)-cnt, cnt)
+			seg.append(s)
+			par.append(t0[s] + k*dt[s])
+
+		seg = numpy.concatenate(seg)
+		par = numpy.concatenate(par)
+		order = numpy.lexsort((par, seg))
+		seg = seg[order]
+		par = par[order]
+
+		# crossing a grid node, both axes at the same place
+		if len(seg) > 1:
+			keep = numpy.ones(len(seg), dtype=bool)
+			with numpy.errstate(invalid="ignore"):
+				keep[1:] = (seg[1:]!=seg[:-1]) | (par[1:]-par[:-1] > 1e-9)
+			seg = seg[keep]
+			par = par[keep]
+
+		last = numpy.isinf(par)
+		par[last] = 0.0
+		points = start[seg] + par[:,None]*u[seg]
+		points[last] = end[seg[last]]
+		points[:,2] += self.interpolateArray(points[:,0], points[:,1])
+		return points, seg
+
 
 #===============================================================================
 # contains a list of machine points vs position in the gcode
@@ -654,6 +1212,114 @@ class Orient:
 		self.saved = True
 
 
+#===============================================================================
+# Dictionary of variables that keeps a version number for every key.
+# Writers (e.g. the serial thread) only bump the version when a value
+# really changes. Readers subscribe a callback to a set of keys and call
+# dispatch() from the GUI thread, once per frame, to get notified only for
+# the keys that changed since the last call. Many status reports arriving
+# between two frames result in a single notification.
+# touch() and dispatch() are serialized with a lock, as the serial and the
+# producer threads write while the GUI dispatches.
+#===============================================================================
+class VarStore(dict):
+	def __init__(self, *args, **kwargs):
+		dict.__init__(self, *args, **kwargs)
+		self._lock        = threading.Lock()
+		self._version     = 0		# global version counter
+		self._versions    = {}		# version of every key
+		self._dispatched  = 0		# version of last dispatch
+		self._subscribers = []		# list of [keys, callback, version]
+
+	#-----------------------------------------------------------------------
+	def __setitem__(self, key, value):
+		try:
+			old = dict.__getitem__(self, key)
+			if type(old) is type(value) and old == value: return
+		except Exception:
+			pass
+		dict.__setitem__(self, key, value)
+		self.touch(key)
+
+	#-----------------------------------------------------------------------
+	def __delitem__(self, key):
+		dict.__delitem__(self, key)
+		self.touch(key)
+
+	#-----------------------------------------------------------------------
+	def update(self, *args, **kwargs):
+		for key, value in dict(*args, **kwargs).items():
+			self[key] = value
+
+	#-----------------------------------------------------------------------
+	def setdefault(self, key, value=None):
+		if key not in self: self[key] = value
+		return dict.__getitem__(self, key)
+
+	#-----------------------------------------------------------------------
+	# Mark keys as changed, e.g. after modifying a mutable value in place
+	#-----------------------------------------------------------------------
+	def touch(self, *keys):
+		with self._lock:
+			self._version += 1
+			for key in keys:
+				self._versions[key] = self._version
+
+	#-----------------------------------------------------------------------
+	# @return the version of the store or the latest version of the keys
+	#-----------------------------------------------------------------------
+	def version(self, keys=None):
+		if keys is None: return self._version
+		get = self._versions.get
+		return max([get(key,0) for key in keys] or [0])
+
+	#-----------------------------------------------------------------------
+	# @return the keys changed after version since
+	#-----------------------------------------------------------------------
+	def changed(self, since, keys=None):
+		if keys is None: keys = self._versions
+		get = self._versions.get
+		return [key for key in keys if get(key,0) > since]
+
+	#-----------------------------------------------------------------------
+	# Call callback() on the next dispatch() after any of the keys changed
+	# @return the subscription to be used with unsubscribe()
+	#-----------------------------------------------------------------------
+	def subscribe(self, keys, callback, now=True):
+		sub = [tuple(keys), callback, -1 if now else self._version]
+		self._subscribers.append(sub)
+		self._dispatched = -1
+		return sub
+
+	#-----------------------------------------------------------------------
+	def unsubscribe(self, sub):
+		try:
+			self._subscribers.remove(sub)
+		except ValueError:
+			pass
+
+	#-----------------------------------------------------------------------
+	# Notify the subscribers of the keys changed since the last dispatch.
+	# Must be called from the thread owning the subscribers (GUI)
+	#-----------------------------------------------------------------------
+	def dispatch(self):
+		with self._lock:
+			version = self._version
+			if version == self._dispatched: return
+			self._dispatched = version
+			callbacks = []
+			for sub in self._subscribers:
+				keys, callback, last = sub
+				if last >= 0 and self.version(keys) <= last: continue
+				# remember the version before calling, so that any change
+				# happening during the callback is reported next time
+				sub[2] = version
+				callbacks.append(callback)
+		# outside the lock, callbacks may modify the store
+		for callback in callbacks:
+			callback()
+
+
 #===============================================================================
 # Command operations on a CNC
 #===============================================================================
@@ -677,7 +1343,19 @@ class CNC:
 	comment        = ""	# last parsed comment
 	developer      = False
 	drozeropad     = 0
-	vars           = {
+	# attributes of the modal state and position, saved by saveState()
+	# The first MOTIONSTATE ones affect the motion of the following lines
+	# and are compared by sameState(). The rest (dwell, tool, arc offsets
+	# reset after every arc, ...) do not.
+	STATE          = ("x", "y", "z", "xval", "yval", "zval",
+			"dx", "dy", "dz", "unit", "absolute", "arcabsolute",
+			"retractz", "gcode", "plane", "feed", "lval",
+			"a", "b", "c", "aval", "bval", "cval",
+			"ival", "jval", "kval", "uval", "vval", "wval",
+			"di", "dj", "dk", "rval", "pval", "qval", "mval",
+			"tool", "_lastTool")
+	MOTIONSTATE    = 17
+	vars           = VarStore({
 			"prbx"       : 0.0,
 			"prby"       : 0.0,
 			"prbz"       : 0.0,
@@ -755,7 +1433,7 @@ class CNC:
 			"controller" : "",
 			"running"    : False,
 			#"enable6axisopt" : 0,
-		}
+		})
 
 	drillPolicy    = 1		# Expand Canned cycles
 	toolPolicy     = 1		# Should be in sync with ProbePage
@@ -944,6 +1622,34 @@ class CNC:
 		self.totalLength = 0.0
 		self.totalTime   = 0.0
 
+	#----------------------------------------------------------------------
+	# @return a snapshot of the modal state and position, as a tuple
+	# starting with the x,y,z position
+	#----------------------------------------------------------------------
+	def saveState(self):
+		return tuple([getattr(self,n) for n in CNC.STATE]) \
+			+ (CNC.vars["feedmode"],)
+
+	#----------------------------------------------------------------------
+	# @return True if the two states result in the same motion, with the
+	# same feed if feed is True
+	#----------------------------------------------------------------------
+	@staticmethod
+	def sameState(a, b, feed=True):
+		if feed:
+			return a[:CNC.MOTIONSTATE] == b[:CNC.MOTIONSTATE] and a[-1] == b[-1]
+		f = CNC.STATE.index("feed")
+		return a[:f] == b[:f] and a[-1] == b[-1] and \
+			a[f+1:CNC.MOTIONSTATE] == b[f+1:CNC.MOTIONSTATE]
+
+	#----------------------------------------------------------------------
+	# Restore a state returned by saveState()
+	#----------------------------------------------------------------------
+	def restoreState(self, state):
+		for n,v in zip(CNC.STATE, state):
+			setattr(self, n, v)
+		CNC.vars["feedmode"] = state[-1]
+
 	#----------------------------------------------------------------------
 	def resetEnableMargins(self):
 		# Selected blocks margin
@@ -1120,7 +1826,7 @@ class CNC:
 	#       else compiled expressions,""
 	#----------------------------------------------------------------------
 	@staticmethod
-	def compileLine(line, space=False):
+	def compileLine(line, space=False, fast=True):
 		line = line.strip()
 		if not line: return None
 		if line[0] == "$": return line
@@ -1170,6 +1876,29 @@ class CNC:
 			CNC.comment = line[1:].strip()
 			return None
 
+		# fast path for plain lines without expressions or assignments
+		if fast and "[" not in line and "]" not in line and "=" not in line:
+			cmd = []
+			comment = []
+			pos = 0
+			for pat in TOKENPAT.finditer(line):
+				cmd.append(line[pos:pat.start()])
+				if pat.group(1) is not None:
+					# semicolons are dropped inside a comment
+					comment.append(pat.group(1).replace(";",""))
+				elif pat.group(2) is not None:
+					comment.append(pat.group(2))
+				else:
+					# nested or unbalanced parenthesis
+					break
+				pos = pat.end()
+			else:
+				cmd.append(line[pos:])
+				CNC.comment = "".join(comment)
+				cmd = "".join(cmd)
+				if not space: cmd = cmd.replace(" ","")
+				return cmd or None
+
 		out    = []		# output list of commands
 		braket = 0		# bracket count []
 		paren  = 0		# parenthesis count ()
@@ -1208,7 +1937,7 @@ class CNC:
 					braket -= 1
 					if braket==0:
 						try:
-							out.append(compile(expr,"","eval"))
+							out.append(CNC.foldExpr(compile(expr,"","eval")))
 						except:
 							# FIXME show the error!!!!
 							pass
@@ -1254,6 +1983,16 @@ class CNC:
 
 		if cmd: out.append(cmd)
 
+		# join the folded constant expressions with the commands
+		if len(out)>1:
+			joined = []
+			for item in out:
+				if joined and isinstance(item,str) and isinstance(joined[-1],str):
+					joined[-1] += item
+				else:
+					joined.append(item)
+			out = joined
+
 		# return output commands
 		if len(out)==0:
 			return None
@@ -1261,6 +2000,29 @@ class CNC:
 			return out
 		return out[0]
 
+	#----------------------------------------------------------------------
+	# Format the result of an expression as in a gcode line
+	#----------------------------------------------------------------------
+	@staticmethod
+	def formatResult(result):
+		if isinstance(result,float):
+			return str(round(result,CNC.digits))
+		return str(result)
+
+	#----------------------------------------------------------------------
+	# Fold an expression code object without any variable or function
+	# reference to its formatted value
+	#----------------------------------------------------------------------
+	@staticmethod
+	def foldExpr(code):
+		if code.co_names: return code
+		for const in code.co_consts:
+			if isinstance(const, types.CodeType): return code
+		try:
+			return CNC.formatResult(eval(code, {"__builtins__":{}}))
+		except:
+			return code
+
 	#----------------------------------------------------------------------
 	# Break line into commands
 	#----------------------------------------------------------------------
@@ -1717,7 +2479,14 @@ class CNC:
 	#----------------------------------------------------------------------
 	@staticmethod
 	def compile(program):
-		lines = []
+		return [cmds for j,cmds in CNC.compileIter(program)]
+
+	#----------------------------------------------------------------------
+	# Compile lazily the lines of program, any iterable like an open file
+	# @return generator of (line index, compiled line) of the non empty lines
+	#----------------------------------------------------------------------
+	@staticmethod
+	def compileIter(program):
 		for j,line in enumerate(program):
 			newcmd = []
 			cmds = CNC.compileLine(line)
@@ -1726,7 +2495,7 @@ class CNC:
 				cmds = CNC.breakLine(cmds)
 			else:
 				# either CodeType or tuple, list[] append it as is
-				lines.append(cmds)
+				yield j, cmds
 				continue
 
 			for cmd in cmds:
@@ -1741,8 +2510,7 @@ class CNC:
 
 				if cmd is not None:
 					newcmd.append(cmd)
-			lines.append("".join(newcmd))
-		return lines
+			yield j, "".join(newcmd)
 
 	#----------------------------------------------------------------------
 	# code to change manually tool
@@ -1917,6 +2685,141 @@ class CNC:
 		return lines
 
 
+#===============================================================================
+# Columnar store of the motion segments of a block, filled from a single
+# simulation pass. Every line producing a motion is one row with
+#	lid		line index in the block
+#	gcode		motion type (0,1,2,3,81..)
+#	feed		feed rate
+#	feedmode	93/94 used for the time estimation, 0 for unknown
+#	start, end	xyz of the motion
+#	center		xyz of the arc center (nan for non arcs)
+#	length, time	path length and estimated time
+# while the polyline of row k (arcs approximated) is
+#	points[offset[k]:offset[k+1]]
+#===============================================================================
+class Toolpath:
+	def __init__(self):
+		self.lines    = None	# snapshot of the block lines simulated
+		self.entry    = None	# cnc state at the start of the block
+		self.exit     = None	# cnc state at the end of the block
+		self.volatile = False	# block contains expressions
+		self.first    = None	# position after the first cutting motion
+		self._lid     = []
+		self._gcode   = []
+		self._feed    = []
+		self._mode    = []
+		self._center  = []
+		self._points  = []
+		self._offset  = [0]
+
+	#----------------------------------------------------------------------
+	def __len__(self):
+		return len(self.lid)
+
+	#----------------------------------------------------------------------
+	# Append the motion of line lid with its polyline xyz
+	#----------------------------------------------------------------------
+	def add(self, lid, gcode, feed, feedmode, xyz, center=None):
+		self._lid.append(lid)
+		self._gcode.append(gcode)
+		self._feed.append(feed)
+		self._mode.append(feedmode)
+		if center is None:
+			self._center.append((numpy.nan, numpy.nan, numpy.nan))
+		else:
+			self._center.append(center)
+		self._points.extend(xyz)
+		self._offset.append(len(self._points))
+
+	#----------------------------------------------------------------------
+	# Convert the collected rows to arrays and calculate lengths and times
+	#----------------------------------------------------------------------
+	def close(self):
+		n = len(self._lid)
+		self.lid     = numpy.array(self._lid,    dtype=numpy.int32)
+		self.gcode   = numpy.array(self._gcode,  dtype=numpy.int16)
+		self.feed    = numpy.array(self._feed,   dtype=numpy.float64)
+		self.feedmode= numpy.array(self._mode,   dtype=numpy.int16)
+		self.center  = numpy.array(self._center, dtype=numpy.float64).reshape(n,3)
+		self.points  = numpy.array(self._points, dtype=numpy.float64).reshape(-1,3)
+		self.offset  = numpy.array(self._offset, dtype=numpy.int64)
+		del self._lid, self._gcode, self._feed, self._mode
+		del self._center, self._points, self._offset
+
+		self.start   = self.points[self.offset[:-1]]
+		self.end     = self.points[self.offset[1:]-1]
+
+		# Length of every row as the sum of its polyline segments
+		if n:
+			d = numpy.sqrt((numpy.diff(self.points, axis=0)**2).sum(axis=1))
+			csum = numpy.concatenate(([0.0], numpy.cumsum(d)))
+			self.length = csum[self.offset[1:]-1] - csum[self.offset[:-1]]
+		else:
+			self.length = numpy.zeros(0)
+
+		# Time as CNC.pathLength() does, rapids with feedmax_x
+		self.time = numpy.zeros(n)
+		rapid = self.gcode==0
+		self.time[rapid] = self.length[rapid] / CNC.feedmax_x
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			normal  = (~rapid) & (self.feedmode==94) & (self.feed!=0.0)
+			inverse = (~rapid) & (self.feedmode==93)
+			self.time[normal]  = self.length[normal] / self.feed[normal]
+			self.time[inverse] = self.length[inverse] * self.feed[inverse]
+
+	#----------------------------------------------------------------------
+	# @return the polyline of row k
+	#----------------------------------------------------------------------
+	def polyline(self, k):
+		return self.points[self.offset[k]:self.offset[k+1]]
+
+	#----------------------------------------------------------------------
+	# @return (xmin,ymin,zmin), (xmax,ymax,zmax) of the cutting motions
+	#	  or None if there are no cutting motions
+	#----------------------------------------------------------------------
+	def margins(self):
+		cut = (self.gcode>=1) & (self.gcode<=3)
+		if not cut.any(): return None
+		counts = self.offset[1:] - self.offset[:-1]
+		pts = self.points[numpy.repeat(cut, counts)]
+		return pts.min(axis=0), pts.max(axis=0)
+
+	#----------------------------------------------------------------------
+	# Update the block statistics from the segments
+	#----------------------------------------------------------------------
+	def updateBlock(self, block):
+		rapid = self.gcode==0
+		block.length = float(self.length[~rapid].sum())
+		block.rapid  = float(self.length[rapid].sum())
+		block.time   = float(self.time.sum())
+		m = self.margins()
+		if m is not None:
+			block.xmin, block.ymin, block.zmin = [float(x) for x in m[0]]
+			block.xmax, block.ymax, block.zmax = [float(x) for x in m[1]]
+		if self.first is not None:
+			block.startPath(*self.first)
+		block.endPath(*self.exit[:3])
+
+	#----------------------------------------------------------------------
+	# Concatenate the toolpaths of several blocks into a single store with
+	# an additional bid column
+	#----------------------------------------------------------------------
+	@staticmethod
+	def concatenate(toolpaths, bids):
+		tp = Toolpath()
+		for name in ("lid","gcode","feed","feedmode","center","start","end",
+				"length","time"):
+			setattr(tp, name, numpy.concatenate([getattr(t,name) for t in toolpaths]))
+		tp.bid = numpy.repeat(numpy.array(bids, dtype=numpy.int32),
+				[len(t) for t in toolpaths])
+		tp.points = numpy.concatenate([t.points for t in toolpaths])
+		shift = numpy.cumsum([0]+[len(t.points) for t in toolpaths[:-1]])
+		tp.offset = numpy.concatenate([[0]]+[t.offset[1:]+s
+				for t,s in zip(toolpaths,shift)])
+		return tp
+
+
 #===============================================================================
 # Block of g-code commands. A gcode file is represented as a list of blocks
 # - Commands are grouped as (non motion commands Mxxx)
@@ -1928,6 +2831,13 @@ class CNC:
 #	- (imported shape)
 #===============================================================================
 class Block(list):
+	# attributes saved in the cache file
+	CACHED = ("_name", "enable", "expand", "color",
+		  "xmin", "ymin", "zmin", "xmax", "ymax", "zmax",
+		  "length", "rapid", "time",
+		  "sx", "sy", "sz", "ex", "ey", "ez")
+	_UNSET = object()	# parse cache slot not computed yet
+
 	def __init__(self, name=None):
 		# Copy constructor
 		if isinstance(name, Block):
@@ -1938,6 +2848,8 @@ class Block(list):
 		self.expand   = False		# Expand in editor
 		self.color    = None		# Custom color for path
 		self._path    = []		# canvas drawing paths
+		self._cmds    = []		# parse cache parallel to lines
+		self.toolpath = None		# motion segments from simulation
 		self.sx = self.sy = self.sz = 0	# start  coordinates
 						# (entry point first non rapid motion)
 		self.ex = self.ey = self.ez = 0	# ending coordinates
@@ -1951,6 +2863,8 @@ class Block(list):
 		self.color  = src.color
 		self[:]     = src[:]
 		self._path  = []
+		self._cmds  = src._cmds[:]
+		self.toolpath = None
 		self.sx = src.sx
 		self.sy = src.sy
 		self.sz = src.sz
@@ -1958,6 +2872,18 @@ class Block(list):
 		self.ey = src.ey
 		self.ez = src.ez
 
+	#----------------------------------------------------------------------
+	# @return a copy of the lines to check later with changed()
+	#----------------------------------------------------------------------
+	def snapshot(self):
+		return self[:]
+
+	#----------------------------------------------------------------------
+	# @return True if the lines differ from a previous snapshot()
+	#----------------------------------------------------------------------
+	def changed(self, snapshot):
+		return self != snapshot
+
 	#----------------------------------------------------------------------
 	def name(self):
 		return self._name is None and "block" or self._name
@@ -2135,6 +3061,90 @@ class Block(list):
 			if pat: self._name = pat.group(1)
 		list.append(self, line)
 
+	#----------------------------------------------------------------------
+	# Parse cache entry for line lid as [line, compiled, commands, comment,
+	# parsed]. Entries are validated against the line they were created
+	# from, so lines modified directly and not through the GCode undo
+	# setters are re-parsed on the next access
+	#----------------------------------------------------------------------
+	def _cache(self, lid):
+		if lid < 0: lid += len(self)
+		line = self[lid]
+		cache = self._cmds
+		if lid >= len(cache):
+			cache.extend([None]*(len(self)-len(cache)))
+		entry = cache[lid]
+		if entry is None or entry[0] is not line:
+			cmds = CNC.compileLine(line)
+			if isinstance(cmds, str):
+				broken = CNC.breakLine(cmds)
+			else:
+				broken = None
+			entry = [line, cmds, broken, CNC.comment, Block._UNSET]
+			# "%if running" depends on the running state, don't keep it
+			if not line.lstrip().startswith("%if"):
+				cache[lid] = entry
+		else:
+			CNC.comment = entry[3]
+		return entry
+
+	#----------------------------------------------------------------------
+	# @return CNC.compileLine() of line lid using the cache
+	#----------------------------------------------------------------------
+	def compileLine(self, lid):
+		cmds = self._cache(lid)[1]
+		if isinstance(cmds, list):
+			# evaluate() replaces the expressions in place
+			return cmds[:]
+		return cmds
+
+	#----------------------------------------------------------------------
+	# @return the commands of line lid as CNC.breakLine(CNC.compileLine())
+	#	  or None if the line is not a plain g-code line.
+	#	  WARNING: the list is shared with the cache, do not modify it
+	#----------------------------------------------------------------------
+	def breakLine(self, lid):
+		return self._cache(lid)[2]
+
+	#----------------------------------------------------------------------
+	# @return CNC.parseLine() of line lid using the cache
+	#----------------------------------------------------------------------
+	def parseLine(self, lid):
+		entry = self._cache(lid)
+		if entry[4] is Block._UNSET:
+			entry[4] = CNC.parseLine(entry[0])
+		return entry[4]
+
+	#----------------------------------------------------------------------
+	# Invalidate the parse cache of line lid or of the whole block
+	#----------------------------------------------------------------------
+	def invalidate(self, lid=None):
+		if lid is None:
+			del self._cmds[:]
+		elif lid < len(self._cmds):
+			self._cmds[lid] = None
+
+	#----------------------------------------------------------------------
+	# Keep the parse cache aligned when lines are inserted, deleted or swapped
+	#----------------------------------------------------------------------
+	def _cacheInsert(self, lid):
+		if lid < len(self._cmds):
+			self._cmds.insert(lid, None)
+
+	#----------------------------------------------------------------------
+	def _cacheDelete(self, lid):
+		if lid < len(self._cmds):
+			del self._cmds[lid]
+
+	#----------------------------------------------------------------------
+	def _cacheSwap(self, a, b):
+		cache = self._cmds
+		if a < len(cache) and b < len(cache):
+			cache[a], cache[b] = cache[b], cache[a]
+		else:
+			self.invalidate(a)
+			self.invalidate(b)
+
 	#----------------------------------------------------------------------
 	def resetPath(self):
 		del self._path[:]
@@ -2181,11 +3191,271 @@ class Block(list):
 		self.zmax = max(self.zmax, max([i[2] for i in xyz]))
 
 
+#===============================================================================
+# Block whose lines stay in a memory mapped file until they are accessed.
+# The block knows only the byte range and the number of its lines. Any read
+# access loads the lines, any modification detaches the block from the file
+# and turns it to a normal one.
+#===============================================================================
+class LazyBlock(Block):
+	def __init__(self, name=None, mm=None):
+		Block.__init__(self, name)
+		self._mm     = mm		# memory map, None once modified
+		self._start  = None		# byte range of the lines
+		self._end    = None
+		self._nlines = 0
+		self._loaded = False
+
+	#----------------------------------------------------------------------
+	# Add the line read from range start:end of the file while loading
+	#----------------------------------------------------------------------
+	def addLine(self, line, start, end):
+		if line.startswith("(Block-"):
+			pat = BLOCKPAT.match(line)
+			if pat and pat.group(1) != "X":
+				# header line, sets only the attributes
+				Block.append(self, line)
+				return
+		if self._name is None and ("id:" in line) and ("End" not in line):
+			pat = IDPAT.match(line)
+			if pat: self._name = pat.group(1)
+		self.addRange(start, end, 1)
+
+	#----------------------------------------------------------------------
+	# Add a range of nlines lines
+	#----------------------------------------------------------------------
+	def addRange(self, start, end, nlines):
+		if self._start is None: self._start = start
+		self._end = end
+		self._nlines += nlines
+
+	#----------------------------------------------------------------------
+	# Read the lines from the file
+	#----------------------------------------------------------------------
+	def _load(self):
+		if self._loaded or self._mm is None: return
+		self._loaded = True
+		if self._start is None: return
+		data = self._mm[self._start:self._end]
+		if not isinstance(data, str):
+			data = data.decode(locale.getpreferredencoding(False), "replace")
+		lines = data.split("\n")
+		if lines[-1]:
+			# last line of file without a new line, as in GCode.load
+			lines[-1] = lines[-1][:-1]
+		else:
+			del lines[-1]
+		for line in lines:
+			Block.append(self, line.replace("\x0d",""))
+
+	#----------------------------------------------------------------------
+	# Detach from the file before any modification
+	#----------------------------------------------------------------------
+	def _detach(self):
+		self._load()
+		self._mm = None
+
+	#----------------------------------------------------------------------
+	# @return True if the lines are still the ones in the file
+	#----------------------------------------------------------------------
+	def isLazy(self):
+		return self._mm is not None
+
+	#----------------------------------------------------------------------
+	# Forget the loaded lines if the block is not modified
+	#----------------------------------------------------------------------
+	def release(self):
+		if self._mm is None or not self._loaded: return
+		list.__delitem__(self, slice(None))
+		del self._cmds[:]
+		self._loaded = False
+
+	#----------------------------------------------------------------------
+	def snapshot(self):
+		if self._mm is not None:
+			return (self._mm, self._start, self._end)
+		return Block.snapshot(self)
+
+	#----------------------------------------------------------------------
+	def changed(self, snapshot):
+		if self._mm is not None:
+			return snapshot != (self._mm, self._start, self._end)
+		return Block.changed(self, snapshot)
+
+	#----------------------------------------------------------------------
+	def dump(self):
+		return self.name(), self.enable, self.expand, self.color, self[:]
+
+	#----------------------------------------------------------------------
+	def __len__(self):
+		if self._mm is not None and not self._loaded:
+			return self._nlines
+		return list.__len__(self)
+
+	def __iter__(self):
+		self._load()
+		return list.__iter__(self)
+
+	def __reversed__(self):
+		self._load()
+		return list.__reversed__(self)
+
+	def __getitem__(self, item):
+		self._load()
+		return list.__getitem__(self, item)
+
+	def __getslice__(self, i, j):
+		self._load()
+		return list.__getslice__(self, i, j)
+
+	def __contains__(self, item):
+		self._load()
+		return list.__contains__(self, item)
+
+	def __eq__(self, other):
+		self._load()
+		return list.__eq__(self, other)
+
+	def __ne__(self, other):
+		self._load()
+		return list.__ne__(self, other)
+
+	__hash__ = None
+
+	def __add__(self, other):
+		self._load()
+		return list.__add__(self, other)
+
+	def __mul__(self, n):
+		self._load()
+		return list.__mul__(self, n)
+
+	def __repr__(self):
+		self._load()
+		return list.__repr__(self)
+
+	def index(self, *args):
+		self._load()
+		return list.index(self, *args)
+
+	def count(self, item):
+		self._load()
+		return list.count(self, item)
+
+	def __setitem__(self, item, value):
+		self._detach()
+		return list.__setitem__(self, item, value)
+
+	def __setslice__(self, i, j, value):
+		self._detach()
+		return list.__setslice__(self, i, j, value)
+
+	def __delitem__(self, item):
+		self._detach()
+		return list.__delitem__(self, item)
+
+	def __delslice__(self, i, j):
+		self._detach()
+		return list.__delslice__(self, i, j)
+
+	def __iadd__(self, other):
+		self._detach()
+		return list.__iadd__(self, other)
+
+	def __imul__(self, n):
+		self._detach()
+		return list.__imul__(self, n)
+
+	def append(self, line):
+		self._detach()
+		Block.append(self, line)
+
+	def extend(self, lines):
+		self._detach()
+		list.extend(self, lines)
+
+	def insert(self, i, line):
+		self._detach()
+		list.insert(self, i, line)
+
+	def pop(self, *args):
+		self._detach()
+		return list.pop(self, *args)
+
+	def remove(self, item):
+		self._detach()
+		list.remove(self, item)
+
+	def reverse(self):
+		self._detach()
+		list.reverse(self)
+
+	def sort(self, *args, **kwargs):
+		self._detach()
+		list.sort(self, *args, **kwargs)
+
+
+#===============================================================================
+# Autolevel moves queued by GCode.compile() and expanded lazily by the sender
+# just before writing them to the serial. The moves are expanded in chunks of
+# CHUNK moves to use the vectorized splitting of the probe
+#===============================================================================
+class AutolevelBatch:
+	CHUNK = 256
+
+	def __init__(self, gcode):
+		self.gcode    = gcode
+		self.moves    = []
+		self.expanded = {}	# index: lines of the already expanded moves
+
+	#-----------------------------------------------------------------------
+	# @return the lazy item to queue for the move
+	#-----------------------------------------------------------------------
+	def add(self, move):
+		self.moves.append(move)
+		return AutolevelMove(self, len(self.moves)-1)
+
+	#-----------------------------------------------------------------------
+	# @return the autolevel lines of move index
+	#-----------------------------------------------------------------------
+	def lines(self, index):
+		try:
+			return self.expanded.pop(index)
+		except KeyError:
+			pass
+		moves = self.moves[index:index+AutolevelBatch.CHUNK]
+		for i,lines in enumerate(self.gcode.autolevelMoves(moves)):
+			self.expanded[index+i] = lines
+			self.moves[index+i] = None	# release memory
+		return self.expanded.pop(index)
+
+
+#-------------------------------------------------------------------------------
+class AutolevelMove:
+	__slots__ = ("batch", "index")
+
+	def __init__(self, batch, index):
+		self.batch = batch
+		self.index = index
+
+	#-----------------------------------------------------------------------
+	def lines(self):
+		return self.batch.lines(self.index)
+
+
 #===============================================================================
 # Gcode file
 #===============================================================================
 class GCode:
 	LOOP_MERGE = False
+	LAZY_SIZE  = 32*1024*1024	# load lazily files bigger than this
+	PARALLEL_SIZE = 4*1024*1024	# load in parallel files bigger than this
+	CACHE      = True		# cache the parsed and simulated big files
+	CACHE_SIZE = 1024*1024		# for files bigger than this, up to LAZY_SIZE
+	CACHE_LIMIT = 256*1024*1024	# size of the cache directory
+	CACHE_HASH = 1024*1024		# bytes hashed at both ends of the file
+	CACHE_DIR  = os.path.expanduser("~/.bCNC.cache")
+	CACHE_VERSION = 3
 
 	#----------------------------------------------------------------------
 	def __init__(self):
@@ -2203,11 +3473,18 @@ class GCode:
 		self.filename = ""
 		self.blocks   = []		# list of blocks
 		self.vars.clear()
+		self._exprCache = {}	# expression -> (vars version, result)
+		self._varsVersion = 0	# incremented when local vars may change
 		self.undoredo.reset()
 #		self.probe.init()
 
 		self._lastModified = 0
 		self._modified = False
+		self._simKey    = None	# simulation reuse key
+		self._cacheSave = False	# save the cache after the next simulation
+		self._mmap      = None	# memory map of a lazy loaded file
+		self._mmapFile  = None	# private copy of the file mapped
+		self._lineRange = None
 
 	#----------------------------------------------------------------------
 	# Recalculate enabled path margins
@@ -2245,11 +3522,7 @@ class GCode:
 		elif isinstance(line,list):
 			for i,expr in enumerate(line):
 				if isinstance(expr, types.CodeType):
-					result = eval(expr,CNC.vars,self.vars)
-					if isinstance(result,float):
-						line[i] = str(round(result,CNC.digits))
-					else:
-						line[i] = str(result)
+					line[i] = self.evaluateExpr(expr)
 			return "".join(line)
 
 		elif isinstance(line, types.CodeType):
@@ -2258,11 +3531,35 @@ class GCode:
 			v = self.vars
 			v['os'] = os
 			v['app'] = app
+			self._varsVersion += 1
 			return eval(line,CNC.vars,self.vars)
 
 		else:
 			return line
 
+	#----------------------------------------------------------------------
+	# Evaluate an expression of a gcode line and return it formatted.
+	# Expressions referencing only local variables (#nnn) with plain data
+	# values are cached until the local variables could have changed,
+	# which is whenever a code line (assignment) is executed
+	#----------------------------------------------------------------------
+	def evaluateExpr(self, expr):
+		cached = self._exprCache.get(expr)
+		if cached is not None and cached[0] == self._varsVersion:
+			return cached[1]
+
+		result = CNC.formatResult(eval(expr,CNC.vars,self.vars))
+
+		for name in expr.co_names:
+			if name in self.vars:
+				if not isinstance(self.vars[name], DATATYPES): return result
+			elif name not in PUREFUNCS or name in CNC.vars:
+				return result
+		for const in expr.co_consts:
+			if isinstance(const, types.CodeType): return result
+		self._exprCache[expr] = (self._varsVersion, result)
+		return result
+
 	#----------------------------------------------------------------------
 	# add new line to list create block if necessary
 	#----------------------------------------------------------------------
@@ -2273,7 +3570,7 @@ class GCode:
 			if pat:
 				value = pat.group(2).strip()
 				if not self.blocks or len(self.blocks[-1]):
-					self.blocks.append(Block(value))
+					self.blocks.append(self._newBlock(value))
 				else:
 					self.blocks[-1]._name = value
 				return
@@ -2291,29 +3588,48 @@ class GCode:
 				print("WARNING: Converted legacy tabs loaded from file to new g-code island tabs: %s"%(tablock._name))
 
 		if not self.blocks:
-			self.blocks.append(Block("Header"))
+			self.blocks.append(self._newBlock("Header"))
 
 		cmds = CNC.parseLine(line)
 		if cmds is None:
-			self.blocks[-1].append(line)
+			self._appendLine(line)
 			return
 
 		self.cnc.motionStart(cmds)
 
 		# rapid move up = end of block
 		if self._blocksExist:
-			self.blocks[-1].append(line)
+			self._appendLine(line)
 		elif self.cnc.gcode == 0 and self.cnc.dz > 0.0:
-			self.blocks[-1].append(line)
-			self.blocks.append(Block())
+			self._appendLine(line)
+			self.blocks.append(self._newBlock())
 		elif self.cnc.gcode == 0 and len(self.blocks)==1:
-			self.blocks.append(Block())
-			self.blocks[-1].append(line)
+			self.blocks.append(self._newBlock())
+			self._appendLine(line)
 		else:
-			self.blocks[-1].append(line)
+			self._appendLine(line)
 
 		self.cnc.motionEnd()
 
+	#----------------------------------------------------------------------
+	# Create a new block, lazy when loading from a memory map
+	#----------------------------------------------------------------------
+	def _newBlock(self, name=None):
+		if self._mmap is None:
+			return Block(name)
+		return LazyBlock(name, self._mmap)
+
+	#----------------------------------------------------------------------
+	# Append line to the last block. When loading from a memory map only
+	# the byte range self._lineRange of the line is kept
+	#----------------------------------------------------------------------
+	def _appendLine(self, line):
+		block = self.blocks[-1]
+		if self._lineRange is not None and isinstance(block, LazyBlock):
+			block.addLine(line, *self._lineRange)
+		else:
+			block.append(line)
+
 	#----------------------------------------------------------------------
 	# Load a file into editor
 	#----------------------------------------------------------------------
@@ -2321,8 +3637,38 @@ class GCode:
 		if filename is None: filename = self.filename
 		self.init()
 		self.filename = filename
-		try: f = open(self.filename,"r")
+		try:
+			size = os.path.getsize(self.filename)
+			# files loaded lazily are not cached, loading them scans only
+			# the block boundaries and the lines stay in the file
+			cache = GCode.CACHE and GCode.CACHE_SIZE < size <= GCode.LAZY_SIZE
+			if cache and self.loadCache():
+				return True
+			if size > GCode.LAZY_SIZE:
+				ok = self.loadLazy()
+			elif size > GCode.PARALLEL_SIZE and numpy is not None \
+			     and multiprocessing.cpu_count() > 1:
+				try:
+					ok = self.loadParallel()
+				except Exception:
+					ok = False
+				if not ok:
+					# process pool not available, load serially
+					self.init()
+					self.filename = filename
+					ok = self.loadFile()
+			else:
+				ok = self.loadFile()
 		except: return False
+		# saved by the simulation drawing the file
+		self._cacheSave = ok and cache
+		return ok
+
+	#----------------------------------------------------------------------
+	# Load the file line by line
+	#----------------------------------------------------------------------
+	def loadFile(self):
+		f = open(self.filename,"r")
 		self._lastModified = os.stat(self.filename).st_mtime
 		self.cnc.initPath()
 		self.cnc.resetAllMargins()
@@ -2333,11 +3679,243 @@ class GCode:
 		f.close()
 		return True
 
+	#----------------------------------------------------------------------
+	# @return the name of the cache file of the loaded file
+	#----------------------------------------------------------------------
+	def _cacheFilename(self):
+		name = os.path.abspath(self.filename)
+		if not isinstance(name, bytes): name = name.encode("utf-8")
+		return os.path.join(GCode.CACHE_DIR,
+				"%s.bcnc"%(hashlib.md5(name).hexdigest()))
+
+	#----------------------------------------------------------------------
+	# @return the key validating the cache: version, size and modification
+	#	  time of the file and the md5 of its first and last CACHE_HASH
+	#	  bytes, to catch a new version of the same size saved within
+	#	  the resolution of the modification time (2s on FAT)
+	#----------------------------------------------------------------------
+	def _cacheKey(self):
+		f = open(self.filename,"rb")
+		try:
+			st = os.fstat(f.fileno())
+			md5 = hashlib.md5(f.read(GCode.CACHE_HASH))
+			if st.st_size > GCode.CACHE_HASH:
+				f.seek(max(GCode.CACHE_HASH, st.st_size-GCode.CACHE_HASH))
+				md5.update(f.read(GCode.CACHE_HASH))
+		finally:
+			f.close()
+		return (GCode.CACHE_VERSION, st.st_size, st.st_mtime, md5.hexdigest())
+
+	#----------------------------------------------------------------------
+	# Load blocks, statistics and toolpaths from the cache file if valid
+	# @return True on success
+	#----------------------------------------------------------------------
+	def loadCache(self):
+		filename = self._cacheFilename()
+		try:
+			f = open(filename,"rb")
+		except IOError:
+			return False
+		try:
+			if pickle.load(f) != self._cacheKey():
+				return False
+			simKey, blocks = pickle.load(f)
+		except:
+			return False
+		finally:
+			f.close()
+
+		# mark it as recently used
+		try: os.utime(filename, None)
+		except OSError: pass
+		for lines, attrs, tp in blocks:
+			block = Block()
+			list.extend(block, lines)
+			block.__dict__.update(attrs)
+			if tp is not None:
+				tp.lines = block.snapshot()
+			block.toolpath = tp
+			self.blocks.append(block)
+		self._lastModified = os.stat(self.filename).st_mtime
+		self._simKey = simKey
+		return True
+
+	#----------------------------------------------------------------------
+	# Save the blocks, statistics and toolpaths to the cache file
+	#----------------------------------------------------------------------
+	def saveCache(self):
+		blocks = []
+		for block in self.blocks:
+			attrs = dict([(n,getattr(block,n)) for n in Block.CACHED])
+			tp = block.toolpath
+			if tp is not None:
+				tp = copy(tp)
+				tp.lines = None
+			blocks.append((list(block), attrs, tp))
+
+		try:
+			if not os.path.isdir(GCode.CACHE_DIR):
+				os.makedirs(GCode.CACHE_DIR)
+			filename = self._cacheFilename()
+			f = open(filename+".tmp","wb")
+			pickle.dump(self._cacheKey(), f, pickle.HIGHEST_PROTOCOL)
+			pickle.dump((self._simKey, blocks), f, pickle.HIGHEST_PROTOCOL)
+			f.close()
+			if os.path.exists(filename): os.remove(filename)
+			os.rename(filename+".tmp", filename)
+		except (IOError, OSError):
+			return
+		GCode._pruneCache()
+
+	#----------------------------------------------------------------------
+	# Remove the least recently used cache files to keep the cache
+	# directory within CACHE_LIMIT bytes
+	#----------------------------------------------------------------------
+	@staticmethod
+	def _pruneCache():
+		files = []
+		total = 0
+		try:
+			for name in os.listdir(GCode.CACHE_DIR):
+				if not name.endswith(".bcnc"): continue
+				path = os.path.join(GCode.CACHE_DIR, name)
+				st = os.stat(path)
+				files.append((st.st_mtime, st.st_size, path))
+				total += st.st_size
+		except OSError:
+			return
+		files.sort()
+		for mtime, size, path in files:
+			if total <= GCode.CACHE_LIMIT: break
+			try: os.remove(path)
+			except OSError: pass
+			total -= size
+
+	#----------------------------------------------------------------------
+	# Load the file splitting it in chunks that are parsed and simulated in
+	# a process pool, each chunk assuming the initial modal state. The
+	# chunks are stitched in order: the head of each chunk is re-parsed
+	# with the correct state until a block boundary is found where the
+	# state assumed by the worker matches, from there on the worker blocks
+	# and toolpaths are used as they are. Toolpaths still starting from a
+	# wrong state are re-simulated by the next simulate()
+	#----------------------------------------------------------------------
+	def loadParallel(self, processes=None):
+		f = open(self.filename,"r")
+		lines = f.read().split("\n")
+		f.close()
+		self._lastModified = os.stat(self.filename).st_mtime
+		if lines[-1]:
+			# last line without a new line, as in load()
+			lines[-1] = lines[-1][:-1]
+		else:
+			del lines[-1]
+		lines = [x.replace("\x0d","") for x in lines]
+
+		if processes is None: processes = multiprocessing.cpu_count()
+		step = (len(lines)+processes-1)//processes or 1
+		chunks = [lines[i:i+step] for i in range(0, len(lines), step)]
+		settings = _loadSettings()
+		seeds = _loadSeeds(chunks)
+		pool = multiprocessing.Pool(processes)
+		try:
+			results = pool.map(loadworker.loadChunk,
+					[(c,settings,seed) for c,seed in zip(chunks,seeds)])
+		finally:
+			pool.close()
+			pool.join()
+
+		self.cnc.initPath()
+		self.cnc.resetAllMargins()
+		self._blocksExist = False
+		for chunk,(blocks,bounds,final) in zip(chunks,results):
+			b = 0
+			for i,line in enumerate(chunk):
+				n = len(self.blocks)
+				self._addLine(line)
+				if len(self.blocks) == n or len(self.blocks[-1]): continue
+
+				# new block started, check the worker state at this line.
+				# The feed does not change the blocks, the toolpaths
+				# of a wrong feed are simulated again by simulate()
+				while b < len(bounds) and bounds[b][0] < i+1: b += 1
+				if b < len(bounds) and bounds[b][0] == i+1 \
+				   and bounds[b][2] == self._blocksExist \
+				   and CNC.sameState(bounds[b][3], self.cnc.saveState(), False):
+					self.blocks.pop()
+					self.blocks.extend(blocks[bounds[b][1]:])
+					self._blocksExist = final[0]
+					self.cnc.restoreState(final[1])
+					break
+		self._trim()
+		self._simKey = self._simulateKey()
+		return True
+
+	#----------------------------------------------------------------------
+	# Load a big file by memory mapping it. The blocks are split as in load()
+	# but keep only the byte range of their lines, which are read when the
+	# block is accessed. Once the block names are found in the file the
+	# lines are not parsed anymore, only the block boundaries are searched.
+	# The map is of a private temporary copy of the file: the file can be
+	# overwritten or truncated (e.g. exported again from the CAM) while it
+	# is open, without locking it or invalidating the lines not read yet
+	#----------------------------------------------------------------------
+	def loadLazy(self):
+		f = open(self.filename,"rb")
+		self._lastModified = os.fstat(f.fileno()).st_mtime
+		tmp = tempfile.TemporaryFile(prefix="bCNC")
+		try:
+			shutil.copyfileobj(f, tmp, 1<<20)
+		finally:
+			f.close()
+		tmp.flush()
+		try:
+			self._mmap = mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			# empty file
+			tmp.close()
+			return True
+		self._mmapFile = tmp
+		self.cnc.initPath()
+		self.cnc.resetAllMargins()
+		self._blocksExist = False
+		mm = self._mmap
+		size = len(mm)
+		encoding = locale.getpreferredencoding(False)
+		pos = 0
+		while pos < size:
+			end = mm.find(b"\n", pos)
+			if end < 0: end = size
+			else: end += 1
+			line = mm[pos:end]
+			if not isinstance(line, str):
+				line = line.decode(encoding, "replace")
+			line = line[:-1].replace("\x0d","")
+			self._lineRange = (pos, end)
+			self._addLine(line)
+			pos = end
+			if self._blocksExist and not line.startswith("(Block-"):
+				# Skip parsing until the next block name
+				pat = BLOCKNAMEPAT.search(mm, pos)
+				nxt = pat and pat.start() or size
+				if nxt > pos:
+					n = 0
+					for i in range(pos, nxt, 1<<24):
+						n += mm[i:min(i+(1<<24),nxt)].count(b"\n")
+					if mm[nxt-1:nxt] != b"\n": n += 1
+					n -= len(HEADERPAT.findall(mm, pos, nxt))
+					self.blocks[-1].addRange(pos, nxt, n)
+					pos = nxt
+		self._lineRange = None
+		self._trim()
+		return True
+
 	#----------------------------------------------------------------------
 	# Save to a file
 	#----------------------------------------------------------------------
 	def save(self, filename=None):
 		if filename is not None: self.filename = filename
+		self._unmap()
 		try:
 			f = open(self.filename,"w")
 		except:
@@ -2350,6 +3928,20 @@ class GCode:
 		self._modified = False
 		return True
 
+	#----------------------------------------------------------------------
+	# Read all lazy blocks and release the memory map, before the file
+	# is overwritten
+	#----------------------------------------------------------------------
+	def _unmap(self):
+		if self._mmap is None: return
+		for block in self.blocks:
+			if isinstance(block, LazyBlock):
+				block._detach()
+		self._mmap.close()
+		self._mmap = None
+		self._mmapFile.close()
+		self._mmapFile = None
+
 	#----------------------------------------------------------------------
 	# Save in TXT format
 	# -Enabled Blocks only
@@ -2360,8 +3952,8 @@ class GCode:
 		txt = open(filename, 'w')
 		for block in self.blocks:
 			if block.enable:
-				for line in block:
-					cmds = CNC.parseLine(line)
+				for lid,line in enumerate(block):
+					cmds = block.parseLine(lid)
 					if cmds is None: continue
 					txt.write("%s\n"%line.upper())
 		txt.close()
@@ -2481,8 +4073,8 @@ class GCode:
 		for block in self.blocks:
 			name = block.name()
 			if ":" in name: name = name.split(":")[0]
-			for line in block:
-				cmds = CNC.parseLine(line)
+			for lid in range(len(block)):
+				cmds = block.parseLine(lid)
 				if cmds is None: continue
 				self.cnc.motionStart(cmds)
 				if self.cnc.gcode == 1:	# line
@@ -2595,8 +4187,8 @@ class GCode:
 			firstx, firsty = None, None
 
 			#Write paths
-			for line in block:
-				cmds = CNC.parseLine(line)
+			for lid in range(len(block)):
+				cmds = block.parseLine(lid)
 				if cmds is None: continue
 				self.cnc.motionStart(cmds)
 
@@ -2976,8 +4568,10 @@ class GCode:
 	# Change a single line in a block
 	#----------------------------------------------------------------------
 	def setLineUndo(self, bid, lid, line):
-		undoinfo = (self.setLineUndo, bid, lid, self.blocks[bid][lid])
-		self.blocks[bid][lid] = line
+		block = self.blocks[bid]
+		undoinfo = (self.setLineUndo, bid, lid, block[lid])
+		block[lid] = line
+		block.invalidate(lid)
 		return undoinfo
 
 	#----------------------------------------------------------------------
@@ -2990,6 +4584,7 @@ class GCode:
 			block.append(line)
 		else:
 			block.insert(lid, line)
+			block._cacheInsert(lid)
 		return undoinfo
 
 	#----------------------------------------------------------------------
@@ -3005,6 +4600,7 @@ class GCode:
 		block = self.blocks[bid]
 		undoinfo = (self.insLineUndo, bid, lid, block[lid])
 		del block[lid]
+		block._cacheDelete(lid)
 		return undoinfo
 
 	#----------------------------------------------------------------------
@@ -3189,6 +4785,7 @@ class GCode:
 		block = self.blocks[bid]
 		undoinfo = (self.setBlockLinesUndo, bid, block[:])
 		del block[:]
+		block.invalidate()
 		block.extend(lines)
 		return undoinfo
 
@@ -3200,6 +4797,7 @@ class GCode:
 		block = self.blocks[bid]
 		undoinfo = (self.orderDownLineUndo, bid, lid-1)
 		block.insert(lid-1, block.pop(lid))
+		block._cacheSwap(lid-1, lid)
 		return undoinfo
 
 	#----------------------------------------------------------------------
@@ -3210,22 +4808,114 @@ class GCode:
 		if lid>=len(block)-1: return None
 		undoinfo = (self.orderUpLineUndo, bid, lid+1)
 		block.insert(lid+1, block.pop(lid))
+		block._cacheSwap(lid, lid+1)
 		return undoinfo
 
+	#----------------------------------------------------------------------
+	# Return the autolevel move of the current motion as a tuple
+	# (g, extra, unit, xyz) to be expanded with autolevelMoves()
+	#----------------------------------------------------------------------
+	def autolevelMove(self, cmds, xyz, cnc=None):
+		if cnc is None: cnc = self.cnc
+		extra = ""
+		for c in cmds:
+			if c[0].upper() not in ('G','X','Y','Z','I','J','K','R'):
+				extra += c
+		if cnc.gcode == 0:
+			g = 0
+		else:
+			g = 1
+		return (g, extra, cnc.unit, xyz)
+
+	#----------------------------------------------------------------------
+	# Split and correct with the probe information a list of moves
+	# @return a list with the new lines of every move
+	#----------------------------------------------------------------------
+	def autolevelMoves(self, moves):
+		result = [[] for m in moves]
+		if not moves: return result
+
+		probe = self.probe
+		merge = probe.merge
+
+		if numpy is None:
+			for lines,(g,extra,unit,xyz) in zip(result, moves):
+				x1,y1,z1 = xyz[0]
+				for x2,y2,z2 in xyz[1:]:
+					points = probe.splitLine(x1,y1,z1,x2,y2,z2)
+					if merge > 0.0 and len(points) > 1:
+						anchor = (x1,y1,z1+probe.interpolate(x1,y1))
+						points = [points[k] for k in
+							Probe.mergeLine(anchor, points, merge)]
+					for x,y,z in points:
+						lines.append("G%d%s%s%s%s"%\
+							(g,
+							 self.fmt('X',x/unit),
+							 self.fmt('Y',y/unit),
+							 self.fmt('Z',z/unit),
+							 extra))
+						extra = ""
+					x1,y1,z1 = x2,y2,z2
+			return result
+
+		# all segments of all moves in a single call
+		start = []
+		end   = []
+		owner = []
+		for m,move in enumerate(moves):
+			xyz = move[3]
+			start.extend(xyz[:-1])
+			end.extend(xyz[1:])
+			owner.extend([m]*(len(xyz)-1))
+		points, seg = probe.splitSegments(start, end)
+
+		if merge > 0.0:
+			# merge the split points of every segment
+			start = numpy.asarray(start, dtype=numpy.float64)
+			anchors = start.copy()
+			anchors[:,2] += probe.interpolateArray(start[:,0], start[:,1])
+			anchors = anchors.tolist()
+			pts  = points.tolist()
+			keep = []
+			bounds = numpy.nonzero(numpy.diff(seg))[0] + 1
+			for a,b in zip([0]+bounds.tolist(), bounds.tolist()+[len(seg)]):
+				if b-a == 1:
+					keep.append(a)
+				else:
+					keep.extend([a+k for k in Probe.mergeLine(
+						anchors[seg[a]], pts[a:b], merge)])
+			points = points[keep]
+			seg    = seg[keep]
+
+		owner = numpy.array(owner, dtype=int)[seg]
+
+		fmt = self.fmt
+		for (x,y,z),m in zip(points.tolist(), owner.tolist()):
+			g,extra,unit,xyz = moves[m]
+			lines = result[m]
+			lines.append("G%d%s%s%s%s"%\
+				(g,
+				 fmt('X',x/unit),
+				 fmt('Y',y/unit),
+				 fmt('Z',z/unit),
+				 "" if lines else extra))
+		return result
+
 	#----------------------------------------------------------------------
 	# Expand block with autolevel information
 	#----------------------------------------------------------------------
 	def autolevelBlock(self, block):
 		new = []
+		moves = []		# autolevel moves to expand, None in new
 		autolevel = not self.probe.isEmpty()
-		for line in block:
+		for lid,line in enumerate(block):
 			newcmd = []
-			cmds = CNC.compileLine(line)
+			cmds = block.compileLine(lid)
 			if cmds is None:
 				new.append(line)
 				continue
 			elif isinstance(cmds,str):
-				cmds = CNC.breakLine(cmds)
+				cmds = block.breakLine(lid)
 			else:
 				new.append(line)
 				continue
@@ -3238,30 +4928,24 @@ class GCode:
 					# commands, just append the line as-is
 					new.append(line)
 				else:
-					extra = ""
-					for c in cmds:
-						if c[0].upper() not in ('G','X','Y','Z','I','J','K','R'):
-							extra += c
-					x1,y1,z1 = xyz[0]
-					if self.cnc.gcode == 0:
-						g = 0
-					else:
-						g = 1
-					for x2,y2,z2 in xyz[1:]:
-						for x,y,z in self.probe.splitLine(x1,y1,z1,x2,y2,z2):
-							new.append("G%d%s%s%s%s"%\
-								(g,
-								 self.fmt('X',x/self.cnc.unit),
-								 self.fmt('Y',y/self.cnc.unit),
-								 self.fmt('Z',z/self.cnc.unit),
-								 extra))
-							extra = ""
-						x1,y1,z1 = x2,y2,z2
+					moves.append(self.autolevelMove(cmds, xyz))
+					new.append(None)
 				self.cnc.motionEnd()
 			else:
 				self.cnc.motionEnd()
 				new.append(line)
-		return new
+
+		if not moves: return new
+
+		# Replace the placeholders with the expanded moves
+		expanded = iter(self.autolevelMoves(moves))
+		lines = []
+		for line in new:
+			if line is None:
+				lines.extend(next(expanded))
+			else:
+				lines.append(line)
+		return lines
 
 	#----------------------------------------------------------------------
 	# Execute autolevel on selected blocks
@@ -3376,12 +5060,223 @@ class GCode:
 	def initPath(self, bid=0):
 		if bid == 0:
 			self.cnc.initPath()
+		elif self.blocks[bid].toolpath is not None:
+			# Use the modal state checkpoint from the last simulation
+			self.cnc.initPath()
+			self.cnc.restoreState(self.blocks[bid].toolpath.entry)
 		else:
 			# Use the ending point of the previous block
 			# since the starting (sxyz is after the rapid motion)
 			block = self.blocks[bid-1]
 			self.cnc.initPath(block.ex, block.ey, block.ez)
 
+	#----------------------------------------------------------------------
+	# Simulate the whole file filling the Toolpath of every block and the
+	# block statistics and margins. Every toolpath keeps the cnc modal state
+	# at the entry and exit of its block. A block is re-simulated only if
+	# its lines or its entry state changed, or it contains expressions, so
+	# after editing a block only the blocks from it onward are simulated,
+	# until the exit state matches again the old checkpoint.
+	#
+	# check: optional function called every 1000 lines (e.g. to abort)
+	# @return the number of blocks re-simulated
+	#----------------------------------------------------------------------
+	def simulate(self, app=None, check=None):
+		key = self._simulateKey()
+		reuse = self._simKey == key
+		self._simKey = None
+
+		self.cnc.initPath()
+		self.cnc.resetAllMargins()
+		state = self.cnc.saveState()
+		count = 0
+		n = 1000
+		for i,block in enumerate(self.blocks):
+			block.resetPath()
+			tp = block.toolpath
+			# the first block starts from the machine position, compare
+			# all axes so that a jog re-simulates it (and what follows
+			# only if its exit state changes)
+			if reuse and tp is not None and not tp.volatile \
+			   and (tp.entry == state if i==0 else CNC.sameState(tp.entry, state)) \
+			   and not block.changed(tp.lines):
+				# Same lines and entry state, restore only the statistics
+				tp.updateBlock(block)
+				self._simulateTotals(block)
+				state = tp.exit
+				continue
+
+			count += 1
+			self.cnc.restoreState(state)
+			tp = Toolpath()
+			tp.lines = block.snapshot()
+			tp.entry = state
+			for j,line in enumerate(block):
+				n -= 1
+				if n==0:
+					if check is not None: check()
+					n = 1000
+				try:
+					cmd = block.compileLine(j)
+					if isinstance(cmd,str):
+						cmd = block.breakLine(j)
+					elif cmd is None or isinstance(cmd,tuple):
+						continue
+					else:
+						tp.volatile = True
+						cmd = self.evaluate(cmd, app)
+						if isinstance(cmd,tuple): continue
+						cmd = CNC.breakLine(cmd)
+				except:
+					sys.stderr.write(_(">>> ERROR: %s\n")%(str(sys.exc_info()[1])))
+					sys.stderr.write(_("     line: %s\n")%(line))
+					continue
+				if cmd is None: continue
+				self._simulateLine(tp, j, cmd)
+			tp.exit = state = self.cnc.saveState()
+			tp.close()
+			tp.updateBlock(block)
+			block.toolpath = tp
+			if isinstance(block, LazyBlock) and not block.expand:
+				block.release()
+			self._simulateTotals(block)
+		self.cnc.restoreState(state)
+		self._simKey = key
+		if self._cacheSave:
+			# first simulation of the file loaded
+			self._cacheSave = False
+			if not self._modified: self.saveCache()
+		return count
+
+	#----------------------------------------------------------------------
+	# @return the settings that invalidate all toolpaths when changed
+	# The machine position is not part of it, it only sets the entry
+	# state of the first block.
+	#----------------------------------------------------------------------
+	def _simulateKey(self):
+		return (CNC.feedmax_x, CNC.accuracy)
+
+	#----------------------------------------------------------------------
+	# Execute one broken line on the cnc and append its motion to tp
+	#----------------------------------------------------------------------
+	def _simulateLine(self, tp, lid, cmd):
+		cnc = self.cnc
+		cnc.motionStart(cmd)
+		xyz = cnc.motionPath()
+		if xyz:
+			mode = CNC.vars["feedmode"]
+			if mode not in (93,94): mode = 0
+			if cnc.gcode in (2,3):
+				uc,vc = cnc.motionCenter()
+				if cnc.plane == XY:
+					center = (uc, vc, cnc.z)
+				elif cnc.plane == XZ:
+					center = (uc, cnc.y, vc)
+				else:
+					center = (cnc.x, uc, vc)
+			else:
+				center = None
+			tp.add(lid, cnc.gcode, cnc.feed, mode, xyz, center)
+		cnc.motionEnd()
+		if tp.first is None and cnc.gcode in (1,2,3):
+			# Mark as start the first non-rapid motion
+			tp.first = (cnc.x, cnc.y, cnc.z)
+
+	#----------------------------------------------------------------------
+	# Accumulate the block statistics to the cnc totals and margins
+	#----------------------------------------------------------------------
+	def _simulateTotals(self, block):
+		self.cnc.totalLength += block.length + block.rapid
+		self.cnc.totalTime   += block.time
+		if block.xmin <= block.xmax:
+			self.cnc.pathMargins(block)
+
+	#----------------------------------------------------------------------
+	# @return a single Toolpath with the segments of all simulated blocks
+	#	  and an extra bid column
+	#----------------------------------------------------------------------
+	def segments(self):
+		bids = [i for i,b in enumerate(self.blocks) if b.toolpath is not None]
+		if not bids: return None
+		return Toolpath.concatenate([self.blocks[i].toolpath for i in bids], bids)
+
+	#----------------------------------------------------------------------
+	# Return the start and end points of the linear segments of all the
+	# feed moves (G1,G2,G3) of the enabled blocks, e.g. to limit probing
+	# to the area touched by the toolpath. None if numpy is missing
+	#----------------------------------------------------------------------
+	def cuttingSegments(self):
+		if numpy is None: return None
+		if any([b.toolpath is None for b in self.blocks]): self.simulate()
+		bids = [i for i,b in enumerate(self.blocks)
+				if b.enable and b.toolpath is not None]
+		if not bids: return numpy.zeros((0,3)), numpy.zeros((0,3))
+		seg = Toolpath.concatenate([self.blocks[i].toolpath for i in bids], bids)
+
+		# linear segments of the polylines of the feed rows
+		counts = seg.offset[1:] - seg.offset[:-1]
+		row  = numpy.repeat(numpy.arange(len(seg)), counts)
+		mask = seg.gcode[row] != 0
+		mask[seg.offset[1:]-1] = False
+		i = numpy.nonzero(mask)[0]
+		return seg.points[i], seg.points[i+1]
+
+	#----------------------------------------------------------------------
+	# Estimate the execution time with a model of the grbl planner, using
+	# the max rate ($110-$112), acceleration ($120-$122) and junction
+	# deviation ($11) read from the controller, or the configuration
+	# values if missing. Updates the block times and the cnc total time.
+	# Requires the blocks to be simulated first.
+	#
+	# @return the total time in minutes or None if not possible
+	#----------------------------------------------------------------------
+	def estimateTime(self):
+		if numpy is None or not self.blocks: return None
+		if any([b.toolpath is None for b in self.blocks]): return None
+		seg = self.segments()
+
+		# grbl settings are always in mm
+		scale = CNC.inch and 25.4 or 1.0
+		def setting(n, default):
+			try: return float(CNC.vars["grbl_%d"%(n)]) / scale
+			except (KeyError, ValueError, TypeError): return default
+		maxrate  = [setting(110, CNC.feedmax_x),
+			    setting(111, CNC.feedmax_y),
+			    setting(112, CNC.feedmax_z)]
+		accel    = [setting(120, CNC.acceleration_x),
+			    setting(121, CNC.acceleration_y),
+			    setting(122, CNC.acceleration_z)]
+		junction = setting(11, 0.01/scale)
+
+		# linear segments of the polylines of every row
+		counts = seg.offset[1:] - seg.offset[:-1]
+		row  = numpy.repeat(numpy.arange(len(seg)), counts-1)
+		mask = numpy.ones(len(seg.points), dtype=bool)
+		mask[seg.offset[1:]-1] = False
+		i = numpy.nonzero(mask)[0]
+
+		# requested feed of every row in units/min
+		feed = seg.feed.copy()
+		inverse = seg.feedmode==93
+		feed[inverse] = seg.length[inverse] * seg.feed[inverse]
+		feed[seg.gcode==0] = numpy.inf
+
+		# rows not starting from the end of the previous one start from rest
+		connected = numpy.ones(len(i), dtype=bool)
+		if len(seg) > 1:
+			jump = (seg.start[1:] != seg.end[:-1]).any(axis=1)
+			connected[(seg.offset[1:-1]-numpy.arange(1,len(seg)))[jump]] = False
+
+		t = planner.estimate(seg.points[i], seg.points[i+1], feed[row],
+				maxrate, accel, junction, connected)
+		rowtime = numpy.bincount(row, weights=t, minlength=len(seg))
+		blocktime = numpy.bincount(seg.bid, weights=rowtime,
+				minlength=len(self.blocks))
+		for block,bt in zip(self.blocks, blocktime):
+			block.time = float(bt)
+		self.cnc.totalTime = float(blocktime.sum())
+		return self.cnc.totalTime
+
 	#----------------------------------------------------------------------
 	# Move blocks/lines up
 	#----------------------------------------------------------------------
@@ -3490,7 +5385,7 @@ class GCode:
 			elif distance is None and number==0:
 				#Drill on path begining only
 				for i,line in enumerate(block):
-					cmds = CNC.parseLine(line)
+					cmds = block.parseLine(i)
 					if cmds is None:
 						lines.append(line)
 						continue
@@ -4268,8 +6163,8 @@ class GCode:
 
 		# Find starting location
 		self.initPath(bid)
-		for i,line in enumerate(block):
-			cmds = CNC.parseLine(line)
+		for i in range(len(block)):
+			cmds = block.parseLine(i)
 			if cmds is None: continue
 			self.cnc.motionStart(cmds)
 			self.cnc.motionEnd()
@@ -4298,7 +6193,7 @@ class GCode:
 			block = self.blocks[bid]
 
 			if isinstance(lid, int):
-				cmds = CNC.parseLine(block[lid])
+				cmds = block.parseLine(lid)
 				if cmds is None: continue
 				self.cnc.motionStart(cmds)
 
@@ -4567,6 +6462,53 @@ class GCode:
 	#----------------------------------------------------------------------
 	def optimize(self, items):
 		n = len(items)
+		if numpy is not None:
+			best = self._optimizeArray(items)
+		else:
+			best = self._optimizeLists(items)
+
+		undoinfo = []
+		for i in range(len(best)):
+			b = best[i]
+			if i==b: continue
+			ptr = best.index(i)
+			# swap i,b in items
+			undoinfo.append(self.swapBlockUndo(items[i], items[b]))
+			# swap i,ptr in best
+			best[i], best[ptr] = best[ptr], best[i]
+		self.addUndo(undoinfo, "Optimize")
+
+	#----------------------------------------------------------------------
+	# Nearest neighbor order of the blocks items, from the start and end
+	# points of their toolpaths
+	# @return the order as indices of items
+	#----------------------------------------------------------------------
+	def _optimizeArray(self, items):
+		if len(items) < 2: return list(range(len(items)))
+		if any([self.blocks[i].toolpath is None for i in items]):
+			self.simulate()
+		blocks = [self.blocks[i] for i in items]
+		start = numpy.array([(b.sx, b.sy) for b in blocks], dtype=numpy.float64)
+		end   = numpy.array([(b.ex, b.ey) for b in blocks], dtype=numpy.float64)
+		#Compensate for machines, which have different speed of X and Y:
+		d = (end[:,None,:] - start[None,:,:]) / [CNC.feedmax_x, CNC.feedmax_y]
+		matrix = numpy.hypot(d[...,0], d[...,1])
+
+		best = [0]
+		visited = numpy.zeros(len(items), dtype=bool)
+		visited[0] = True
+		for i in range(len(items)-1):
+			# from all the unvisited places search the closest one
+			row = numpy.where(visited, numpy.inf, matrix[best[-1]])
+			best.append(int(row.argmin()))
+			visited[best[-1]] = True
+		return best
+
+	#----------------------------------------------------------------------
+	# Same as _optimizeArray() without numpy
+	#----------------------------------------------------------------------
+	def _optimizeLists(self, items):
+		n = len(items)
 
 		matrix = []
 		for i in range(n):
@@ -4605,24 +6547,80 @@ class GCode:
 					si = i
 			best.append(unvisited.pop(si))
 		#print "best=",best
+		return best
 
-		undoinfo = []
-		for i in range(len(best)):
-			b = best[i]
-			if i==b: continue
-			ptr = best.index(i)
-			# swap i,b in items
-			undoinfo.append(self.swapBlockUndo(items[i], items[b]))
-			# swap i,ptr in best
-			best[i], best[ptr] = best[ptr], best[i]
-		self.addUndo(undoinfo, "Optimize")
+	#----------------------------------------------------------------------
+	# Compile the broken commands of a line to send, with the modal state
+	# cnc. Appends the feed, applies the autolevel when batch is not None
+	# and the expansion policies of the canned cycles and tool change
+	# @return list of items to queue (strings or autolevel moves) and True
+	#	  if the single item is the line itself, False for expansions
+	#----------------------------------------------------------------------
+	def compileCmds(self, cnc, cmds, line, batch=None):
+		cnc.motionStart(cmds)
+
+		# FIXME append feed on cut commands. It will be obsolete in grbl v1.0
+		if CNC.appendFeed and cnc.gcode in (1,2,3):
+			# Check is not existing in cmds
+			for c in cmds:
+				if c[0] in ('f','F'):
+					break
+			else:
+				# cmds is shared with the block cache
+				cmds = cmds + [cnc.fmt('F',cnc.feed/cnc.unit)]
+
+		if batch is not None and cnc.gcode in (0,1,2,3) and cnc.mval==0:
+			xyz = cnc.motionPath()
+			cnc.motionEnd()
+			if not xyz:
+				# while auto-levelling, do not ignore non-movement
+				# commands, just append the line as-is
+				return [line], False
+			return [batch.add(self.autolevelMove(cmds, xyz, cnc))], True
+
+		# FIXME expansion policy here variable needed
+		expand = None
+		# Canned cycles
+		if CNC.drillPolicy==1 and \
+		   cnc.gcode in (81,82,83,85,86,89):
+			expand = cnc.macroGroupG8X()
+		# Tool change
+		elif cnc.mval == 6:
+			if CNC.toolPolicy == 0:
+				pass	# send to grbl
+			elif CNC.toolPolicy == 1:
+				cnc.motionEnd()
+				return [], False	# skip whole line
+			elif CNC.toolPolicy >= 2:
+				expand = CNC.compile(cnc.toolChange())
+		cnc.motionEnd()
+		if expand is not None:
+			return expand, False
+
+		newcmd = []
+		for cmd in cmds:
+			c = cmd[0]
+			try: value = float(cmd[1:])
+			except: value = 0.0
+			if c.upper() in ("F","X","Y","Z","I","J","K","R","P"):
+				cmd = cnc.fmt(c,value)
+			else:
+				opt = ERROR_HANDLING.get(cmd.upper(),0)
+				if opt == SKIP: cmd = None
+			if cmd is not None:
+				newcmd.append(cmd)
+		return ["".join(newcmd)], True
 
 	#----------------------------------------------------------------------
 	# Use probe information to modify the g-code to autolevel
+	# The autolevel motions are queued as AutolevelMove items that the
+	# sender splits and corrects just before sending them
+	# The (block,line) of every queued command is appended to paths as
+	# soon as it is queued, when compiling while sending
 	#----------------------------------------------------------------------
-	def compile(self, queue, stopFunc=None):
+	def compile(self, queue, stopFunc=None, paths=None):
 		#lines  = [self.cnc.startup]
-		paths   = []
+		if paths is None: paths = []
 
 		def add(line, path):
 			if line is not None:
@@ -4631,9 +6629,14 @@ class GCode:
 				else:
 					queue.put(line)
 			paths.append(path)
+
+		# autolevel moves are split by the sender while sending
 		autolevel = not self.probe.isEmpty()
-		self.initPath()
-		for line in CNC.compile(self.cnc.startup.splitlines()):
+		batch = AutolevelBatch(self)
+		# private state, the compilation runs in the producer thread
+		# while the GUI may simulate the blocks to redraw them
+		cnc = CNC()
+		for line in CNC.compile(CNC.startup.splitlines()):
 			add(line, None)
 
 		every = 1
@@ -4646,12 +6649,11 @@ class GCode:
 						return None
 					every = 50
 
-				newcmd = []
-				cmds = CNC.compileLine(line)
+				cmds = block.compileLine(j)
 				if cmds is None:
 					continue
 				elif isinstance(cmds,str):
-					cmds = CNC.breakLine(cmds)
+					cmds = block.breakLine(j)
 				else:
 					# either CodeType or tuple, list[] append at it as is
 					#lines.append(cmds)
@@ -4661,90 +6663,70 @@ class GCode:
 						add(cmds, (i,j))
 					continue
 
-				skip   = False
-				expand = None
-				self.cnc.motionStart(cmds)
+				items, own = self.compileCmds(cnc, cmds, line,
+						batch if autolevel else None)
+				for item in items:
+					add(item, (i,j) if own else None)
 
-				# FIXME append feed on cut commands. It will be obsolete in grbl v1.0
-				if CNC.appendFeed and self.cnc.gcode in (1,2,3):
-					# Check is not existing in cmds
-					for c in cmds:
-						if c[0] in ('f','F'):
-							break
-					else:
-						cmds.append(self.fmt('F',self.cnc.feed/self.cnc.unit))
-
-				if autolevel and self.cnc.gcode in (0,1,2,3) and self.cnc.mval==0:
-					xyz = self.cnc.motionPath()
-					if not xyz:
-						# while auto-levelling, do not ignore non-movement
-						# commands, just append the line as-is
-						#lines.append(line)
-						#paths.append(None)
-						add(line, None)
-					else:
-						extra = ""
-						for c in cmds:
-							if c[0].upper() not in ('G','X','Y','Z','I','J','K','R'):
-								extra += c
-						x1,y1,z1 = xyz[0]
-						if self.cnc.gcode == 0:
-							g = 0
-						else:
-							g = 1
-						for x2,y2,z2 in xyz[1:]:
-							for x,y,z in self.probe.splitLine(x1,y1,z1,x2,y2,z2):
-								add("G%d%s%s%s%s"%\
-									(g,
-									 self.fmt('X',x/self.cnc.unit),
-									 self.fmt('Y',y/self.cnc.unit),
-									 self.fmt('Z',z/self.cnc.unit),
-									 extra),
-								    (i,j))
-								extra = ""
-							x1,y1,z1 = x2,y2,z2
-					self.cnc.motionEnd()
-					continue
-				else:
-					# FIXME expansion policy here variable needed
-					# Canned cycles
-					if CNC.drillPolicy==1 and \
-					   self.cnc.gcode in (81,82,83,85,86,89):
-						expand = self.cnc.macroGroupG8X()
-					# Tool change
-					elif self.cnc.mval == 6:
-						if CNC.toolPolicy == 0:
-							pass	# send to grbl
-						elif CNC.toolPolicy == 1:
-							skip = True	# skip whole line
-						elif CNC.toolPolicy >= 2:
-							expand = CNC.compile(self.cnc.toolChange())
-					self.cnc.motionEnd()
-
-				if expand is not None:
-					for line in expand:
-						add(line, None)
-					expand = None
-					continue
-				elif skip:
-					skip = False
-					continue
-
-				for cmd in cmds:
-					c = cmd[0]
-					try: value = float(cmd[1:])
-					except: value = 0.0
-					if c.upper() in ("F","X","Y","Z","I","J","K","R","P"):
-						cmd = self.fmt(c,value)
-					else:
-						opt = ERROR_HANDLING.get(cmd.upper(),0)
-						if opt == SKIP: cmd = None
-					if cmd is not None:
-						newcmd.append(cmd)
+		return paths
 
-				add("".join(newcmd), (i,j))
+	#----------------------------------------------------------------------
+	# Compile the lines of program, e.g. a file streamed from the disk
+	# without loading it, as compile() does for the blocks
+	# @yield line number, item to queue
+	#----------------------------------------------------------------------
+	def compileIter(self, program):
+		autolevel = not self.probe.isEmpty()
+		batch = AutolevelBatch(self)
+		cnc = CNC()
+		for j,line in enumerate(program):
+			line = line.rstrip("\n").replace("\x0d","")
+			cmds = CNC.compileLine(line)
+			if cmds is None: continue
+			if isinstance(cmds,str):
+				cmds = CNC.breakLine(cmds)
+			else:
+				# either CodeType or tuple, list[] append it as is
+				yield j, cmds
+				continue
 
-		return paths
+			if autolevel and len(batch.moves) >= AutolevelBatch.CHUNK:
+				# release the moves already corrected
+				batch = AutolevelBatch(self)
+			items, own = self.compileCmds(cnc, cmds, line,
+					batch if autolevel else None)
+			for item in items:
+				yield j, item
+
+#-------------------------------------------------------------------------------
+# Settings affecting the parsing and simulation, for the load workers
+#-------------------------------------------------------------------------------
+def _loadSettings():
+	attrs = dict([(n,getattr(CNC,n)) for n in
+			("inch","accuracy","feedmax_x","stdexpr","digits")])
+	cncvars = dict([(n,v) for n,v in CNC.vars.items()
+			if isinstance(v,(int,float,str))])
+	return attrs, cncvars
+
+#-------------------------------------------------------------------------------
+# Fast scan of the units, feed mode and feed set before every chunk of
+# lines, the modal state the workers could not know and most CAM programs
+# set only once
+# @return a line setting them for each chunk, parsed before the chunk
+#-------------------------------------------------------------------------------
+def _loadSeeds(chunks):
+	seeds = []
+	unit = mode = feed = ""
+	for chunk in chunks:
+		seeds.append(" ".join([x for x in (unit, mode, feed) if x]))
+		text = "\n".join(chunk)
+		if "(" in text or ";" in text:
+			text = COMMENTPAT.sub("", text)
+		for u,m,f in MODALPAT.findall(text):
+			if u: unit = "G"+u
+			elif m: mode = "G"+m
+			else: feed = "F"+f
+	return seeds
 
 #if __name__=="__main__":
 #	orient = Orient()
@@ -1676,7 +1676,7 @@ class CNCCanvas(Canvas, object):
 
 		# Draw image map if numpy exists
 		#if numpy is not None and probe.matrix and self.view == VIEW_XY:
-		if numpy is not None and probe.matrix and self.view in (VIEW_XY, VIEW_ISO1, VIEW_ISO2, VIEW_ISO3):
+		if numpy is not None and not probe.isEmpty() and self.view in (VIEW_XY, VIEW_ISO1, VIEW_ISO2, VIEW_ISO3):
 			array = numpy.array(list(reversed(probe.matrix)), numpy.float32)
 
 			lw = array.min()
@@ -1790,6 +1790,85 @@ class CNCCanvas(Canvas, object):
 				block.resetPath()
 			return
 
+		if numpy is None:
+			self.drawPathsLines()
+			return
+
+		# simulate without the draw time limit, which is left for
+		# drawing as much as possible of the paths
+		self._before = time.time()
+		self.gcode.simulate(self.app, self._updateDraw)
+		self._startTime = self._before = time.time()
+		try:
+			drawG = self.draw_rapid or self.draw_paths or self.draw_margin
+			for i,block in enumerate(self.gcode.blocks):
+				tp = block.toolpath
+				paths = [None]*len(block)
+				try:
+					if drawG and len(tp):
+						coords = self.plotArray(tp.points)
+						for k in range(len(tp)):
+							if k%1000 == 0: self._checkDrawTime()
+							path = self.drawSegment(block, tp, coords, k)
+							if path is not None:
+								j = int(tp.lid[k])
+								self._items[path] = i,j
+								paths[j] = path
+				finally:
+					# register also the paths of a partially drawn block
+					for path in paths:
+						block.addPath(path)
+		except AlarmException:
+			self.status("Rendering takes TOO Long. Interrupted...")
+
+	#----------------------------------------------------------------------
+	# Abort drawing if it takes too long, and force a periodic update
+	#----------------------------------------------------------------------
+	def _checkDrawTime(self):
+		if time.time() - self._startTime > DRAW_TIME:
+			raise AlarmException()
+		self._updateDraw()
+
+	#----------------------------------------------------------------------
+	# Force a periodic update, since drawing can take time
+	#----------------------------------------------------------------------
+	def _updateDraw(self):
+		if time.time() - self._before > 1.0:
+			self.update()
+			self._before = time.time()
+
+	#----------------------------------------------------------------------
+	# Create path for the toolpath segment k using the projected coords
+	#----------------------------------------------------------------------
+	def drawSegment(self, block, tp, coords, k):
+		gcode = tp.gcode[k]
+		xy = coords[tp.offset[k]:tp.offset[k+1]]
+		if block.enable:
+			if gcode == 0 and self.draw_rapid:
+				xy = xy.copy()
+				xy[0] = self.plotCoords([self._last])[0]
+			self._last = tuple(tp.end[k])
+			if block.color:
+				fill = block.color
+			else:
+				fill = ENABLE_COLOR
+		else:
+			if gcode == 0:
+				return None
+			fill = DISABLE_COLOR
+		if gcode == 0:
+			if self.draw_rapid:
+				return self.create_line(xy.ravel().tolist(),
+					fill=fill, width=0, dash=(4,3))
+		elif self.draw_paths:
+			return self.create_line(xy.ravel().tolist(), fill=fill,
+					width=0, cap="projecting")
+		return None
+
+	#----------------------------------------------------------------------
+	# Draw the paths line by line, when numpy is not available
+	#----------------------------------------------------------------------
+	def drawPathsLines(self):
 		try:
 			n = 1
 			startTime = before = time.time()
@@ -1814,11 +1893,15 @@ class CNCCanvas(Canvas, object):
 							before = time.time()
 						n = 1000
 					try:
-						cmd = self.gcode.evaluate(CNC.compileLine(line), self.app)
-						if isinstance(cmd,tuple):
-							cmd = None
+						cmd = block.compileLine(j)
+						if isinstance(cmd,str):
+							cmd = block.breakLine(j)
 						else:
-							cmd = CNC.breakLine(cmd)
+							cmd = self.gcode.evaluate(cmd, self.app)
+							if isinstance(cmd,tuple):
+								cmd = None
+							else:
+								cmd = CNC.breakLine(cmd)
 					except AlarmException:
 						raise
 					except:
@@ -1911,6 +1994,29 @@ class CNCCanvas(Canvas, object):
 				coords[i] = (x,y)
 		return coords
 
+	#----------------------------------------------------------------------
+	# Return plotting coordinates for an (n,3) numpy array as an (n,2) array
+	#----------------------------------------------------------------------
+	def plotArray(self, xyz):
+		x = xyz[:,0]
+		y = xyz[:,1]
+		z = xyz[:,2]
+		if self.view == VIEW_XY:
+			u,v = x, -y
+		elif self.view == VIEW_XZ:
+			u,v = x, -z
+		elif self.view == VIEW_YZ:
+			u,v = y, -z
+		elif self.view == VIEW_ISO1:
+			u,v = x*S60 + y*S60, x*C60 - y*C60 - z
+		elif self.view == VIEW_ISO2:
+			u,v = x*S60 - y*S60, -x*C60 - y*C60 - z
+		elif self.view == VIEW_ISO3:
+			u,v = -x*S60 - y*S60, -x*C60 + y*C60 - z
+		coords = numpy.column_stack((u,v))*self.zoom
+		# Check limits
+		return numpy.clip(coords, -MAXDIST, MAXDIST)
+
 	#----------------------------------------------------------------------
 	# Canvas to real coordinates
 	#----------------------------------------------------------------------
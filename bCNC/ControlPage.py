@@ -198,6 +198,7 @@ class DROFrame(CNCRibbon.PageFrame):
 		self.xwork.grid(row=row,column=col,padx=1,sticky=EW)
 		tkExtra.Balloon.set(self.xwork, _("X work position (click to set)"))
 		self.xwork.bind('<FocusIn>',  self.workFocus)
+		self.xwork.bind('<FocusOut>', self.workFocusOut)
 		self.xwork.bind('<Return>',   self.setX)
 		self.xwork.bind('<KP_Enter>', self.setX)
 
@@ -211,6 +212,7 @@ class DROFrame(CNCRibbon.PageFrame):
 		self.ywork.grid(row=row,column=col,padx=1,sticky=EW)
 		tkExtra.Balloon.set(self.ywork, _("Y work position (click to set)"))
 		self.ywork.bind('<FocusIn>',  self.workFocus)
+		self.ywork.bind('<FocusOut>', self.workFocusOut)
 		self.ywork.bind('<Return>',   self.setY)
 		self.ywork.bind('<KP_Enter>', self.setY)
 
@@ -224,6 +226,7 @@ class DROFrame(CNCRibbon.PageFrame):
 		self.zwork.grid(row=row,column=col,padx=1,sticky=EW)
 		tkExtra.Balloon.set(self.zwork, _("Z work position (click to set)"))
 		self.zwork.bind('<FocusIn>',  self.workFocus)
+		self.zwork.bind('<FocusOut>', self.workFocusOut)
 		self.zwork.bind('<Return>',   self.setZ)
 		self.zwork.bind('<KP_Enter>', self.setZ)
 
@@ -384,6 +387,12 @@ class DROFrame(CNCRibbon.PageFrame):
 		if self.app.running:
 			self.app.focus_set()
 
+	#----------------------------------------------------------------------
+	# Revert the text not entered once the focus has left the entry
+	#----------------------------------------------------------------------
+	def workFocusOut(self, event=None):
+		self.after_idle(self.updateCoords)
+
 	#----------------------------------------------------------------------
 	def setX0(self, event=None):
 		self.app.mcontrol._wcsSet("0",None,None,None,None,None)
@@ -484,6 +493,7 @@ class abcDROFrame(CNCRibbon.PageExLabelFrame):
 		self.awork.grid(row=row,column=col,sticky=EW)
 		tkExtra.Balloon.set(self.awork, _("A work position (click to set)"))
 		self.awork.bind('<FocusIn>',  self.workFocus)
+		self.awork.bind('<FocusOut>', self.workFocusOut)
 		self.awork.bind('<Return>',   self.setA)
 		self.awork.bind('<KP_Enter>', self.setA)
 
@@ -498,6 +508,7 @@ class abcDROFrame(CNCRibbon.PageExLabelFrame):
 		self.bwork.grid(row=row,column=col,sticky=EW)
 		tkExtra.Balloon.set(self.bwork, _("B work position (click to set)"))
 		self.bwork.bind('<FocusIn>',  self.workFocus)
+		self.bwork.bind('<FocusOut>', self.workFocusOut)
 		self.bwork.bind('<Return>',   self.setB)
 		self.bwork.bind('<KP_Enter>', self.setB)
 
@@ -512,6 +523,7 @@ class abcDROFrame(CNCRibbon.PageExLabelFrame):
 		self.cwork.grid(row=row,column=col,sticky=EW)
 		tkExtra.Balloon.set(self.cwork, _("C work position (click to set)"))
 		self.cwork.bind('<FocusIn>',  self.workFocus)
+		self.cwork.bind('<FocusOut>', self.workFocusOut)
 		self.cwork.bind('<Return>',   self.setC)
 		self.cwork.bind('<KP_Enter>', self.setC)
 
@@ -617,6 +629,12 @@ class abcDROFrame(CNCRibbon.PageExLabelFrame):
 		if self.app.running:
 			self.app.focus_set()
 
+	#----------------------------------------------------------------------
+	# Revert the text not entered once the focus has left the entry
+	#----------------------------------------------------------------------
+	def workFocusOut(self, event=None):
+		self.after_idle(self.updateCoords)
+
 	#----------------------------------------------------------------------
 	def setA0(self, event=None):
 		self.app.mcontrol._wcsSet(None,None,None,"0",None,None)
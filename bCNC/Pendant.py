@@ -51,6 +51,9 @@ iconpath = "%s/icons/"%(prgpath)
 #==============================================================================
 class Pendant(HTTPServer.BaseHTTPRequestHandler):
 	camera = None
+	STATE  = ("controller", "state", "pins", "color", "msg", "wx", "wy", "wz",
+		  "G", "OvFeed", "OvRapid", "OvSpindle")
+	_state = (-1, "")	# (version, json) of the last state sent
 
 	#----------------------------------------------------------------------
 	def log_message(self, fmt, *args):
@@ -87,7 +90,7 @@ class Pendant(HTTPServer.BaseHTTPRequestHandler):
 			for key,value in arg.items():
 				if key=="gcode":
 					for line in value.split('\n'):
-						httpd.app.queue.put(line+"\n")
+						httpd.app.sendGCode(line)
 				elif key=="cmd":
 					httpd.app.pendant.put(urlparse.unquote(value))
 			#send empty response so browser does not generate errors
@@ -95,10 +98,14 @@ class Pendant(HTTPServer.BaseHTTPRequestHandler):
 			self.wfile.write("".encode())
 
 		elif page == "/state":
-			tmp = {}
-			for name in ["controller", "state", "pins", "color", "msg", "wx", "wy", "wz", "G", "OvFeed", "OvRapid", "OvSpindle"]:
-				tmp[name] = CNC.vars[name]
-			contentToSend = json.dumps(tmp)
+			# serialize again only if any of the variables changed
+			version = CNC.vars.version(Pendant.STATE)
+			if version != Pendant._state[0]:
+				tmp = {}
+				for name in Pendant.STATE:
+					tmp[name] = CNC.vars[name]
+				Pendant._state = (version, json.dumps(tmp))
+			contentToSend = Pendant._state[1]
 			self.do_HEAD(200, content="text/text", cl=len(contentToSend))
 			self.wfile.write(contentToSend.encode())
 
@@ -20,7 +20,7 @@ except ImportError:
 	from tkinter import *
 	import tkinter.messagebox as tkMessageBox
 
-from CNC import CNC, Block
+from CNC import CNC, Block, Probe
 import Utils
 import Camera
 import Ribbon
@@ -45,6 +45,11 @@ TOOL_WAIT = [	_("ONLY before probing"),
 		_("BEFORE & AFTER probing")
 		]
 
+INTERPOLATION = [ _("Bilinear"),	# Probe.INTERPOLATION order
+		  _("Bicubic"),
+		  _("Thin plate spline")
+		]
+
 CAMERA_LOCATION = { "Gantry"       : NONE,
 		    "Top-Left"     : NW,
 		    "Top"          : N,
@@ -1094,6 +1099,63 @@ class AutolevelFrame(CNCRibbon.PageFrame):
 		tkExtra.Balloon.set(self.probeZmax, _("Z safe to move"))
 		self.addWidget(self.probeZmax)
 
+		# Interpolation
+		row += 1
+		col  = 0
+		Label(lframe, text=_("Interp:")).grid(row=row, column=col, sticky=E)
+		col += 1
+		self.interpolation = tkExtra.Combobox(lframe, True,
+					background=tkExtra.GLOBAL_CONTROL_BACKGROUND,
+					command=self.draw,
+					width=16)
+		self.interpolation.grid(row=row, column=col, columnspan=4, sticky=EW)
+		self.interpolation.fill(INTERPOLATION)
+		self.interpolation.set(INTERPOLATION[0])
+		tkExtra.Balloon.set(self.interpolation,
+			_("Interpolation of the probed surface. Bicubic and thin plate spline follow curved surfaces with coarser grids"))
+		self.addWidget(self.interpolation)
+
+		# Adaptive probing
+		row += 1
+		col  = 0
+		Label(lframe, text=_("Adaptive:")).grid(row=row, column=col, sticky=E)
+		col += 1
+		self.adaptiveStride = Spinbox(lframe,
+					from_=1, to_=64,
+					background=tkExtra.GLOBAL_CONTROL_BACKGROUND,
+					width=3)
+		self.adaptiveStride.grid(row=row, column=col, sticky=EW)
+		tkExtra.Balloon.set(self.adaptiveStride,
+			_("Adaptive probing: probe first every N nodes and refine only where the surface bends. 1 probes the full grid"))
+		self.addWidget(self.adaptiveStride)
+
+		col += 1
+		self.adaptiveTolerance = tkExtra.FloatEntry(lframe, background=tkExtra.GLOBAL_CONTROL_BACKGROUND, width=5)
+		self.adaptiveTolerance.grid(row=row, column=col, sticky=EW)
+		tkExtra.Balloon.set(self.adaptiveTolerance, _("Adaptive probing Z tolerance"))
+		self.addWidget(self.adaptiveTolerance)
+
+		col += 1
+		self.masked = BooleanVar()
+		b = Checkbutton(lframe, text=_("Toolpath"),
+				variable=self.masked,
+				padx=2, pady=1)
+		b.grid(row=row, column=col, columnspan=2, sticky=W)
+		tkExtra.Balloon.set(b,
+			_("Probe only the cells crossed by the enabled blocks and their neighbors, in a short visiting order. Overrides adaptive"))
+		self.addWidget(b)
+
+		# Merge of the autolevel segments
+		row += 1
+		col  = 0
+		Label(lframe, text=_("Merge:")).grid(row=row, column=col, sticky=E)
+		col += 1
+		self.mergeTolerance = tkExtra.FloatEntry(lframe, background=tkExtra.GLOBAL_CONTROL_BACKGROUND, width=5)
+		self.mergeTolerance.grid(row=row, column=col, sticky=EW)
+		tkExtra.Balloon.set(self.mergeTolerance,
+			_("Z tolerance to merge the autoleveled segments of a straight line. 0 to disable"))
+		self.addWidget(self.mergeTolerance)
+
 		lframe.grid_columnconfigure(1,weight=2)
 		lframe.grid_columnconfigure(2,weight=2)
 		lframe.grid_columnconfigure(3,weight=1)
@@ -1117,6 +1179,7 @@ class AutolevelFrame(CNCRibbon.PageFrame):
 
 		self.probeZmin.set(str(probe.zmin))
 		self.probeZmax.set(str(probe.zmax))
+		self.interpolation.set(INTERPOLATION[Probe.INTERPOLATION.index(probe.method)])
 
 	#-----------------------------------------------------------------------
 	def saveConfig(self):
@@ -1128,6 +1191,11 @@ class AutolevelFrame(CNCRibbon.PageFrame):
 		Utils.setInt(  "Probe", "yn",   self.probeYbins.get())
 		Utils.setFloat("Probe", "zmin", self.probeZmin.get())
 		Utils.setFloat("Probe", "zmax", self.probeZmax.get())
+		Utils.setInt(  "Probe", "interpolation", INTERPOLATION.index(self.interpolation.get()))
+		Utils.setInt(  "Probe", "adaptive",  self.adaptiveStride.get())
+		Utils.setFloat("Probe", "tolerance", self.adaptiveTolerance.get())
+		Utils.setBool( "Probe", "masked",    self.masked.get())
+		Utils.setFloat("Probe", "merge",     self.mergeTolerance.get())
 
 	#-----------------------------------------------------------------------
 	def loadConfig(self):
@@ -1143,6 +1211,15 @@ class AutolevelFrame(CNCRibbon.PageFrame):
 
 		self.probeYbins.delete(0,END)
 		self.probeYbins.insert(0,max(2,Utils.getInt("Probe","yn",5)))
+		try:
+			self.interpolation.set(INTERPOLATION[Utils.getInt("Probe","interpolation",0)])
+		except IndexError:
+			pass
+		self.adaptiveStride.delete(0,END)
+		self.adaptiveStride.insert(0,max(1,Utils.getInt("Probe","adaptive",1)))
+		self.adaptiveTolerance.set(Utils.getFloat("Probe","tolerance",0.02))
+		self.masked.set(Utils.getBool("Probe","masked",False))
+		self.mergeTolerance.set(Utils.getFloat("Probe","merge",0.0))
 		self.change(False)
 
 	#-----------------------------------------------------------------------
@@ -1214,6 +1291,16 @@ class AutolevelFrame(CNCRibbon.PageFrame):
 						parent=self.winfo_toplevel())
 			error = True
 
+		try:
+			probe.method = Probe.INTERPOLATION[INTERPOLATION.index(self.interpolation.get())]
+		except ValueError:
+			pass
+
+		try:
+			probe.merge = max(0.0, float(self.mergeTolerance.get()))
+		except ValueError:
+			probe.merge = 0.0
+
 		if ProbeCommonFrame.probeUpdate():
 			if verbose:
 				tkMessageBox.showerror(_("Probe Error"),
@@ -1251,7 +1338,27 @@ class AutolevelFrame(CNCRibbon.PageFrame):
 		if self.change(): return
 		self.event_generate("<<DrawProbe>>")
 		# absolute
-		self.app.run(lines=self.app.gcode.probe.scan())
+		probe = self.app.gcode.probe
+		try:
+			stride = int(self.adaptiveStride.get())
+			tolerance = float(self.adaptiveTolerance.get())
+		except ValueError:
+			stride = 1
+		segments = self.masked.get() and self.app.gcode.cuttingSegments()
+		if segments:
+			self.app.run(lines=probe.scanMasked(*segments))
+		elif stride > 1:
+			self.app.run(lines=probe.scanAdaptive(stride, tolerance))
+		else:
+			self.app.run(lines=probe.scan())
+
+	#-----------------------------------------------------------------------
+	# Continue the adaptive probing with the next refinement pass
+	#-----------------------------------------------------------------------
+	def refine(self):
+		lines = self.app.gcode.probe.refine()
+		self.event_generate("<<DrawProbe>>")
+		if lines: self.app.run(lines=lines)
 
 	#-----------------------------------------------------------------------
 	# Scan autolevel margins
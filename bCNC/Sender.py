@@ -14,12 +14,14 @@ import os
 import re
 import sys
 import glob
+import select
 import traceback
 import rexx
 import time
 import threading
 import webbrowser
 
+from collections import deque
 from datetime import datetime
 
 try:
@@ -31,17 +33,19 @@ try:
 except ImportError:
 	from queue import *
 
-from CNC import WAIT, MSG, UPDATE, WCS, CNC, GCode
+from CNC import WAIT, MSG, UPDATE, WCS, CNC, GCode, AutolevelBatch, AutolevelMove
 import Utils
 import Pendant
 from _GenericGRBL import ERROR_CODES
+from _GenericController import RxBuffer
+from telemetry import Telemetry
 
 WIKI = "https://github.com/vlachoudis/bCNC/wiki"
 
 SERIAL_POLL    = 0.125	# s
 SERIAL_TIMEOUT = 0.10	# s
 G_POLL	       = 10	# s
-RX_BUFFER_SIZE = 128
+QUEUE_SIZE     = 1000	# commands prepared ahead of the serial thread
 
 GPAT	  = re.compile(r"[A-Za-z]\s*[-+]?\d+.*")
 FEEDPAT   = re.compile(r"^(.*)[fF](\d+\.?\d+)(.*)$")
@@ -72,6 +76,195 @@ STATECOLOR = {
 		}
 
 
+#==============================================================================
+# Wake up the serial thread when there is something to do.
+# When the port exposes a file descriptor the thread blocks with select()
+# on the port and on a self-pipe written by set(), otherwise it falls back
+# to a blocking read on the port bounded by the SERIAL_TIMEOUT
+#==============================================================================
+class Wakeup:
+	def __init__(self):
+		self._flag = threading.Event()
+		try:
+			self._rd, self._wr = os.pipe()
+		except (AttributeError, OSError):
+			self._rd = self._wr = None
+
+	#----------------------------------------------------------------------
+	# Signal the waiting thread, can be called from any thread
+	#----------------------------------------------------------------------
+	def set(self):
+		if self._flag.is_set(): return
+		self._flag.set()
+		if self._wr is not None:
+			try:
+				os.write(self._wr, b"!")
+			except OSError:
+				pass
+
+	#----------------------------------------------------------------------
+	# Wait until data arrive on port, set() is called or timeout expires
+	# @return True if the port has something to read
+	#----------------------------------------------------------------------
+	def wait(self, port, timeout):
+		if port.inWaiting(): return True
+		if self._flag.is_set():
+			self._flag.clear()
+			return False
+
+		fd = None
+		if self._rd is not None:
+			try:
+				fd = port.fileno()
+			except (AttributeError, ValueError, OSError):
+				pass
+
+		if fd is not None:
+			try:
+				ready = select.select([fd, self._rd], [], [], timeout)[0]
+			except (ValueError, OSError, select.error):
+				# select() doesn't support pipes or ports on this system
+				self._rd = self._wr = None
+			else:
+				if self._rd in ready:
+					self._flag.clear()
+					os.read(self._rd, 512)
+				return fd in ready
+
+		# no way to block on both, let the port block on its own timeout
+		self._flag.clear()
+		return True
+
+
+#==============================================================================
+# Command queue waking up the serial thread on every new item
+#==============================================================================
+class CommandQueue(Queue):
+	def __init__(self, wakeup, maxsize=0):
+		Queue.__init__(self, maxsize)
+		self.wakeup = wakeup
+
+	def _put(self, item):
+		Queue._put(self, item)
+		self.wakeup.set()
+
+
+#==============================================================================
+# Queue given to the compiler by the producer thread of a run. Prepares the
+# commands and blocks while the command queue is full, dropping everything
+# once the run is stopped. The commands are prepared in chunks so that the
+# autolevel moves of a chunk are corrected together
+#==============================================================================
+class ProducerQueue:
+	def __init__(self, sender):
+		self.sender  = sender
+		self.pending = []
+
+	#----------------------------------------------------------------------
+	def put(self, item):
+		self.pending.append(item)
+		if len(self.pending) >= AutolevelBatch.CHUNK:
+			self.flush()
+
+	#----------------------------------------------------------------------
+	def flush(self):
+		sender = self.sender
+		for item in self.pending:
+			if sender._stop: break
+			item = sender.prepare(item)
+			while not sender._stop:
+				try:
+					sender.queue.put(item, True, SERIAL_POLL)
+					sender._queued += 1
+					break
+				except Full:
+					pass
+		del self.pending[:]
+
+
+#==============================================================================
+# Prepared lines of an autolevel move, counting as a single command
+#==============================================================================
+class PreparedMove:
+	__slots__ = ("lines",)
+
+	def __init__(self, lines):
+		self.lines = lines
+
+
+#==============================================================================
+# Run a file streaming it directly from disk, without loading it in the
+# editor. The lines are compiled one by one as they are queued, with the
+# autolevel and the tool change policy of gcode, only the line numbers of
+# the commands in flight are kept for the progress
+#==============================================================================
+class FileStream:
+	SIZE   = 64*1024*1024	# stream instead of loading bigger files to run
+	WINDOW = 4096		# line numbers kept, more than the commands in flight
+
+	def __init__(self, filename, startup="", gcode=None):
+		self.filename = filename
+		self.startup  = startup
+		self.gcode    = gcode		# autolevel and policies, CNC if None
+		self.lines    = FileStream.count(filename)
+		self.line     = 0		# last line queued
+		self.executed = 0		# last line executed
+		self.window   = deque(maxlen=FileStream.WINDOW)	# (command, line)
+
+	#----------------------------------------------------------------------
+	# @return number of lines of filename, reading it in chunks
+	#----------------------------------------------------------------------
+	@staticmethod
+	def count(filename):
+		n    = 0
+		last = b"\n"
+		f = open(filename, "rb")
+		while True:
+			chunk = f.read(1024*1024)
+			if not chunk: break
+			n += chunk.count(b"\n")
+			last = chunk[-1:]
+		f.close()
+		if last != b"\n": n += 1
+		return n
+
+	#----------------------------------------------------------------------
+	# Compile function of the producer of the run
+	# @return number of commands queued or None if stopped
+	#----------------------------------------------------------------------
+	def compile(self, queue, stopFunc):
+		n = 0
+		for line in CNC.compile(self.startup.splitlines()):
+			queue.put(line+"\n" if isinstance(line,str) else line)
+			n += 1
+
+		if self.gcode is None:
+			compileIter = CNC.compileIter
+		else:
+			compileIter = self.gcode.compileIter
+		f = open(self.filename, "r")
+		try:
+			for j,line in compileIter(f):
+				if n & 0xFF == 0 and stopFunc():
+					return None
+				queue.put(line+"\n" if isinstance(line,str) else line)
+				self.window.append((n, j+1))
+				self.line = j+1
+				n += 1
+		finally:
+			f.close()
+		return n
+
+	#----------------------------------------------------------------------
+	# @return the line number of the last of the count commands executed
+	#----------------------------------------------------------------------
+	def done(self, count):
+		window = self.window
+		while window and window[0][0] < count:
+			self.executed = window.popleft()[1]
+		return self.executed
+
+
 #==============================================================================
 # bCNC Sender class
 #==============================================================================
@@ -89,6 +282,8 @@ class Sender:
 		# Global variables
 		self.history	 = []
 		self._historyPos = None
+		self._rxBuffer	 = 0		# receive buffer size of the controller
+		self._rxBufferFixed = 0		# size set by the user, 0=auto
 
 		#self.mcontrol     = None
 		self.controllers = {}
@@ -100,14 +295,20 @@ class Sender:
 		self.cnc   = self.gcode.cnc
 
 		self.log	 = Queue()	# Log queue returned from GRBL
-		self.queue	 = Queue()	# Command queue to be send to GRBL
+		self._wakeup	 = Wakeup()	# Wake up the serial thread
+		self.telemetry	 = Telemetry()	# Streaming statistics
+		self.telemetryFile = ""		# export telemetry after every run
+		self.queue	 = CommandQueue(self._wakeup, QUEUE_SIZE)	# Command queue to be send to GRBL
+		self.commands	 = CommandQueue(self._wakeup)	# Manual commands, never blocking the caller
 		self.pendant	 = Queue()	# Command queue to be executed from Pendant
 		self.serial	 = None
 		self.thread	 = None
+		self.producer	 = None		# thread preparing the commands of a run
+		self.streamFile  = None		# file to stream on the next run
+		self._stream	 = None		# FileStream of the current run
 
 		self._posUpdate  = False	# Update position
 		self._probeUpdate= False	# Update probe
-		self._gUpdate	 = False	# Update $G
 		self._update	 = None		# Generic update
 
 		self.running	 = False
@@ -116,10 +317,12 @@ class Sender:
 		self._runLines	 = 0
 		self._quit	 = 0		# Quit counter to exit program
 		self._stop	 = False	# Raise to stop current run
+		self._runLock	 = threading.Lock()	# _stop and _runLines of the producer
 		self._pause	 = False	# machine is on Hold
 		self._alarm	 = True		# Display alarm message if true
 		self._msg	 = None
 		self._sumcline	 = 0
+		self._queued	 = 0		# commands of the run queued
 		self._lastFeed	 = 0
 		self._newFeed	 = 0
 
@@ -155,6 +358,8 @@ class Sender:
 			self.controller = ctl
 			CNC.vars["controller"] = ctl
 			self.mcontrol = self.controllers[ctl]
+			self.mcontrol.resetStatus()
+			self.setRxBufferSize()
 			#self.mcontrol.test()
 
 
@@ -165,9 +370,16 @@ class Sender:
 
 	#----------------------------------------------------------------------
 	def loadConfig(self):
+		self._rxBufferFixed = Utils.getInt("Connection", "rxbuffer", 0)
 		self.controllerSet(Utils.getStr("Connection", "controller"))
 		Pendant.port	 = Utils.getInt("Connection","pendantport",Pendant.port)
 		GCode.LOOP_MERGE = Utils.getBool("File","dxfloopmerge")
+		GCode.CACHE      = Utils.getBool("File","cache",GCode.CACHE)
+		GCode.CACHE_LIMIT = Utils.getInt("File","cachelimit",
+					GCode.CACHE_LIMIT>>20) << 20
+		self.telemetryFile = Utils.getStr("Connection","telemetry")
+		# record the whole run only when it is exported
+		self.telemetry.keep = None if self.telemetryFile else Telemetry.KEEP
 		self.loadHistory()
 
 	#----------------------------------------------------------------------
@@ -279,6 +491,21 @@ class Sender:
 		elif cmd == "RUN":
 			self.run()
 
+		# TEL*EMETRY [filename]: show the streaming statistics and
+		# optionally export the telemetry of the last run as CSV
+		elif rexx.abbrev("TELEMETRY",cmd,3):
+			for s in self.telemetryStats():
+				self.log.put((Sender.MSG_RECEIVE, s))
+			if len(line)>1:
+				self.exportTelemetry(line[1])
+
+		# STREAM [filename]: run a file streaming it from disk, without
+		# loading it in the editor
+		elif cmd == "STREAM":
+			if len(line)>1:
+				self.streamFile = line[1]
+			self.run()
+
 		# SAFE [z]: safe z to move
 		elif cmd=="SAFE":
 			try: CNC.vars["safe"] = float(line[1])
@@ -416,6 +643,7 @@ class Sender:
 		else:
 			self.gcode.load(filename)
 			self._saveConfigFile()
+			self.streamFile = None
 		Utils.addRecent(filename)
 
 	#----------------------------------------------------------------------
@@ -521,6 +749,7 @@ class Sender:
 			pass
 		self._runLines = 0
 		self.thread = None
+		self._wakeup.set()
 		time.sleep(1)
 		try:
 			self.serial.close()
@@ -537,9 +766,93 @@ class Sender:
 	def sendGCode(self, cmd):
 		if self.serial and not self.running:
 			if isinstance(cmd,tuple):
-				self.queue.put(cmd)
+				self.commands.put(cmd)
 			else:
-				self.queue.put(cmd+"\n")
+				self.commands.put(self.prepare(cmd+"\n"))
+
+	#----------------------------------------------------------------------
+	# Prepare a command for sending. Strings are converted to the bytes
+	# written to the controller with the case conversion, autolevel moves
+	# to their prepared lines. Anything else (wait, messages, code to
+	# evaluate) is returned as is
+	#----------------------------------------------------------------------
+	def prepare(self, line):
+		if isinstance(line, AutolevelMove):
+			return PreparedMove([self.prepare(x+"\n") for x in line.lines()])
+		elif not isinstance(line, str):
+			return line
+		if self.mcontrol.gcode_case > 0: line = line.upper()
+		if self.mcontrol.gcode_case < 0: line = line.lower()
+		return line.encode()
+
+	#----------------------------------------------------------------------
+	# Modify the line to reflect the overridden feed, for controllers
+	# without override support. Called by the serial thread just before
+	# sending the line, so a change of the override applies on the next
+	# line and not on the lines already prepared in the queue
+	#----------------------------------------------------------------------
+	def overrideFeed(self, tosend):
+		line = tosend.decode()
+
+		# Keep track of last feed
+		pat = FEEDPAT.match(line)
+		if pat is not None:
+			self._lastFeed = pat.group(2)
+
+		if CNC.vars["_OvChanged"]:
+			CNC.vars["_OvChanged"] = False
+			self._newFeed = float(self._lastFeed)*CNC.vars["_OvFeed"]/100.0
+			if pat is None and self._newFeed!=0 \
+			   and not line.startswith("$"):
+				line = "f%g%s" % (self._newFeed, line)
+
+		# Apply override Feed
+		if CNC.vars["_OvFeed"] != 100 and self._newFeed != 0:
+			pat = FEEDPAT.match(line)
+			if pat is not None:
+				try:
+					line = "%sf%g%s\n" % \
+						(pat.group(1),
+						 self._newFeed,
+						 pat.group(3))
+				except:
+					pass
+		return line.encode()
+
+	#----------------------------------------------------------------------
+	# Start the producer thread of a run, compiling the commands with
+	# compile(queue, stopFunc) while the serial thread streams them.
+	# compile returns the number of commands of the run or None if stopped
+	#----------------------------------------------------------------------
+	def produce(self, compile):
+		self._queued  = 0
+		self.producer = threading.Thread(target=self._produce, args=(compile,))
+		self.producer.start()
+
+	#----------------------------------------------------------------------
+	def _produce(self, compile):
+		queue = ProducerQueue(self)
+		try:
+			n = compile(queue, lambda: self._stop)
+		except:
+			for s in str(sys.exc_info()[1]).splitlines():
+				self.log.put((Sender.MSG_ERROR,s))
+			n = None
+		if n is not None:
+			queue.put((WAIT,))	# wait at the end to become idle
+			queue.flush()
+		self.producer = None
+		# publish the run lines only if not stopped meanwhile, otherwise
+		# stopRun() skipped the purge of the controller
+		with self._runLock:
+			stopped = n is None or self._stop
+			if not stopped: self._runLines = n + 1	# plus the wait
+		if stopped:
+			self.emptyQueue()
+			if self.serial is not None:
+				self.purgeController()
+			else:
+				self.runEnded()
 
 	#----------------------------------------------------------------------
 	def sendHex(self, hexcode):
@@ -575,27 +888,65 @@ class Sender:
 
 	#----------------------------------------------------------------------
 	def emptyQueue(self):
-		while self.queue.qsize()>0:
-			try:
-				self.queue.get_nowait()
-			except Empty:
-				break
+		for queue in (self.commands, self.queue):
+			while queue.qsize()>0:
+				try:
+					queue.get_nowait()
+				except Empty:
+					break
 
 	#----------------------------------------------------------------------
 	def stopProbe(self):
 		if self.gcode.probe.start:
 			self.gcode.probe.clear()
 
+	#----------------------------------------------------------------------
+	# @return the rolling streaming statistics as text lines
+	#----------------------------------------------------------------------
+	def telemetryStats(self):
+		s = self.telemetry.stats()
+		return [_("Streaming: %.1f lines/s %.0f bytes/s buffer %.0f/%d bytes") % \
+				(s["lines/s"], s["bytes/s"], s["fill"], self._rxBuffer),
+			_("Ack latency: p50 %.1fms p95 %.1fms p99 %.1fms max %.1fms") % \
+				(s["p50"]*1000., s["p95"]*1000., s["p99"]*1000., s["max"]*1000.),
+			_("Planner empty: %.1fs, %.0f%% of the reports") % \
+				(s["starved"], s["empty"]*100.)]
+
+	#----------------------------------------------------------------------
+	def exportTelemetry(self, filename):
+		try:
+			n = self.telemetry.export(filename)
+		except (IOError, OSError):
+			self.log.put((Sender.MSG_ERROR, str(sys.exc_info()[1])))
+			return
+		self.log.put((Sender.MSG_RECEIVE,
+			_("Telemetry: %d records exported to %s")%(n, filename)))
+
 	#----------------------------------------------------------------------
 	def getBufferFill(self):
-		return self._sumcline * 100. / RX_BUFFER_SIZE
+		return self._sumcline * 100. / self._rxBuffer
+
+	#----------------------------------------------------------------------
+	# Set the receive buffer size of the controller used for the character
+	# counting, as detected from the controller or the default advertised
+	# by the controller class when size is None. A size set by the user in
+	# the configuration always wins
+	#----------------------------------------------------------------------
+	def setRxBufferSize(self, size=None):
+		if self._rxBufferFixed > 0:
+			size = self._rxBufferFixed
+		elif size is None:
+			size = self.mcontrol.rx_buffer_size
+		self._rxBuffer = size
 
 	#----------------------------------------------------------------------
 	def initRun(self):
 		self._quit   = 0
 		self._pause  = False
 		self._paths  = None
+		self._stream = None
 		self.running = True
+		self.telemetry.reset()
 		self.disable()
 		self.emptyQueue()
 		time.sleep(1)
@@ -613,9 +964,12 @@ class Sender:
 					os.system(self._onStop)
 				except:
 					pass
+			if self.telemetryFile:
+				self.exportTelemetry(datetime.now().strftime(self.telemetryFile))
 		self._runLines = 0
 		self._quit     = 0
 		self._msg      = None
+		CNC.vars.touch("state")
 		self._pause    = False
 		self.running   = False
 		CNC.vars["running"] = False
@@ -626,9 +980,13 @@ class Sender:
 	#----------------------------------------------------------------------
 	def stopRun(self, event=None):
 		self.feedHold()
-		self._stop = True
-		# if we are in the process of submitting do not do anything
-		if self._runLines != sys.maxsize:
+		with self._runLock:
+			self._stop = True
+			submitting = self._runLines == sys.maxsize
+		self._wakeup.set()
+		# if we are in the process of submitting do not do anything,
+		# the producer purges the controller when it exits
+		if not submitting:
 			self.purgeController()
 
 	#----------------------------------------------------------------------
@@ -661,9 +1019,9 @@ class Sender:
 	def serialIO(self):
 		self.sio_wait   = False		# wait for commands to complete (status change to Idle)
 		self.sio_status = False		# waiting for status <...> report
-		cline  = []		# length of pipeline commands
-		sline  = []			# pipeline commands
+		rxbuf  = RxBuffer(self.telemetry)	# pipeline commands
 		tosend = None			# next string to send
+		expanded = deque()		# remaining lines of an autolevel move
 		tr = tg = time.time()		# last time a ? or $G was send to grbl
 
 		while self.thread:
@@ -678,11 +1036,23 @@ class Sender:
 					self.mcontrol.overrideSet()
 
 			# Fetch new command to send if...
-			if tosend is None and not self.sio_wait and not self._pause and self.queue.qsize()>0:
+			if tosend is None and not self.sio_wait and not self._pause and \
+			   (expanded or self.commands.qsize()>0 or self.queue.qsize()>0):
 				try:
-					tosend = self.queue.get_nowait()
+					if expanded:
+						tosend = expanded.popleft()
+					elif self.commands.qsize()>0:
+						tosend = self.commands.get_nowait()
+					else:
+						tosend = self.queue.get_nowait()
 					#print "+++",repr(tosend)
-					if isinstance(tosend, tuple):
+					if isinstance(tosend, AutolevelMove):
+						tosend = self.prepare(tosend)
+					if isinstance(tosend, PreparedMove):
+						expanded = deque(tosend.lines)
+						tosend = expanded.popleft()
+
+					elif isinstance(tosend, tuple):
 						#print "gcount tuple=",self._gcount
 						# wait to empty the grbl buffer and status is Idle
 						if tosend[0] == WAIT:
@@ -696,6 +1066,7 @@ class Sender:
 							if tosend[1] is not None:
 								# show our message on machine status
 								self._msg = tosend[1]
+								CNC.vars.touch("state")
 						elif tosend[0] == UPDATE:
 							# Count executed commands as well
 							self._gcount += 1
@@ -705,14 +1076,13 @@ class Sender:
 							self._gcount += 1
 						tosend = None
 
-					elif not isinstance(tosend,str):
+					elif not isinstance(tosend,(bytes,str)):
 						try:
 							tosend = self.gcode.evaluate(tosend, self)
 #							if isinstance(tosend, list):
-#								cline.append(len(tosend[0]))
-#								sline.append(tosend[0])
+#								rxbuf.append(tosend[0])
 							if isinstance(tosend,str):
-								tosend += "\n"
+								tosend = self.prepare(tosend+"\n")
 							else:
 								# Count executed commands as well
 								self._gcount += 1
@@ -727,41 +1097,28 @@ class Sender:
 					break
 
 				if tosend is not None:
-					# All modification in tosend should be
-					# done before adding it to cline
-
-					# Keep track of last feed
-					pat = FEEDPAT.match(tosend)
-					if pat is not None:
-						self._lastFeed = pat.group(2)
-
-					# Modify sent g-code to reflect overrided feed for controllers without override support
 					if not self.mcontrol.has_override:
-						if CNC.vars["_OvChanged"]:
-							CNC.vars["_OvChanged"] = False
-							self._newFeed = float(self._lastFeed)*CNC.vars["_OvFeed"]/100.0
-							if pat is None and self._newFeed!=0 \
-							   and not tosend.startswith("$"):
-								tosend = "f%g%s" % (self._newFeed, tosend)
-
-						# Apply override Feed
-						if CNC.vars["_OvFeed"] != 100 and self._newFeed != 0:
-							pat = FEEDPAT.match(tosend)
-							if pat is not None:
-								try:
-									tosend = "%sf%g%s\n" % \
-										(pat.group(1),
-										 self._newFeed,
-										 pat.group(3))
-								except:
-									pass
-
-					# Bookkeeping of the buffers
-					sline.append(tosend)
-					cline.append(len(tosend))
+						tosend = self.overrideFeed(tosend)
+					# Bookkeeping of the buffers, all lines of an
+					# autolevel move count as one with the last
+					rxbuf.append(tosend, 0 if expanded else 1)
 
 			# Anything to receive?
-			if self.serial.inWaiting() or tosend is None:
+			# Block only when there is nothing else to do, until data
+			# arrive, a new command is queued or the next status poll
+			if tosend is not None:
+				busy = rxbuf.size < self._rxBuffer
+			else:
+				busy = not self.sio_wait and not self._pause and \
+					(expanded or self.commands.qsize()>0 or \
+					 self.queue.qsize()>0)
+			if busy:
+				ready = self.serial.inWaiting()
+			else:
+				ready = self._wakeup.wait(self.serial,
+						max(0.0, tr+SERIAL_POLL-time.time()))
+
+			if ready:
 				try:
 					line = str(self.serial.readline().decode()).strip()
 				except:
@@ -771,10 +1128,10 @@ class Sender:
 					return
 
 				#print "<R<",repr(line)
-				#print "*-* stack=",sline,"sum=",sum(cline),"wait=",wait,"pause=",self._pause
+				#print "*-* stack=",rxbuf.lines,"sum=",rxbuf.size,"wait=",wait,"pause=",self._pause
 				if not line:
 					pass
-				elif self.mcontrol.parseLine(line, cline, sline):
+				elif self.mcontrol.parseLine(line, rxbuf):
 					pass
 				else:
 					self.log.put((Sender.MSG_RECEIVE, line))
@@ -783,6 +1140,7 @@ class Sender:
 			if self._stop:
 				self.emptyQueue()
 				tosend = None
+				expanded.clear()
 				self.log.put((Sender.MSG_CLEAR, ""))
 				# WARNING if runLines==maxint then it means we are
 				# still preparing/sending lines from from bCNC.run(),
@@ -790,19 +1148,17 @@ class Sender:
 				if self._runLines != sys.maxsize:
 					self._stop = False
 
-			#print "tosend='%s'"%(repr(tosend)),"stack=",sline,
-			#	"sum=",sum(cline),"wait=",wait,"pause=",self._pause
-			if tosend is not None and sum(cline) < RX_BUFFER_SIZE:
-				self._sumcline = sum(cline)
+			#print "tosend='%s'"%(repr(tosend)),"stack=",rxbuf.lines,
+			#	"sum=",rxbuf.size,"wait=",wait,"pause=",self._pause
+			if tosend is not None and rxbuf.size < self._rxBuffer:
+				self._sumcline = rxbuf.size
 #				if isinstance(tosend, list):
 #					self.serial_write(str(tosend.pop(0)))
 #					if not tosend: tosend = None
 
-				#print ">S>",repr(tosend),"stack=",sline,"sum=",sum(cline)
-				if self.mcontrol.gcode_case > 0: tosend = tosend.upper()
-				if self.mcontrol.gcode_case < 0: tosend = tosend.lower()
-
+				#print ">S>",repr(tosend),"stack=",rxbuf.lines,"sum=",rxbuf.size
 				self.serial_write(tosend)
+				self.telemetry.write(len(tosend), rxbuf.size)
 
 				#self.serial_write(tosend)
 				#self.serial.flush()
@@ -811,6 +1167,5 @@ class Sender:
 				tosend = None
 				if not self.running and t-tg > G_POLL:
 					tosend = b"$G\n" #FIXME: move to controller specific class
-					sline.append(tosend)
-					cline.append(len(tosend))
+					rxbuf.append(tosend)
 					tg = t
@@ -11,8 +11,10 @@ __email__  = "vvlachoudis@gmail.com"
 
 try:
 	from Tkinter import *
+	import tkFont
 except ImportError:
 	from tkinter import *
+	import tkinter.font as tkFont
 
 import Utils
 import Ribbon
@@ -20,6 +22,8 @@ import tkExtra
 
 import CNCRibbon
 
+TERMINAL_LINES = 10000	# lines kept in the terminal
+
 
 #===============================================================================
 # Terminal Group
@@ -146,33 +150,238 @@ class CommandsGroup(CNCRibbon.ButtonMenuGroup):
 		self.addWidget(b)
 
 
+#===============================================================================
+# Listbox showing a window of a ring buffer of lines. The lines are kept in
+# a python list, trimmed in chunks when full, and only the visible rows are
+# inserted in the Tk widget by refresh(), called once per update of the GUI.
+# While the view is at the bottom it follows the new lines. The selection is
+# kept as absolute line numbers, so it survives the refresh and may extend
+# beyond the visible rows
+#===============================================================================
+class TerminalListbox(Listbox):
+	def __init__(self, master, maxlines=None, trim=1000, **kw):
+		Listbox.__init__(self, master, **kw)
+		self.lines    = []		# (text, color)
+		self.maxlines = maxlines	# lines kept or None for all
+		self.trim     = trim		# lines removed when full
+		self.follow   = maxlines is not None
+		self.yscrollcommand = None	# scrollbar set function
+		self._top     = 0		# first line shown
+		self._rows    = int(kw.get("height", 10))
+		self._shown   = None		# (first line number, lines) in the widget
+		self._dirty   = True
+		self._first   = 0		# line number of lines[0]
+		self._select  = set()		# line numbers selected
+		self._anchor  = None		# line number of the selection anchor
+		self.bind("<Configure>",	self._configure)
+		self.bind("<<ListboxSelect>>",	self._selectSync)
+		self.bind("<Button-1>",		self._click)
+		self.bind("<Shift-Button-1>",	self._shiftClick)
+		self.bind("<Control-Button-1>",	lambda e: None)	# toggle, keep the selection
+		self.bind("<Control-Key-a>",	self.selectAll)
+		self.bind("<MouseWheel>",	self._wheel)
+		self.bind("<Button-4>",		lambda e,s=self:s.yview(SCROLL,-3,UNITS))
+		self.bind("<Button-5>",		lambda e,s=self:s.yview(SCROLL, 3,UNITS))
+		self.bind("<Prior>",		lambda e,s=self:s.yview(SCROLL,-1,PAGES))
+		self.bind("<Next>",		lambda e,s=self:s.yview(SCROLL, 1,PAGES))
+		self.bind("<Home>",		lambda e,s=self:s.yview(MOVETO, 0.0))
+		self.bind("<End>",		lambda e,s=self:s.yview(MOVETO, 1.0))
+
+	#----------------------------------------------------------------------
+	def lineCount(self):
+		return len(self.lines)
+
+	#----------------------------------------------------------------------
+	# Add a line at the end or before line index
+	#----------------------------------------------------------------------
+	def add(self, text, color=None, index=None):
+		if index is None:
+			self.lines.append((text, color))
+		else:
+			self.lines.insert(index, (text, color))
+			if self._select:
+				k = self._first + index
+				self._select = set([x+1 if x>=k else x for x in self._select])
+		if self.maxlines is not None and len(self.lines) > self.maxlines:
+			del self.lines[:self.trim]
+			self._top = max(0, self._top-self.trim)
+			self._forget(self.trim)
+		self._dirty = True
+
+	#----------------------------------------------------------------------
+	# Remove and return the text of the first line, None if empty
+	#----------------------------------------------------------------------
+	def popFirst(self):
+		if not self.lines: return None
+		if self._top > 0: self._top -= 1
+		self._forget(1)
+		self._dirty = True
+		return self.lines.pop(0)[0]
+
+	#----------------------------------------------------------------------
+	# The first n lines were removed
+	#----------------------------------------------------------------------
+	def _forget(self, n):
+		self._first += n
+		if self._select:
+			first = self._first
+			self._select = set([x for x in self._select if x>=first])
+
+	#----------------------------------------------------------------------
+	def clear(self):
+		self._first += len(self.lines)
+		del self.lines[:]
+		self._select.clear()
+		self._top   = 0
+		self._dirty = True
+		self.refresh()
+
+	#----------------------------------------------------------------------
+	# @return the text of the selected lines
+	#----------------------------------------------------------------------
+	def selected(self):
+		first = self._first
+		return [self.lines[x-first][0] for x in sorted(self._select)]
+
+	#----------------------------------------------------------------------
+	def selectAll(self, event=None):
+		self._select = set(range(self._first, self._first+len(self.lines)))
+		self._shown  = None
+		self._dirty  = True
+		self.refresh()
+		return "break"
+
+	#----------------------------------------------------------------------
+	# Line number of the row at y
+	#----------------------------------------------------------------------
+	def _lineAt(self, y):
+		return self._shown[0] + self.nearest(y)
+
+	#----------------------------------------------------------------------
+	# A plain click starts a new selection
+	#----------------------------------------------------------------------
+	def _click(self, event):
+		self._select.clear()
+		if self._shown is not None:
+			self._anchor = self._lineAt(event.y)
+
+	#----------------------------------------------------------------------
+	# Extend the selection from the anchor, even if it is not visible
+	#----------------------------------------------------------------------
+	def _shiftClick(self, event):
+		if self._shown is None or not self._shown[1]: return "break"
+		line = self._lineAt(event.y)
+		if self._anchor is None: self._anchor = line
+		a = max(self._first, min(self._anchor, line))
+		b = max(self._anchor, line)
+		self._select = set(range(a, b+1))
+		self._shown  = None
+		self._dirty  = True
+		self.refresh()
+		return "break"
+
+	#----------------------------------------------------------------------
+	# Copy the selection of the visible rows, changed by the user, to the
+	# selected line numbers
+	#----------------------------------------------------------------------
+	def _selectSync(self, event=None):
+		if self._shown is None: return
+		first, lines = self._shown
+		rows = set([int(i) for i in self.curselection()])
+		for i in range(len(lines)):
+			if i in rows:
+				self._select.add(first+i)
+			else:
+				self._select.discard(first+i)
+
+	#----------------------------------------------------------------------
+	# Without arguments return the fractions of the lines shown, otherwise
+	# scroll like the Listbox.yview(MOVETO|SCROLL, ...)
+	#----------------------------------------------------------------------
+	def yview(self, *args):
+		n = len(self.lines)
+		if not args:
+			if n <= self._rows: return (0.0, 1.0)
+			return (float(self._top)/n, float(min(n,self._top+self._rows))/n)
+		if args[0] == MOVETO:
+			top = int(float(args[1])*n + 0.5)
+		elif args[1:] and args[-1] == PAGES:
+			top = self._top + int(args[1])*max(1,self._rows-1)
+		else:
+			top = self._top + int(args[1])
+		self._top   = max(0, min(top, n-self._rows))
+		self.follow = self.maxlines is not None and self._top >= n-self._rows
+		self._dirty = True
+		self.refresh()
+
+	#----------------------------------------------------------------------
+	def _wheel(self, event):
+		self.yview(SCROLL, -3 if event.delta>0 else 3, UNITS)
+		return "break"
+
+	#----------------------------------------------------------------------
+	# Number of rows fitting in the widget
+	#----------------------------------------------------------------------
+	def _configure(self, event):
+		pad  = 2*(int(self.cget("borderwidth")) + int(self.cget("highlightthickness")))
+		line = tkFont.Font(font=self.cget("font")).metrics("linespace") + 1
+		rows = max(1, (event.height-pad+line-1) // line)
+		if rows != self._rows:
+			self._rows  = rows
+			self._dirty = True
+			self.refresh()
+
+	#----------------------------------------------------------------------
+	# Show the visible lines in the widget
+	#----------------------------------------------------------------------
+	def refresh(self):
+		if not self._dirty: return
+		self._dirty = False
+		n = len(self.lines)
+		if self.follow or self._top > n-self._rows:
+			self._top = max(0, n-self._rows)
+		shown = (self._first+self._top, self.lines[self._top:self._top+self._rows])
+		if shown != self._shown:
+			self._shown = shown
+			first, lines = shown
+			self.delete(0,END)
+			if lines:
+				self.insert(END, *[text for text,color in lines])
+			for i,(text,color) in enumerate(lines):
+				if color: self.itemconfig(i, foreground=color)
+				if first+i in self._select: self.selection_set(i)
+		if self.yscrollcommand:
+			self.yscrollcommand(*self.yview())
+
+
 #===============================================================================
 class TerminalFrame(CNCRibbon.PageFrame):
 	def __init__(self, master, app):
 		CNCRibbon.PageFrame.__init__(self, master, N_("Terminal"), app)
 
 		# ---
-		self.terminal = Listbox(self,
+		self.terminal = TerminalListbox(self,
+					maxlines=TERMINAL_LINES,
 					background=tkExtra.GLOBAL_CONTROL_BACKGROUND,
 					selectmode=EXTENDED,
 					height=5)
 		self.terminal.grid(row=0, column=0, sticky=NSEW)
 		sb = Scrollbar(self, orient=VERTICAL, command=self.terminal.yview)
 		sb.grid(row=0, column=1, sticky=NS)
-		self.terminal.config(yscrollcommand=sb.set)
+		self.terminal.yscrollcommand = sb.set
 		self.terminal.bind("<<Copy>>",		self.copy)
 		self.terminal.bind("<Control-Key-c>",	self.copy)
 		tkExtra.Balloon.set(self.terminal, _("Terminal communication with controller"))
 
 		# ---
-		self.buffer = Listbox(self,
+		self.buffer = TerminalListbox(self,
 					background="LightYellow",
 					selectmode=EXTENDED,
 					height=5)
 		self.buffer.grid(row=1, column=0, sticky=NSEW)
 		sb = Scrollbar(self, orient=VERTICAL, command=self.buffer.yview)
 		sb.grid(row=1, column=1, sticky=NS)
-		self.buffer.config(yscrollcommand=sb.set)
+		self.buffer.yscrollcommand = sb.set
 		tkExtra.Balloon.set(self.buffer, _("Buffered commands"))
 		self.buffer.bind("<<Copy>>",		self.copy)
 		self.buffer.bind("<Control-Key-c>",	self.copy)
@@ -183,14 +392,12 @@ class TerminalFrame(CNCRibbon.PageFrame):
 
 	#----------------------------------------------------------------------
 	def clear(self, event=None):
-		self.terminal.delete(0,END)
+		self.terminal.clear()
 
 	#----------------------------------------------------------------------
 	def copy(self, event):
 		self.clipboard_clear()
-		self.clipboard_append("\n".join(
-			[event.widget.get(x)
-				for x in event.widget.curselection()]))
+		self.clipboard_append("\n".join(event.widget.selected()))
 		return "break"
 
 
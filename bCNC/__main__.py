@@ -19,6 +19,7 @@ import os
 import time
 import getopt
 import socket
+import multiprocessing
 import traceback
 from datetime import datetime
 
@@ -59,7 +60,7 @@ import tkDialogs
 from CNC import WAIT, CNC, GCode
 import Ribbon
 import Pendant
-from Sender import Sender, NOT_CONNECTED, STATECOLOR, STATECOLORDEF
+from Sender import Sender, FileStream, NOT_CONNECTED, STATECOLOR, STATECOLORDEF
 
 import CNCCanvas
 import webbrowser
@@ -79,8 +80,6 @@ _baud       = None
 MONITOR_AFTER =  200	# ms
 DRAW_AFTER    =  300	# ms
 
-RX_BUFFER_SIZE = 128
-
 MAX_HISTORY  = 500
 
 #ZERO = ["G28", "G30", "G92"]
@@ -242,6 +241,19 @@ class Application(Toplevel,Sender):
 		# XXX FIXME Do we need it or I can takes from Page every time?
 		self.autolevel = Page.frames["Probe:Autolevel"]
 
+		# Refresh the widgets only when their variables change
+		CNC.vars.subscribe(("state", "pins", "color"), self.dro.updateState)
+		# the coordinates also on state changes, to revert the DRO text not entered
+		CNC.vars.subscribe(("wx", "wy", "wz", "mx", "my", "mz",
+				    "wa", "wb", "wc", "ma", "mb", "mc", "state"),
+				self.dro.updateCoords)
+		CNC.vars.subscribe(("wx", "wy", "wz", "mx", "my", "mz"),
+				self.updateGantry)
+		CNC.vars.subscribe(("curfeed",), self.updateFeed)
+		CNC.vars.subscribe(("WCS", "feed", "feedmode", "spindle", "rpm",
+				    "tool", "units", "distance", "plane", "TLO", "G92"),
+				self.gstate.updateG)
+
 		# Left side
 		for name in Utils.getStr(Utils.__prg__,"ribbon").split():
 			last = name[-1]
@@ -941,6 +953,9 @@ class Application(Toplevel,Sender):
 		else:
 			unit = "mm"
 
+		# replace the simple time estimation with the planner model
+		self.gcode.estimateTime()
+
 		# count enabled blocks
 		e = 0
 		l = 0
@@ -2051,6 +2066,23 @@ class Application(Toplevel,Sender):
 					self.gcode.probe.save()
 		return False
 
+	#-----------------------------------------------------------------------
+	# Load a file into editor, or when it is too big to be loaded keep it
+	# to be streamed directly from the disk on the next run
+	#-----------------------------------------------------------------------
+	def loadOrStream(self, filename):
+		fn,ext = os.path.splitext(filename)
+		try:
+			size = os.path.getsize(filename)
+		except OSError:
+			size = 0
+		if size > FileStream.SIZE and \
+		   ext.lower() not in (".probe", ".orient", ".dxf", ".svg", ".stl", ".ply"):
+			self.streamFile = filename
+			self.setStatus(_("Ready to stream: %s")%(filename))
+		else:
+			self.load(filename)
+
 	#-----------------------------------------------------------------------
 	# Load a file into editor
 	#-----------------------------------------------------------------------
@@ -2235,6 +2267,24 @@ class Application(Toplevel,Sender):
 				parent=self)
 			return
 
+		stream = None
+		if lines is None and self.streamFile is not None:
+			try:
+				stream = FileStream(self.streamFile, self.gcode.cnc.startup, self.gcode)
+				self.streamFile = None
+			except (IOError, OSError):
+				tkMessageBox.showerror(_("Stream error"),
+					str(sys.exc_info()[1]),
+					parent=self)
+				return
+
+		elif lines is None and \
+		   not any(block.enable and len(block) for block in self.gcode.blocks):
+			tkMessageBox.showerror(_("Empty gcode"),
+				_("Not gcode file was loaded"),
+				parent=self)
+			return
+
 		self.editor.selectClear()
 		self.selectionChange()
 		CNC.vars["errline"] = ""
@@ -2256,39 +2306,27 @@ class Application(Toplevel,Sender):
 			except:
 				pass
 
-		if lines is None:
+		if stream is not None:
+			# stream directly from the disk
+			self._stream = stream
+			total   = stream.lines
+			compile = stream.compile
+
+		elif lines is None:
 			#if not self.gcode.probe.isEmpty() and not self.gcode.probe.zeroed:
 			#	tkMessageBox.showerror(_("Probe is not zeroed"),
 			#		_("Please ZERO any location of the probe before starting a run"),
 			#		parent=self)
 			#	return
-			self.statusbar.setLimits(0, 9999)
-			self.statusbar.setProgress(0,0)
-
-			#class MyQueue:
-			#	def put(self,line):
-			#		print ">>>",line
-			#self._paths = self.gcode.compile(MyQueue(), self.checkStop)
-			#return
-
-			self._paths = self.gcode.compile(self.queue, self.checkStop)
-			if self._paths is None:
-				self.emptyQueue()
-				self.purgeController()
-				return
-			elif not self._paths:
-				self.runEnded()
-				tkMessageBox.showerror(_("Empty gcode"),
-					_("Not gcode file was loaded"),
-					parent=self)
-				return
-
 			# reset colors
 			before = time.time()
-			for ij in self._paths:	# Slow loop
-				if not ij: continue
-				path = self.gcode[ij[0]].path(ij[1])
-				if path:
+			total  = len(self.gcode.cnc.startup.splitlines()) + 1
+			for block in self.gcode.blocks:	# Slow loop
+				if not block.enable: continue
+				total += len(block)
+				for j in range(len(block)):
+					path = block.path(j)
+					if not path: continue
 					color = self.canvas.itemcget(path, "fill")
 					if color != CNCCanvas.ENABLE_COLOR:
 						self.canvas.itemconfig(
@@ -2300,22 +2338,30 @@ class Application(Toplevel,Sender):
 						self.update()
 						before = time.time()
 
-			# the buffer of the machine should be empty?
-			self._runLines = len(self._paths) + 1	# plus the wait
+			# compile while sending, the paths are filled as the lines
+			# are queued
+			self._paths = []
+			def compile(queue, stopFunc):
+				paths = self.gcode.compile(queue, stopFunc, self._paths)
+				if paths is None: return None
+				return len(paths)
 		else:
-			n = 1		# including one wait command
-			for line in CNC.compile(lines):
-				if line is not None:
-					if isinstance(line,str):
-						self.queue.put(line+"\n")
-					else:
-						self.queue.put(line)
-					n += 1
-			self._runLines = n	# set it at the end to be sure that all lines are queued
-		self.queue.put((WAIT,))		# wait at the end to become idle
+			total = len(lines) + 1
+			def compile(queue, stopFunc):
+				n = 0
+				for line in CNC.compile(lines):
+					if stopFunc(): return None
+					if line is not None:
+						if isinstance(line,str):
+							queue.put(line+"\n")
+						else:
+							queue.put(line)
+						n += 1
+				return n
+		self.produce(compile)
 
 		self.setStatus(_("Running..."))
-		self.statusbar.setLimits(0, self._runLines)
+		self.statusbar.setLimits(0, total)	# until all lines are queued
 		self.statusbar.configText(fill="White")
 		self.statusbar.config(background="DarkGray")
 
@@ -2358,23 +2404,26 @@ class Application(Toplevel,Sender):
 		t = time.time()
 
 		# dump in the terminal what ever you can in less than 0.1s
-		inserted = False
+		# the lines are kept in ring buffers and only the visible
+		# ones are drawn once at the end. During a run the commands
+		# acknowledged are moved to the terminal without the ok replies
+		terminal = self.terminal
+		buffer   = self.buffer
 		while self.log.qsize()>0 and time.time()-t<0.1:
 			try:
 				msg, line = self.log.get_nowait()
+				if isinstance(line, bytes): line = line.decode()
 				line = str(line).rstrip("\n")
-				inserted = True
 				#print "<<<",msg,line,"\n" in line
 
 				if msg == Sender.MSG_BUFFER:
-					self.buffer.insert(END, line)
+					buffer.add(line)
 
 				elif msg == Sender.MSG_SEND:
-					self.terminal.insert(END, line)
-					self.terminal.itemconfig(END, foreground="Blue")
+					terminal.add(line, "Blue")
 
 				elif msg == Sender.MSG_RECEIVE:
-					self.terminal.insert(END, line)
+					terminal.add(line)
 					if self._insertCount:
 						# when counting is started, then continue
 						self._insertCount += 1
@@ -2383,51 +2432,37 @@ class Application(Toplevel,Sender):
 						# starting with $ or [
 						self._insertCount = 1
 
-				elif msg == Sender.MSG_OK:
-					if self.terminal.size()>0:
-						if self._insertCount:
-							pos = self.terminal.size()-self._insertCount
-							self._insertCount = 0
-						else:
-							pos = END
-						self.terminal.insert(pos, self.buffer.get(0))
-						self.terminal.itemconfig(pos, foreground="Blue")
-						self.buffer.delete(0)
-					self.terminal.insert(END, line)
-
-				elif msg == Sender.MSG_ERROR:
-					if self.terminal.size()>0:
-						if self._insertCount:
-							pos = self.terminal.size()-self._insertCount
-							self._insertCount = 0
-						else:
-							pos = END
-						self.terminal.insert(pos, self.buffer.get(0))
-						self.terminal.itemconfig(pos, foreground="Blue")
-						self.buffer.delete(0)
-					self.terminal.insert(END, line)
-					self.terminal.itemconfig(END, foreground="Red")
+				elif msg in (Sender.MSG_OK, Sender.MSG_ERROR):
+					if self._insertCount:
+						pos = terminal.lineCount()-self._insertCount
+						self._insertCount = 0
+					else:
+						pos = None
+					cmd = buffer.popFirst()
+					if cmd is not None:
+						terminal.add(cmd, "Blue", pos)
+					if msg == Sender.MSG_ERROR:
+						terminal.add(line, "Red")
+					elif not self.running or pos is not None:
+						terminal.add(line)
 
 				elif msg == Sender.MSG_RUNEND:
-					self.terminal.insert(END, line)
-					self.terminal.itemconfig(END, foreground="Magenta")
+					terminal.add(line, "Magenta")
 					self.setStatus(line)
 					self.enable()
 
 				elif msg == Sender.MSG_CLEAR:
-					self.buffer.delete(0,END)
+					buffer.clear()
 
 				else:
 					# Unknown?
-					self.buffer.insert(END, line)
-					self.terminal.itemconfig(END, foreground="Magenta")
+					buffer.add(line, "Magenta")
 
-				if self.terminal.size() > 1000:
-					self.terminal.delete(0,500)
 			except Empty:
 				break
 
-		if inserted: self.terminal.see(END)
+		terminal.refresh()
+		buffer.refresh()
 
 		# Check pendant
 		try:
@@ -2438,7 +2473,7 @@ class Application(Toplevel,Sender):
 
 		# Load file from pendant
 		if self._pendantFileUploaded!=None:
-			self.load(self._pendantFileUploaded)
+			self.loadOrStream(self._pendantFileUploaded)
 			self._pendantFileUploaded=None
 
 		# Update position if needed
@@ -2453,23 +2488,11 @@ class Application(Toplevel,Sender):
 				else:
 					CNC.vars["color"] = STATECOLORDEF
 			self._pause = ("Hold" in state)
-			self.dro.updateState()
-			self.dro.updateCoords()
-			self.canvas.gantry(CNC.vars["wx"],
-					   CNC.vars["wy"],
-					   CNC.vars["wz"],
-					   CNC.vars["mx"],
-					   CNC.vars["my"],
-					   CNC.vars["mz"])
-			if state=="Run":
-				self.gstate.updateFeed()
-				#self.xxx.updateSpindle()
 			self._posUpdate = False
 
-		# Update status string
-		if self._gUpdate:
-			self.gstate.updateG()
-			self._gUpdate = False
+		# Update DRO, gantry and status of the variables changed since
+		# the last call, all the status reports received are merged
+		CNC.vars.dispatch()
 
 		# Update probe and draw point
 		if self._probeUpdate:
@@ -2478,6 +2501,10 @@ class Application(Toplevel,Sender):
 			self.canvas.drawProbe()
 			self._probeUpdate = False
 
+		# Next pass of an adaptive probing
+		if not self.running and self.gcode.probe.refining():
+			self.autolevel.refine()
+
 		# Update any possible variable?
 		if self._update:
 			if self._update == "toolheight":
@@ -2487,8 +2514,17 @@ class Application(Toplevel,Sender):
 			self._update = None
 
 		if self.running:
-			self.statusbar.setProgress(self._runLines-self.queue.qsize(),
-						self._gcount)
+			if self._stream is not None:
+				# progress in lines of the file
+				self.statusbar.setProgress(self._stream.line,
+						self._stream.done(self._gcount))
+			else:
+				if self._runLines != sys.maxsize and \
+				   self.statusbar.high != self._runLines:
+					# all lines are queued, replace the estimated total
+					self.statusbar.high = self.statusbar.length = float(self._runLines)
+				self.statusbar.setProgress(self._queued-self.queue.qsize(),
+							self._gcount)
 			CNC.vars["msg"] = self.statusbar.msg
 			self.bufferbar.setProgress(Sender.getBufferFill(self))
 			self.bufferbar.setText("%i%%"%Sender.getBufferFill(self))
@@ -2507,6 +2543,21 @@ class Application(Toplevel,Sender):
 			if self._gcount >= self._runLines:
 				self.runEnded()
 
+	#-----------------------------------------------------------------------
+	def updateGantry(self):
+		self.canvas.gantry(CNC.vars["wx"],
+				   CNC.vars["wy"],
+				   CNC.vars["wz"],
+				   CNC.vars["mx"],
+				   CNC.vars["my"],
+				   CNC.vars["mz"])
+
+	#-----------------------------------------------------------------------
+	def updateFeed(self):
+		if CNC.vars["state"]=="Run":
+			self.gstate.updateFeed()
+			#self.xxx.updateSpindle()
+
 	#-----------------------------------------------------------------------
 	# "thread" timed function looking for messages in the serial thread
 	# and reporting back in the terminal
@@ -2548,7 +2599,7 @@ def usage(rc):
 	sys.stdout.write("\t-R #\t\t\tLoad the recent file matching the argument\n")
 	sys.stdout.write("\t-s # | --serial #\tOpen serial port specified\n")
 	sys.stdout.write("\t-S\t\t\tDo not open serial port\n")
-	sys.stdout.write("\t--run\t\t\tDirectly run the file once loaded\n")
+	sys.stdout.write("\t--run\t\t\tDirectly run the file once loaded,\n\t\t\t\tstreaming big files from the disk\n")
 	sys.stdout.write("\n")
 	sys.exit(rc)
 
@@ -2561,6 +2612,9 @@ def main(args=None):
 	global tk
 	global application
 
+	# the workers of the parallel loading must not start the application
+	multiprocessing.freeze_support()
+
 	#if sys.version_info[0] != 2:
 	sys.stdout.write("="*80+"\n")
 	sys.stdout.write("WARNING: bCNC has been recently ported to support both python v2.x and v3.x\n")
@@ -2701,7 +2755,10 @@ def main(args=None):
 	# Parse remaining arguments except files
 	if recent: args.append(recent)
 	for fn in args:
-		application.load(fn)
+		if run:
+			application.loadOrStream(fn)
+		else:
+			application.load(fn)
 
 	if serial is None:
 		tkMessageBox.showerror(_("python serial missing"),
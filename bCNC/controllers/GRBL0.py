@@ -12,10 +12,11 @@ class Controller(_GenericGRBL):
 	def __init__(self, master):
 		self.gcode_case = 0
 		self.has_override = False
+		self.rx_buffer_size = 128	# serial receive buffer of the controller
 		self.master = master
 		#print("grbl0 loaded")
 
-	def parseBracketAngle(self, line, cline):
+	def parseBracketAngle(self, line, rxbuf):
 		self.master.sio_status = False
 		pat = STATUSPAT.match(line)
 		if pat:
@@ -33,12 +34,13 @@ class Controller(_GenericGRBL):
 			self.master._posUpdate = True
 			if pat.group(1)[:4] != "Hold" and self.master._msg:
 				self.master._msg = None
+				CNC.vars.touch("state")
 
 			# Machine is Idle buffer is empty
 			# stop waiting and go on
-			#print "<<< WAIT=",wait,sline,pat.group(1),sum(cline)
+			#print "<<< WAIT=",wait,rxbuf.lines,pat.group(1),rxbuf.size
 			#print ">>>", line
-			if self.master.sio_wait and not cline and pat.group(1) not in ("Run", "Jog", "Hold"):
+			if self.master.sio_wait and not rxbuf and pat.group(1) not in ("Run", "Jog", "Hold"):
 				#print ">>>",line
 				self.master.sio_wait = False
 				#print "<<< NO MORE WAIT"
@@ -77,4 +79,3 @@ class Controller(_GenericGRBL):
 			elif DOLLARPAT.match(line):
 				CNC.vars["G"] = line[1:-1].split()
 				CNC.updateG()
-				self.master._gUpdate = True
@@ -29,12 +29,18 @@ OV_SPINDLE_STOP = chr(0x9E)
 OV_FLOOD_TOGGLE = chr(0xA0)
 OV_MIST_TOGGLE  = chr(0xA1)
 
+# Variables of every axis: machine, work position and work offset
+AXES = tuple([("m%s"%(a), "w%s"%(a), "wco%s"%(a)) for a in "xyzabc"])
+
 
 class Controller(_GenericGRBL):
 	def __init__(self, master):
 		self.gcode_case = 0
 		self.has_override = True
+		self.rx_buffer_size = 128	# serial receive buffer of the controller
 		self.master = master
+		self._axes   = AXES[:3]	# axes of the machine position
+		self._report = {}	# raw text of the fields of the last status report
 		#print("grbl1 loaded")
 
 	def jog(self, dir):
@@ -93,110 +99,134 @@ class Controller(_GenericGRBL):
 			CNC.vars["_OvChanged"] = diff<-1
 
 
-	def parseBracketAngle(self, line, cline):
+	#----------------------------------------------------------------------
+	# Forget the fields of the last status report, the next report is
+	# parsed completely
+	#----------------------------------------------------------------------
+	def resetStatus(self):
+		self._report = {}
+
+	#----------------------------------------------------------------------
+	# Parse a status report <State|Field:value,value|...>
+	# The raw text of every field is kept from the previous report and only
+	# the fields that changed are converted and written to CNC.vars, through
+	# the handler of the STATUS table
+	#----------------------------------------------------------------------
+	def parseBracketAngle(self, line, rxbuf):
 		self.master.sio_status = False
 		fields = line[1:-1].split("|")
-		CNC.vars["pins"] = ""
-
+		state  = fields[0]
 
 		#Report if state has changed
-		if CNC.vars["state"] != fields[0] or self.master.runningPrev != self.master.running:
-			self.master.controllerStateChange(fields[0])
+		if CNC.vars["state"] != state or self.master.runningPrev != self.master.running:
+			self.master.controllerStateChange(state)
+			self.master._posUpdate = True
 		self.master.runningPrev = self.master.running
-		CNC.vars["state"] = fields[0]
+		CNC.vars["state"] = state
 
+		report  = self._report
+		changed = []
+		pins    = False
 		for field in fields[1:]:
-			word = SPLITPAT.split(field)
-			if word[0] == "MPos":
-				try:
-					CNC.vars["mx"] = float(word[1])
-					CNC.vars["my"] = float(word[2])
-					CNC.vars["mz"] = float(word[3])
-					CNC.vars["wx"] = round(CNC.vars["mx"]-CNC.vars["wcox"], CNC.digits)
-					CNC.vars["wy"] = round(CNC.vars["my"]-CNC.vars["wcoy"], CNC.digits)
-					CNC.vars["wz"] = round(CNC.vars["mz"]-CNC.vars["wcoz"], CNC.digits)
-					#if Utils.config.get("bCNC","enable6axis") == "true":
-					if len(word) > 4:
-						CNC.vars["ma"] = float(word[4])
-						CNC.vars["wa"] = round(CNC.vars["ma"]-CNC.vars["wcoa"], CNC.digits)
-					if len(word) > 5:
-						CNC.vars["mb"] = float(word[5])
-						CNC.vars["wb"] = round(CNC.vars["mb"]-CNC.vars["wcob"], CNC.digits)
-					if len(word) > 6:
-						CNC.vars["mc"] = float(word[6])
-						CNC.vars["wc"] = round(CNC.vars["mc"]-CNC.vars["wcoc"], CNC.digits)
-					self.master._posUpdate = True
-				except (ValueError,IndexError):
-					CNC.vars["state"] = "Garbage receive %s: %s"%(word[0],line)
-					self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
-					break
-			elif word[0] == "F":
-				try:
-					CNC.vars["curfeed"] = float(word[1])
-				except (ValueError,IndexError):
-					CNC.vars["state"] = "Garbage receive %s: %s"%(word[0],line)
-					self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
-					break
-			elif word[0] == "FS":
-				try:
-					CNC.vars["curfeed"]    = float(word[1])
-					CNC.vars["curspindle"] = float(word[2])
-				except (ValueError,IndexError):
-					CNC.vars["state"] = "Garbage receive %s: %s"%(word[0],line)
-					self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
-					break
-			elif word[0] == "Bf":
-				try:
-					CNC.vars["planner"] = int(word[1])
-					CNC.vars["rxbytes"] = int(word[2])
-				except (ValueError,IndexError):
-					CNC.vars["state"] = "Garbage receive %s: %s"%(word[0],line)
-					self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
-					break
-			elif word[0] == "Ov":
-				try:
-					CNC.vars["OvFeed"]    = int(word[1])
-					CNC.vars["OvRapid"]   = int(word[2])
-					CNC.vars["OvSpindle"] = int(word[3])
-				except (ValueError,IndexError):
-					CNC.vars["state"] = "Garbage receive %s: %s"%(word[0],line)
-					self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
-					break
-			elif word[0] == "WCO":
-				try:
-					CNC.vars["wcox"] = float(word[1])
-					CNC.vars["wcoy"] = float(word[2])
-					CNC.vars["wcoz"] = float(word[3])
-					#if Utils.config.get("bCNC","enable6axis") == "true":
-					if len(word) > 4:
-						CNC.vars["wcoa"] = float(word[4])
-					if len(word) > 5:
-						CNC.vars["wcob"] = float(word[5])
-					if len(word) > 6:
-						CNC.vars["wcoc"] = float(word[6])
-				except (ValueError,IndexError):
-					CNC.vars["state"] = "Garbage receive %s: %s"%(word[0],line)
-					self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
-					break
-			elif word[0] == "Pn":
-				try:
-					CNC.vars["pins"] = word[1]
-					if 'S' in word[1]:
-						if CNC.vars["state"] == 'Idle' and not self.master.running:
-							print("Stream requested by CYCLE START machine button")
-							self.master.event_generate("<<Run>>", when = 'tail')
-						else:
-							print("Ignoring machine stream request, because of state: ", CNC.vars["state"], self.master.running)
-				except (ValueError,IndexError):
-					break
+			name, sep, value = field.partition(":")
+			try:
+				handler, always = STATUS[name]
+			except KeyError:
+				continue
+			if name == "Pn": pins = True
+			if not always and report.get(name) == value: continue
+			report[name] = value
+			try:
+				handler(self, value.split(","), rxbuf)
+			except (ValueError,IndexError):
+				del report[name]
+				CNC.vars["state"] = "Garbage receive %s: %s"%(name,line)
+				self.master.log.put((self.master.MSG_RECEIVE, CNC.vars["state"]))
+				break
+			changed.append(name)
+
+		# Pins are reported only when active
+		if not pins and report.pop("Pn", None) is not None:
+			CNC.vars["pins"] = ""
 
+		# Work position from machine position and offset
+		if "MPos" in changed or "WCO" in changed:
+			self._workPosition()
+			self.master._posUpdate = True
 
 		# Machine is Idle buffer is empty stop waiting and go on
-		if self.master.sio_wait and not cline and fields[0] not in ("Run", "Jog", "Hold"):
+		if self.master.sio_wait and not rxbuf and state not in ("Run", "Jog", "Hold"):
 			#if not self.master.running: self.master.jobDone() #This is not a good idea, it purges the controller while waiting for toolchange. see #1061
 			self.master.sio_wait = False
 			self.master._gcount += 1
 
+	#----------------------------------------------------------------------
+	# The whole field is converted before writing any axis, a malformed
+	# report leaves the previous position
+	#----------------------------------------------------------------------
+	def _statusMPos(self, values, rxbuf):
+		pos = [float(x) for x in values[:len(AXES)]]
+		if len(pos) < 3: raise IndexError
+		for (m,w,wco),value in zip(AXES, pos):
+			CNC.vars[m] = value
+		self._axes = AXES[:len(pos)]
+
+	#----------------------------------------------------------------------
+	def _statusWCO(self, values, rxbuf):
+		offset = [float(x) for x in values[:len(AXES)]]
+		if len(offset) < 3: raise IndexError
+		for (m,w,wco),value in zip(AXES, offset):
+			CNC.vars[wco] = value
+
+	#----------------------------------------------------------------------
+	def _workPosition(self):
+		digits = CNC.digits
+		for m,w,wco in self._axes:
+			CNC.vars[w] = round(CNC.vars[m]-CNC.vars[wco], digits)
+
+	#----------------------------------------------------------------------
+	def _statusF(self, values, rxbuf):
+		CNC.vars["curfeed"] = float(values[0])
+
+	#----------------------------------------------------------------------
+	def _statusFS(self, values, rxbuf):
+		CNC.vars["curfeed"]    = float(values[0])
+		CNC.vars["curspindle"] = float(values[1])
+
+	#----------------------------------------------------------------------
+	# Planner blocks and rx bytes available, parsed on every report for
+	# the telemetry and the detection of the receive buffer size
+	#----------------------------------------------------------------------
+	def _statusBf(self, values, rxbuf):
+		CNC.vars["planner"] = planner = int(values[0])
+		CNC.vars["rxbytes"] = rxbytes = int(values[1])
+		# with nothing pending the free space is the
+		# whole buffer minus the byte grbl keeps empty
+		if not rxbuf:
+			self.master.setRxBufferSize(rxbytes+1)
+		self.master.telemetry.status(planner, rxbytes,
+			self.master.running and \
+			self.master._runLines - self.master._gcount > 1)
+
+	#----------------------------------------------------------------------
+	def _statusOv(self, values, rxbuf):
+		CNC.vars["OvFeed"]    = int(values[0])
+		CNC.vars["OvRapid"]   = int(values[1])
+		CNC.vars["OvSpindle"] = int(values[2])
+
+	#----------------------------------------------------------------------
+	# Input pins, parsed on every report to catch the cycle start button
+	#----------------------------------------------------------------------
+	def _statusPn(self, values, rxbuf):
+		pins = values[0]
+		CNC.vars["pins"] = pins
+		if 'S' in pins:
+			if CNC.vars["state"] == 'Idle' and not self.master.running:
+				print("Stream requested by CYCLE START machine button")
+				self.master.event_generate("<<Run>>", when = 'tail')
+			else:
+				print("Ignoring machine stream request, because of state: ", CNC.vars["state"], self.master.running)
+
 	def parseBracketSquare(self, line):
 		word = SPLITPAT.split(line[1:-1])
 		#print word
@@ -223,26 +253,33 @@ class Controller(_GenericGRBL):
 			if len(word) > 6:
 				CNC.vars["G92C"] = float(word[6])
 			CNC.vars[word[0]] = word[1:]
-			self.master._gUpdate = True
 		if word[0] == "G28":
 			CNC.vars["G28X"] = float(word[1])
 			CNC.vars["G28Y"] = float(word[2])
 			CNC.vars["G28Z"] = float(word[3])
 			CNC.vars[word[0]] = word[1:]
-			self.master._gUpdate = True
 		if word[0] == "G30":
 			CNC.vars["G30X"] = float(word[1])
 			CNC.vars["G30Y"] = float(word[2])
 			CNC.vars["G30Z"] = float(word[3])
 			CNC.vars[word[0]] = word[1:]
-			self.master._gUpdate = True
 		elif word[0] == "GC":
 			CNC.vars["G"] = word[1].split()
 			CNC.updateG()
-			self.master._gUpdate = True
 		elif word[0] == "TLO":
 			CNC.vars[word[0]] = word[1]
 			self.master._probeUpdate = True
-			self.master._gUpdate = True
 		else:
 			CNC.vars[word[0]] = word[1:]
+
+
+# Status report fields: name -> (handler, parse on every report)
+STATUS = {
+	"MPos" : (Controller._statusMPos, False),
+	"WCO"  : (Controller._statusWCO,  False),
+	"F"    : (Controller._statusF,    False),
+	"FS"   : (Controller._statusFS,   False),
+	"Bf"   : (Controller._statusBf,   True),
+	"Ov"   : (Controller._statusOv,   False),
+	"Pn"   : (Controller._statusPn,   True),
+}
@@ -12,6 +12,7 @@ class Controller(_GenericController):
 	def __init__(self, master):
 		self.gcode_case = 1
 		self.has_override = False
+		self.rx_buffer_size = 256	# serial receive buffer of the controller
 		self.master = master
 		#print("smoothie loaded")
 
@@ -42,7 +43,7 @@ class Controller(_GenericController):
 	def grblHelp(self):
 		self.master.serial_write(b"help\n")
 
-	def parseBracketAngle(self, line, cline):
+	def parseBracketAngle(self, line, rxbuf):
 		# <Idle|MPos:68.9980,-49.9240,40.0000,12.3456|WPos:68.9980,-49.9240,40.0000|F:12345.12|S:1.2>
 		ln= line[1:-1] # strip off < .. >
 
@@ -69,7 +70,7 @@ class Controller(_GenericController):
 
 		# Machine is Idle buffer is empty
 		# stop waiting and go on
-		if self.master.sio_wait and not cline and l[0] not in ("Run","Jog", "Hold"):
+		if self.master.sio_wait and not rxbuf and l[0] not in ("Run","Jog", "Hold"):
 		        self.master.sio_wait = False
 		        self.master._gcount += 1
 
@@ -104,4 +105,3 @@ class Controller(_GenericController):
 			elif DOLLARPAT.match(line):
 				CNC.vars["G"] = line[1:-1].split()
 				CNC.updateG()
-				self.master._gUpdate = True
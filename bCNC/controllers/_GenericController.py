@@ -7,6 +7,7 @@ from __future__ import print_function
 from CNC import CNC, WCS
 import time
 import re
+from collections import deque
 
 STATUSPAT = re.compile(r"^<(\w*?),MPos:([+\-]?\d*\.\d*),([+\-]?\d*\.\d*),([+\-]?\d*\.\d*)(?:,([+\-]?\d*\.\d*))?(?:,([+\-]?\d*\.\d*))?(?:,([+\-]?\d*\.\d*))?,WPos:([+\-]?\d*\.\d*),([+\-]?\d*\.\d*),([+\-]?\d*\.\d*)(?:,([+\-]?\d*\.\d*))?(?:,([+\-]?\d*\.\d*))?(?:,([+\-]?\d*\.\d*))?(?:,.*)?>$")
 POSPAT	  = re.compile(r"^\[(...):([+\-]?\d*\.\d*),([+\-]?\d*\.\d*),([+\-]?\d*\.\d*)(?:,([+\-]?\d*\.\d*))?(?:,([+\-]?\d*\.\d*))?(?:,([+\-]?\d*\.\d*))?(:(\d*))?\]$")
@@ -15,6 +16,51 @@ DOLLARPAT = re.compile(r"^\[G\d* .*\]$")
 SPLITPAT  = re.compile(r"[:,]")
 VARPAT    = re.compile(r"^\$(\d+)=(\d*\.?\d*) *\(?.*")
 
+GRBLHAL_RX_BUFFER_SIZE = 1024
+
+
+#==============================================================================
+# Commands sent to the controller and not yet acknowledged, used for the
+# character counting protocol. Keeps a running total of their bytes and
+# reports the acknowledgments to the telemetry if any
+#==============================================================================
+class RxBuffer:
+	def __init__(self, telemetry=None):
+		self.lines = deque()
+		self.counts = deque()	# executed commands completed by each line
+		self.count = 1		# count of the last line popped
+		self.size  = 0
+		self.telemetry = telemetry
+
+	def __len__(self):
+		return len(self.lines)
+
+	#----------------------------------------------------------------------
+	# Append a command, count=0 for the lines of an autolevel move but the
+	# last one, the move is executed when its last line is acknowledged
+	#----------------------------------------------------------------------
+	def append(self, line, count=1):
+		self.lines.append(line)
+		self.counts.append(count)
+		self.size += len(line)
+
+	#----------------------------------------------------------------------
+	# Remove and return the oldest command, its count is left in self.count
+	#----------------------------------------------------------------------
+	def pop(self):
+		line = self.lines.popleft()
+		self.count = self.counts.popleft()
+		self.size -= len(line)
+		if self.telemetry is not None: self.telemetry.ack()
+		return line
+
+	#----------------------------------------------------------------------
+	def clear(self):
+		self.lines.clear()
+		self.counts.clear()
+		self.size = 0
+		if self.telemetry is not None: self.telemetry.clear()
+
 
 class _GenericController:
 	def test(self):
@@ -53,6 +99,9 @@ class _GenericController:
 	def overrideSet(self):
 		pass
 
+	def resetStatus(self):
+		pass
+
 	def hardReset(self):
 		self.master.busy()
 		if self.master.serial is not None:
@@ -156,6 +205,7 @@ class _GenericController:
 		self.master._msg   = None
 		self.master._alarm = False
 		self.master._pause = False
+		CNC.vars.touch("state")
 
 	#----------------------------------------------------------------------
 	def pause(self, event=None):
@@ -186,7 +236,7 @@ class _GenericController:
 
 
 	#----------------------------------------------------------------------
-	def parseLine(self, line, cline, sline):
+	def parseLine(self, line, rxbuf):
 		if not line:
 			return True
 
@@ -194,7 +244,7 @@ class _GenericController:
 			if not self.master.sio_status:
 				self.master.log.put((self.master.MSG_RECEIVE, line))
 			else:
-				self.parseBracketAngle(line, cline)
+				self.parseBracketAngle(line, rxbuf)
 
 		elif line[0]=="[":
 			self.master.log.put((self.master.MSG_RECEIVE, line))
@@ -202,10 +252,12 @@ class _GenericController:
 
 		elif "error:" in line or "ALARM:" in line:
 			self.master.log.put((self.master.MSG_ERROR, line))
-			self.master._gcount += 1
+			if rxbuf:
+				CNC.vars["errline"] = rxbuf.pop().decode()
+				self.master._gcount += rxbuf.count
+			else:
+				self.master._gcount += 1
 			#print "gcount ERROR=",self._gcount
-			if cline: del cline[0]
-			if sline: CNC.vars["errline"] = sline.pop(0)
 			if not self.master._alarm: self.master._posUpdate = True
 			self.master._alarm = True
 			CNC.vars["state"] = line
@@ -214,10 +266,11 @@ class _GenericController:
 
 		elif line.find("ok")>=0:
 			self.master.log.put((self.master.MSG_OK, line))
-			self.master._gcount += 1
-			if cline: del cline[0]
-			if sline: del sline[0]
-			#print "SLINE:",sline
+			if rxbuf:
+				rxbuf.pop()
+				self.master._gcount += rxbuf.count
+			else:
+				self.master._gcount += 1
 #			if  self._alarm and not self.running:
 #				# turn off alarm for connected status once
 #				# a valid gcode event occurs
@@ -233,12 +286,14 @@ class _GenericController:
 			#tg = time.time()
 			self.master.log.put((self.master.MSG_RECEIVE, line))
 			self.master._stop = True
-			del cline[:]	# After reset clear the buffer counters
-			del sline[:]
+			rxbuf.clear()	# After reset clear the buffer counters
 			CNC.vars["version"] = line.split()[1]
 			# Detect controller
 			if self.master.controller in ("GRBL0", "GRBL1"):
 				self.master.controllerSet("GRBL%d"%(int(CNC.vars["version"][0])))
+			self.master.setRxBufferSize()
+			if line[:7]=="GrblHAL":
+				self.master.setRxBufferSize(GRBLHAL_RX_BUFFER_SIZE)
 
 		else:
 			#We return false in order to tell that we can't parse this line
@@ -0,0 +1,51 @@
+# -*- coding: ascii -*-
+#
+# Process pool worker of GCode.loadParallel()
+#
+# Kept in a module without any GUI import, the worker processes import
+# only this module and the g-code parser, not the application
+#
+# Date: 18-Oct-2026
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+#-------------------------------------------------------------------------------
+# Load and simulate a chunk of lines starting from the initial state
+# @return blocks, block boundaries as (next line, block index, blocksExist,
+#	  state) and the final loading state
+#-------------------------------------------------------------------------------
+def loadChunk(args):
+	try:
+		_
+	except NameError:
+		import gettext
+		gettext.install("bCNC")
+	from CNC import CNC, GCode
+
+	lines, (attrs, cncvars), seed = args
+	for n,v in attrs.items(): setattr(CNC, n, v)
+	CNC.vars.update(cncvars)
+
+	gcode = GCode()
+	gcode.cnc.initPath()
+	gcode.cnc.resetAllMargins()
+	gcode._blocksExist = False
+	if seed:
+		# units and feed of the lines before the chunk, in the first
+		# block that is never used, also for the simulation
+		gcode._addLine(seed)
+	bounds = []
+	for i,line in enumerate(lines):
+		n = len(gcode.blocks)
+		gcode._addLine(line)
+		if len(gcode.blocks) > n and not len(gcode.blocks[-1]):
+			bounds.append((i+1, len(gcode.blocks)-1, gcode._blocksExist,
+					gcode.cnc.saveState()))
+	final = (gcode._blocksExist, gcode.cnc.saveState())
+	gcode.simulate()
+	for block in gcode.blocks:
+		# compiled code objects cannot be pickled
+		del block._cmds[:]
+	return gcode.blocks, bounds, final
@@ -0,0 +1,117 @@
+# -*- coding: ascii -*-
+#
+# Motion planner model for job time estimation
+#
+# Simulates the trapezoidal velocity profiles of a grbl like planner with
+# look-ahead over the whole path. Entry speeds are limited by the junction
+# deviation, the nominal speeds and the reachable speeds from the previous
+# and next segments. The backward and forward passes of the planner are
+# recurrences of the form  v[k] = min(c[k], v[k+1] + b[k])  that are
+# solved with a cumulative minimum, so the whole estimation is vectorized.
+#
+# Date: 18-Oct-2026
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy
+
+MIN_JUNCTION_SPEED = 0.0	# [units/s]
+EPS = 1e-10
+
+
+#------------------------------------------------------------------------------
+# Return for every segment the value of  min(limit, upper*|u|)  over the axes
+# where u is the unit direction. Used for the max rate and acceleration
+#------------------------------------------------------------------------------
+def _axisLimit(unit, limits):
+	with numpy.errstate(divide="ignore"):
+		lim = numpy.asarray(limits, dtype=numpy.float64) / numpy.abs(unit)
+	return lim.min(axis=1)
+
+
+#------------------------------------------------------------------------------
+# Estimate the time of a path
+#
+# start, end:	(n,3) arrays with the start and end of every linear segment
+# feed:		(n,) array with the requested feed [units/min], inf for rapids
+# maxrate:	(3,) max rate per axis [units/min]		($110-$112)
+# accel:	(3,) acceleration per axis [units/s^2]		($120-$122)
+# junction:	junction deviation [units]			($11)
+# connected:	(n,) boolean array, False where the segment starts from rest
+#		(e.g. a discontinuity in the path). Optional
+#
+# @return (n,) array with the time of every segment in minutes
+#------------------------------------------------------------------------------
+def estimate(start, end, feed, maxrate, accel, junction, connected=None):
+	start = numpy.asarray(start, dtype=numpy.float64)
+	end   = numpy.asarray(end,   dtype=numpy.float64)
+	n     = len(start)
+	time  = numpy.zeros(n)
+	if n == 0: return time
+
+	delta  = end - start
+	length = numpy.sqrt((delta**2).sum(axis=1))
+	move   = length > EPS
+	if not move.any(): return time
+
+	idx    = numpy.nonzero(move)[0]
+	length = length[idx]
+	unit   = delta[idx] / length[:,None]
+	feed   = numpy.asarray(feed, dtype=numpy.float64)[idx] / 60.0	# units/s
+	m      = len(idx)
+
+	# Nominal speed and acceleration of every segment
+	vmax   = numpy.minimum(feed, _axisLimit(unit, numpy.asarray(maxrate)/60.0))
+	v2nom  = vmax**2
+	acc    = _axisLimit(unit, accel)
+
+	# Junction speed from the deviation of the direction
+	v2max = numpy.zeros(m)
+	if m > 1:
+		cos = -(unit[1:]*unit[:-1]).sum(axis=1)
+		cos = numpy.clip(cos, -1.0, 1.0)
+		sin2 = numpy.sqrt(0.5*(1.0-cos))
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			jacc = numpy.minimum(acc[1:], acc[:-1])
+			v2j = jacc * junction * sin2 / (1.0-sin2)
+		v2j[cos >  0.999999] = MIN_JUNCTION_SPEED**2	# reversal
+		v2j[cos < -0.999999] = numpy.inf		# straight line
+		v2max[1:] = numpy.minimum(v2j, numpy.minimum(v2nom[1:], v2nom[:-1]))
+
+	if connected is not None:
+		v2max[~numpy.asarray(connected, dtype=bool)[idx]] = 0.0
+	v2max[0] = 0.0
+
+	# Velocity square gain over every segment
+	gain = 2.0*acc*length
+
+	# Backward pass: entry[k] = min(v2max[k], entry[k+1] + gain[k])
+	# with the exit of the last segment at rest
+	s = numpy.concatenate(([0.0], numpy.cumsum(gain)))	# s[k] = sum(gain[:k])
+	c = numpy.append(v2max, 0.0) + s			# c[m] = rest at the end
+	entry = numpy.minimum.accumulate(c[::-1])[::-1][:m] - s[:m]
+	entry = numpy.minimum(entry, v2max)
+
+	# Forward pass: entry[k+1] = min(entry[k+1], entry[k] + gain[k])
+	c = entry - s[:m]
+	entry = numpy.minimum.accumulate(c) + s[:m]
+	entry = numpy.maximum(entry, 0.0)
+	exit  = numpy.append(entry[1:], 0.0)
+
+	# Trapezoidal (or triangular) profile of every segment
+	v0 = numpy.sqrt(entry)
+	v1 = numpy.sqrt(exit)
+	dacc = (v2nom - entry) / (2.0*acc)
+	ddec = (v2nom - exit ) / (2.0*acc)
+	trap = dacc + ddec <= length
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		t = numpy.where(trap,
+			(vmax-v0)/acc + (vmax-v1)/acc + (length-dacc-ddec)/vmax,
+			0.0)
+		vpeak = numpy.sqrt(numpy.maximum((gain + entry + exit)/2.0, 0.0))
+		vpeak = numpy.minimum(vpeak, vmax)
+		t = numpy.where(trap, t, (2.0*vpeak-v0-v1)/acc)
+	t[~(vmax>0.0)] = 0.0		# no feed, no time as in CNC.pathLength
+	time[idx] = t / 60.0
+	return time
@@ -0,0 +1,148 @@
+# -*- coding: ascii -*-
+#
+# Streaming telemetry of the sender
+#
+# Records with low overhead the time every line is written to the controller
+# and acknowledged, the character counting buffer fill, and the planner
+# blocks and serial bytes available from the status reports (Bf: field).
+# Provides rolling statistics and exports the records as CSV, to find out
+# whether a stuttering job is starved by the PC, the connection or the
+# g-code itself.
+#
+# Date: 18-Oct-2026
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import time
+from collections import deque
+
+
+#==============================================================================
+# Telemetry recorder
+# write() and ack() are called from the serial thread, status() when a
+# status report is parsed. The records are kept in bounded deques, only
+# the last keep seconds of them unless keep is None (full recording of
+# the run for the export)
+#==============================================================================
+class Telemetry:
+	MAXLEN = 500000		# records kept at most
+	KEEP   = 300.0		# seconds of records kept for the rolling statistics
+
+	def __init__(self, maxlen=MAXLEN, keep=KEEP):
+		self.lines   = deque(maxlen=maxlen)	# (sent, acked, bytes, fill)
+		self.reports = deque(maxlen=maxlen)	# (time, planner, rxbytes, starved)
+		self._pending = deque()			# (sent, bytes, fill) not acked yet
+		self.keep    = keep
+		self.planner = 0	# max planner blocks available, the empty planner
+		self.reset()
+
+	#----------------------------------------------------------------------
+	# Start a new recording. The planner size seen in the reports before
+	# (e.g. idle) is kept, so that the first report is not taken as empty
+	#----------------------------------------------------------------------
+	def reset(self):
+		self.lines.clear()
+		self.reports.clear()
+		self._pending.clear()
+		self.start   = time.time()
+		self.starved = 0.0	# time with the planner empty while running
+		self._last   = None	# time of the last report if planner was empty
+
+	#----------------------------------------------------------------------
+	# A line of nbytes was written, fill bytes are now in the controller
+	#----------------------------------------------------------------------
+	def write(self, nbytes, fill):
+		self._pending.append((time.time(), nbytes, fill))
+
+	#----------------------------------------------------------------------
+	# The oldest line written was acknowledged (ok or error)
+	#----------------------------------------------------------------------
+	def ack(self):
+		try:
+			sent, nbytes, fill = self._pending.popleft()
+		except IndexError:
+			return
+		t = time.time()
+		self.lines.append((sent, t, nbytes, fill))
+		if self.keep is not None: self._trim(self.lines, 1, t)
+
+	#----------------------------------------------------------------------
+	# Controller was reset, forget the lines in flight
+	#----------------------------------------------------------------------
+	def clear(self):
+		self._pending.clear()
+
+	#----------------------------------------------------------------------
+	# Status report with planner blocks and rx bytes available. The time
+	# until the next report is counted as starvation if the planner is
+	# empty while there are still lines to execute
+	#----------------------------------------------------------------------
+	def status(self, planner, rxbytes, active):
+		t = time.time()
+		if self._last is not None:
+			self.starved += t - self._last
+		# empty planner only if the size is known from an earlier report
+		starved = active and 0 < self.planner <= planner
+		self.planner = max(self.planner, planner)
+		self._last = t if starved else None
+		self.reports.append((t, planner, rxbytes, starved))
+		if self.keep is not None: self._trim(self.reports, 0, t)
+
+	#----------------------------------------------------------------------
+	# Drop the records older than keep seconds, the field idx is the time
+	#----------------------------------------------------------------------
+	def _trim(self, records, idx, t):
+		since = t - self.keep
+		while records and records[0][idx] < since:
+			records.popleft()
+
+	#----------------------------------------------------------------------
+	# Rolling statistics over the last window seconds
+	# @return dictionary
+	#----------------------------------------------------------------------
+	def stats(self, window=10.0):
+		now     = time.time()
+		since   = now - window
+		lines   = [x for x in list(self.lines) if x[1] >= since]
+		latency = sorted([acked-sent for sent,acked,n,f in lines])
+
+		def percentile(p):
+			if not latency: return 0.0
+			return latency[min(len(latency)-1, int(p*len(latency)))]
+
+		reports = [x for x in list(self.reports) if x[0] >= since]
+		span    = min(window, now-self.start) or 1.0
+		return {
+			"lines/s"  : len(lines) / span,
+			"bytes/s"  : sum([x[2] for x in lines]) / span,
+			"fill"     : lines and float(sum([x[3] for x in lines]))/len(lines) or 0.0,
+			"p50"      : percentile(0.50),
+			"p95"      : percentile(0.95),
+			"p99"      : percentile(0.99),
+			"max"      : latency and latency[-1] or 0.0,
+			"starved"  : self.starved,
+			"empty"    : reports and float(sum([x[3] for x in reports]))/len(reports) or 0.0,
+		}
+
+	#----------------------------------------------------------------------
+	# Export the records as CSV, one row per line or status report sorted
+	# by time, relative to the start of the recording
+	#----------------------------------------------------------------------
+	def export(self, filename):
+		rows = []
+		for sent, acked, nbytes, fill in list(self.lines):
+			rows.append((sent, "line", nbytes, fill, acked-sent, "", "", ""))
+		for t, planner, rxbytes, starved in list(self.reports):
+			rows.append((t, "status", "", "", "", planner, rxbytes, int(starved)))
+		rows.sort(key=lambda x: x[0])
+
+		f = open(filename, "w")
+		f.write("time,type,bytes,fill,latency,planner,rxbytes,starved\n")
+		for t, kind, nbytes, fill, latency, planner, rxbytes, starved in rows:
+			if latency != "": latency = "%.6f"%(latency)
+			f.write("%.6f,%s,%s,%s,%s,%s,%s,%s\n" % \
+				(t-self.start, kind, nbytes, fill, latency,
+				 planner, rxbytes, starved))
+		f.close()
+		return len(rows)
@@ -0,0 +1,15 @@
+"""Make the bCNC modules importable from the tests and the benchmark"""
+
+import os
+import sys
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+BCNC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../bCNC')
+for path in ('', 'lib', 'controllers', 'plugins'):
+    sys.path.insert(0, os.path.join(BCNC_DIR, path))
+if not hasattr(builtins, '_'):
+    builtins._ = lambda s: s
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Streaming benchmark of the bCNC sender against the GRBL simulator
+
+Streams g-code files through Sender (without the GUI) to a simulated GRBL
+on a pty and reports the throughput, the acknowledge latency and the time
+the machine was starved of blocks.
+
+Usage:
+    python benchmark.py [--rx 128] [--blocks 15] [--speed 10] [files...]
+"""
+
+from __future__ import print_function
+
+import glob
+import os
+import sys
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TESTS_DIR)
+
+import _path  # noqa: E402,F401
+import grblsim  # noqa: E402
+import Utils  # noqa: E402
+Utils.loadConfiguration()
+import Sender  # noqa: E402
+from CNC import CNC  # noqa: E402
+
+
+class HeadlessSender(Sender.Sender):
+    """Sender without the user interface"""
+
+    def disable(self):
+        pass
+
+    def enable(self):
+        pass
+
+
+def connect(simulator, timeout=5.0):
+    """Connect a HeadlessSender to the simulator on a new pty"""
+    name, stop = grblsim.start_pty(simulator)
+    sender = HeadlessSender()
+    sender.open(name, 115200)
+    t = time.time()
+    while CNC.vars["version"] == "" and time.time() - t < timeout:
+        time.sleep(0.05)
+    return sender, stop
+
+
+def stream(sender, filename, timeout=None):
+    """Stream filename from the disk as the RUN command does
+    @return wall clock time
+    """
+    sender.initRun()
+    sender._runLines = sys.maxsize
+    sender._gcount = 0
+    CNC.vars["running"] = True
+    t0 = time.time()
+    sender.produce(Sender.FileStream(filename, sender.gcode.cnc.startup,
+                                      sender.gcode).compile)
+    while sender._gcount < sender._runLines:
+        if timeout is not None and time.time() - t0 > timeout:
+            sender.stopRun()
+            break
+        time.sleep(0.05)
+    elapsed = time.time() - t0
+    sender.runEnded()
+    return elapsed
+
+
+def benchmark(filename, rx=128, blocks=15, speed=10.0):
+    simulator = grblsim.Simulator(rx, blocks, speed)
+    sender, stop = connect(simulator)
+    sender.telemetry.keep = None
+    try:
+        wall = stream(sender, filename)
+        stats = sender.telemetry.stats(wall + 1.0)
+    finally:
+        sender.close()
+        stop.set()
+    return {
+        "file": os.path.basename(filename),
+        "lines": simulator.lines,
+        "wall": wall,
+        "machine": simulator.busy / speed,
+        "starved": simulator.starved / speed,
+        "lines/s": simulator.lines / wall,
+        "bytes/s": stats["bytes/s"],
+        "p95": stats["p95"] * 1000.0,
+        "overflows": simulator.overflows,
+        "errors": simulator.errors,
+    }
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="bCNC streaming benchmark")
+    parser.add_argument("--rx", type=int, default=128,
+                        help="serial receive buffer of the simulator")
+    parser.add_argument("--blocks", type=int, default=15,
+                        help="planner blocks of the simulator")
+    parser.add_argument("--speed", type=float, default=10.0,
+                        help="simulated time speed up")
+    parser.add_argument("files", nargs="*",
+                        default=sorted(glob.glob(os.path.join(TESTS_DIR, "static", "*.gcode"))))
+    args = parser.parse_args(argv)
+
+    print("%-20s %7s %8s %8s %8s %9s %9s %8s %5s %5s" % (
+        "file", "lines", "wall[s]", "mach[s]", "starv[s]",
+        "lines/s", "bytes/s", "p95[ms]", "ovfl", "err"))
+    for filename in args.files:
+        r = benchmark(filename, args.rx, args.blocks, args.speed)
+        print("%-20s %7d %8.2f %8.2f %8.2f %9.0f %9.0f %8.1f %5d %5d" % (
+            r["file"][:20], r["lines"], r["wall"], r["machine"],
+            r["starved"], r["lines/s"], r["bytes/s"], r["p95"],
+            r["overflows"], r["errors"]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
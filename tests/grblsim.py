@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+"""GRBL controller simulator for streaming tests and benchmarks
+
+Models the parts of GRBL 1.1 that matter to a sender:
+the serial RX buffer, the planner queue, the execution time of every block
+from its feed and length, status reports with the Bf: field, feed hold,
+soft reset and soft limit alarms. Listens on a pty or a TCP socket.
+
+Usage:
+    python grblsim.py [--pty LINK | --socket PORT] [--rx 128] [--blocks 15]
+                      [--speed 1.0] [--limits X,Y,Z]
+"""
+
+from __future__ import print_function
+
+import math
+import os
+import re
+import select
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+BANNER = b"\r\nGrbl 1.1f ['$' for help]\r\n"
+WORDPAT = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+RAPID = 5000.0          # mm/min
+MIN_FEED = 1.0          # mm/min, when no feed was programmed
+
+
+class Simulator(object):
+    """Simulated GRBL controller, fed with bytes by one of the transports"""
+
+    def __init__(self, rx_size=128, blocks=15, speed=1.0, limits=None,
+                 clock=time.time):
+        self.rx_size = rx_size      # serial receive buffer
+        self.blocks = blocks        # planner blocks available when empty
+        self.speed = speed          # simulated time / wall clock time
+        self.limits = limits        # soft limits |x|,|y|,|z| or None
+        self.clock = clock          # wall clock in seconds
+        self.output = bytearray()
+        self.lock = threading.Lock()
+        self.t0 = clock()
+        self.reset()
+        # statistics
+        self.lines = 0              # lines executed
+        self.overflows = 0          # bytes lost, sent beyond the rx buffer
+        self.errors = 0
+        self.starved = 0.0          # time with empty planner between blocks
+        self.busy = 0.0             # time executing blocks
+
+    # ------------------------------------------------------------------
+    def now(self):
+        return (self.clock() - self.t0) * self.speed
+
+    def reset(self):
+        self.rx = bytearray()
+        self.planner = deque()      # (duration, start, target, feed)
+        self.block_end = None
+        self.empty_since = None
+        self.pos = [0.0, 0.0, 0.0]  # position at the end of the planner
+        self.mpos = [0.0, 0.0, 0.0]  # position executed
+        self.motion = 0
+        self.feed = 0.0
+        self.unit = 1.0
+        self.absolute = True
+        self.hold = False           # feed hold, block_end is time remaining
+        self.alarm = False
+
+    def write(self, data):
+        self.output += data
+
+    # ------------------------------------------------------------------
+    def receive(self, data):
+        """Bytes received from the sender"""
+        with self.lock:
+            self.advance()      # the lines received start from now
+            for c in bytearray(data):
+                if c == ord("?"):
+                    self.advance()
+                    self.write(self.report())
+                elif c == ord("!"):
+                    self.advance()
+                    if not self.hold and self.block_end is not None:
+                        self.block_end -= self.now()    # time remaining
+                    self.hold = True
+                elif c == ord("~"):
+                    if self.hold and self.block_end is not None:
+                        self.block_end += self.now()
+                    self.hold = False
+                elif c == 0x18:
+                    self.reset()
+                    self.write(BANNER)
+                elif c >= 0x80:
+                    pass    # other realtime overrides
+                elif len(self.rx) >= self.rx_size - 1:
+                    self.overflows += 1
+                else:
+                    self.rx.append(c)
+            self.advance()
+
+    # ------------------------------------------------------------------
+    def advance(self):
+        """Execute the blocks finished by now and parse the pending lines"""
+        now = self.now()
+        t = now
+        while True:
+            # grbl parses the next line only with a free planner block
+            while len(self.planner) < self.blocks:
+                eol = self.rx.find(b"\n")
+                if eol < 0:
+                    break
+                line = bytes(self.rx[:eol]).decode(errors="replace")
+                del self.rx[:eol + 1]
+                self.execute(line.strip().upper(), t)
+
+            if not self.planner or self.hold or now < self.block_end:
+                break
+            # the block is finished, the next one was parsed at that time
+            duration, start, target, feed = self.planner.popleft()
+            self.mpos = list(target)
+            self.busy += duration
+            t = self.block_end
+            if self.planner:
+                self.block_end += self.planner[0][0]
+            else:
+                self.empty_since = self.block_end
+                self.block_end = None
+
+    def next_event(self):
+        """Simulated time of the next block completion or None"""
+        if self.planner and not self.hold:
+            return self.block_end
+        return None
+
+    # ------------------------------------------------------------------
+    def execute(self, line, now):
+        if line.startswith("$"):
+            self.system(line)
+            return
+        if self.alarm and line:
+            self.errors += 1
+            self.write(b"error:9\r\n")
+            return
+        if "(" in line or ";" in line:
+            line = re.sub(r"\(.*?\)|;.*", "", line)
+
+        words = WORDPAT.findall(line.replace(" ", ""))
+        target = None
+        dwell = None
+        ijk = [0.0, 0.0]
+        for word, value in words:
+            value = float(value)
+            if word == "G":
+                if value in (0, 1, 2, 3):
+                    self.motion = int(value)
+                elif value == 4:
+                    dwell = 0.0
+                elif value == 20:
+                    self.unit = 25.4
+                elif value == 21:
+                    self.unit = 1.0
+                elif value == 90:
+                    self.absolute = True
+                elif value == 91:
+                    self.absolute = False
+            elif word == "F":
+                self.feed = value * self.unit
+            elif word == "P" and dwell is not None:
+                dwell = value
+            elif word in "XYZ":
+                if target is None:
+                    target = list(self.pos)
+                i = "XYZ".index(word)
+                if self.absolute:
+                    target[i] = value * self.unit
+                else:
+                    target[i] += value * self.unit
+            elif word in "IJ":
+                ijk["IJ".index(word)] = value * self.unit
+
+        if dwell is not None:
+            self.queue(dwell, self.pos, 0.0, now)
+        elif target is not None and (target != self.pos or self.motion > 1):
+            if self.limits and any(abs(x) > l for x, l
+                                   in zip(target, self.limits)):
+                # soft limit, grbl halts everything
+                self.reset()
+                self.alarm = True
+                self.errors += 1
+                self.write(b"ALARM:2\r\n")
+                self.lines += 1
+                return
+            feed = RAPID if self.motion == 0 else max(self.feed, MIN_FEED)
+            length = self.length(target, ijk)
+            self.queue(60.0 * length / feed, target, feed, now)
+        self.lines += 1
+        self.write(b"ok\r\n")
+
+    def length(self, target, ijk):
+        dx, dy, dz = [t - p for t, p in zip(target, self.pos)]
+        if self.motion in (2, 3) and (ijk[0] or ijk[1]):
+            cx = self.pos[0] + ijk[0]
+            cy = self.pos[1] + ijk[1]
+            a0 = math.atan2(self.pos[1] - cy, self.pos[0] - cx)
+            a1 = math.atan2(target[1] - cy, target[0] - cx)
+            sweep = a1 - a0 if self.motion == 3 else a0 - a1
+            if sweep <= 0.0:
+                sweep += 2.0 * math.pi
+            r = math.hypot(ijk[0], ijk[1])
+            return math.hypot(r * sweep, dz)
+        return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+    def queue(self, duration, target, feed, now):
+        start = list(self.pos)
+        self.pos = list(target)
+        if not self.planner:
+            if self.empty_since is not None:
+                self.starved += max(0.0, now - self.empty_since)
+            self.block_end = duration if self.hold else now + duration
+        self.planner.append((duration, start, list(target), feed))
+
+    # ------------------------------------------------------------------
+    def system(self, line):
+        if line == "$X":
+            self.alarm = False
+            self.write(b"[MSG:Caution: Unlocked]\r\n")
+        elif line == "$H":
+            self.alarm = False
+            self.pos = [0.0, 0.0, 0.0]
+            self.mpos = [0.0, 0.0, 0.0]
+        elif line == "$G":
+            self.write(("[GC:G%d G54 G17 %s %s G94 M5 M9 T0 F%g S0]\r\n" % (
+                self.motion,
+                "G21" if self.unit == 1.0 else "G20",
+                "G90" if self.absolute else "G91",
+                self.feed / self.unit)).encode())
+        elif line == "$#":
+            for name in ("G54", "G55", "G56", "G57", "G58", "G59",
+                         "G28", "G30", "G92"):
+                self.write(("[%s:0.000,0.000,0.000]\r\n" % name).encode())
+            self.write(b"[TLO:0.000]\r\n[PRB:0.000,0.000,0.000:0]\r\n")
+        elif line == "$$":
+            self.write(b"$10=2\r\n$11=0.010\r\n$110=5000.000\r\n")
+        self.write(b"ok\r\n")
+
+    def report(self):
+        if self.alarm:
+            state = "Alarm"
+        elif self.hold:
+            state = "Hold:0" if self.planner else "Hold:1"
+        elif self.planner:
+            state = "Run"
+        else:
+            state = "Idle"
+        pos = self.mpos
+        feed = 0.0
+        if self.planner:
+            duration, start, target, feed = self.planner[0]
+            remaining = self.block_end
+            if self.hold:
+                feed = 0.0
+            else:
+                remaining -= self.now()
+            f = 1.0
+            if duration > 0.0:
+                f = 1.0 - remaining / duration
+                f = min(1.0, max(0.0, f))
+            pos = [s + (t - s) * f for s, t in zip(start, target)]
+        return ("<%s|MPos:%.3f,%.3f,%.3f|Bf:%d,%d|FS:%g,0>\r\n" % (
+            state, pos[0], pos[1], pos[2],
+            self.blocks - len(self.planner),
+            self.rx_size - 1 - len(self.rx), feed)).encode()
+
+    # ------------------------------------------------------------------
+    def serve(self, fd, stop=None, read=os.read, write=os.write):
+        """Serve the controller on file descriptor fd until stop is set"""
+        self.write(BANNER)
+        while stop is None or not stop.is_set():
+            with self.lock:
+                if self.output:
+                    write(fd, bytes(self.output))
+                    del self.output[:]
+                event = self.next_event()
+            timeout = 0.1
+            if event is not None:
+                timeout = min(timeout, max(0.0, (event - self.now()) / self.speed))
+            if select.select([fd], [], [], timeout)[0]:
+                try:
+                    data = read(fd, 4096)
+                except OSError:
+                    break
+                if not data:
+                    break
+                self.receive(data)
+            else:
+                with self.lock:
+                    self.advance()
+
+
+# ----------------------------------------------------------------------
+def open_pty(link=None):
+    """Create a pty, @return master fd and the device name to connect to"""
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+    if link:
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(name, link)
+        name = link
+    return master, slave, name
+
+
+def start_pty(simulator, link=None):
+    """Serve simulator on a pty in a daemon thread
+    @return device name, stop event
+    """
+    master, slave, name = open_pty(link)
+    stop = threading.Event()
+    thread = threading.Thread(target=simulator.serve, args=(master, stop))
+    thread.daemon = True
+    thread.start()
+    simulator._fds = (master, slave)    # keep the pty open
+    return name, stop
+
+
+def serve_socket(simulator, port):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", port))
+    server.listen(1)
+    print("Listening at socket://127.0.0.1:%d" % port)
+    while True:
+        conn, addr = server.accept()
+        simulator.reset()
+        simulator.serve(conn.fileno(),
+                        read=lambda fd, n: conn.recv(n),
+                        write=lambda fd, data: conn.sendall(data))
+        conn.close()
+
+
+# ----------------------------------------------------------------------
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="GRBL simulator")
+    parser.add_argument("--pty", metavar="LINK",
+                        help="symlink to create for the pty device")
+    parser.add_argument("--socket", metavar="PORT", type=int,
+                        help="listen on a TCP port instead of a pty")
+    parser.add_argument("--rx", type=int, default=128,
+                        help="serial receive buffer size")
+    parser.add_argument("--blocks", type=int, default=15,
+                        help="planner blocks")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="simulated time speed up")
+    parser.add_argument("--limits", metavar="X,Y,Z",
+                        help="soft limits of the machine")
+    args = parser.parse_args(argv)
+
+    limits = None
+    if args.limits:
+        limits = [float(x) for x in args.limits.split(",")]
+    simulator = Simulator(args.rx, args.blocks, args.speed, limits)
+    if args.socket:
+        serve_socket(simulator, args.socket)
+    else:
+        master, slave, name = open_pty(args.pty)
+        print("Listening at %s" % name)
+        simulator.serve(master)
+
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv[1:])
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _path  # noqa: E402,F401
+
+from CNC import CNC  # noqa: E402
+
+
+class CompileLineTest(unittest.TestCase):
+    """Compare the fast tokenizer of CNC.compileLine with the slow one"""
+
+    LINES = [
+        'G1 X10 Y20',
+        'g0x1.5y-2z.3',
+        'G1 X1 (comment) Y2',
+        'G1 X1 (first)(second) Y2 (third',
+        'G1 X1 (a (nested) comment) Y2',
+        'G1 X1 ) Y2 (c)',
+        'G1 X1 (semi;colon) Y2',
+        'G1 X1 ; trailing comment (with parens)',
+        'G1 X1 (c) ; trailing',
+        '(only a comment)',
+        '   ',
+        '; line comment',
+        'G1\tX1 Y2',
+        'N10 G1 X[1+2] Y#100',
+        'G1 X[sin(1)] (comment [x])',
+        '#100 = 5',
+        'a=10',
+        'G1 X1 ]',
+        '%wait',
+        '$H',
+    ]
+
+    def assertSame(self, line, space=False):
+        fast = CNC.compileLine(line, space)
+        fast_comment = CNC.comment
+        slow = CNC.compileLine(line, space, fast=False)
+        slow_comment = CNC.comment
+        self.assertEqual(fast, slow, line)
+        self.assertEqual(fast_comment, slow_comment, line)
+
+    def test_lines(self):
+        for line in self.LINES:
+            self.assertSame(line)
+            self.assertSame(line, True)
+
+    def test_sample_files(self):
+        static = os.path.join(os.path.dirname(__file__), 'static')
+        for name in os.listdir(static):
+            if not name.endswith(('.gcode', '.nc', '.ngc')):
+                continue
+            with open(os.path.join(static, name)) as f:
+                for line in f:
+                    self.assertSame(line)
+                    self.assertSame(line, True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _path  # noqa: E402,F401
+
+from CNC import CNC  # noqa: E402
+import GRBL1  # noqa: E402
+
+
+class FakeLog(list):
+    def put(self, item):
+        self.append(item)
+
+
+class FakeTelemetry(object):
+    def status(self, planner, rxbytes, streaming):
+        pass
+
+
+class FakeMaster(object):
+    """The parts of Sender used by the status report parser"""
+
+    MSG_RECEIVE = 3
+
+    def __init__(self):
+        self.sio_status = True
+        self.sio_wait = False
+        self.running = False
+        self.runningPrev = False
+        self._gcount = 0
+        self._runLines = 0
+        self._posUpdate = False
+        self.log = FakeLog()
+        self.telemetry = FakeTelemetry()
+        self.states = []
+        self.events = []
+
+    def controllerStateChange(self, state):
+        self.states.append(state)
+
+    def setRxBufferSize(self, size=None):
+        pass
+
+    def event_generate(self, event, **kw):
+        self.events.append(event)
+
+
+class StatusReportTest(unittest.TestCase):
+    """Incremental parsing of the GRBL 1.1 status reports"""
+
+    REPORT = "<Idle|MPos:10.000,20.000,30.000|FS:0,0|WCO:1.000,2.000,3.000>"
+
+    def setUp(self):
+        self.master = FakeMaster()
+        self.grbl = GRBL1.Controller(self.master)
+        CNC.vars["state"] = ""
+        CNC.vars["pins"] = ""
+        self.parse(self.REPORT)
+
+    def parse(self, line):
+        self.master._posUpdate = False
+        self.grbl.parseBracketAngle(line, [])
+
+    def position(self, kind):
+        return [CNC.vars[kind + a] for a in "xyz"]
+
+    def test_first_report(self):
+        self.assertEqual(self.position("m"), [10.0, 20.0, 30.0])
+        self.assertEqual(self.position("wco"), [1.0, 2.0, 3.0])
+        self.assertEqual(self.position("w"), [9.0, 18.0, 27.0])
+        self.assertEqual(self.master.states, ["Idle"])
+
+    def test_unchanged_report(self):
+        self.parse(self.REPORT)
+        self.assertFalse(self.master._posUpdate)
+        self.assertEqual(self.position("w"), [9.0, 18.0, 27.0])
+        self.assertEqual(self.master.states, ["Idle"])
+
+    def test_wco_only_change(self):
+        self.parse("<Idle|MPos:10.000,20.000,30.000|FS:0,0|WCO:0.000,0.000,5.000>")
+        self.assertTrue(self.master._posUpdate)
+        self.assertEqual(self.position("m"), [10.0, 20.0, 30.0])
+        self.assertEqual(self.position("wco"), [0.0, 0.0, 5.0])
+        self.assertEqual(self.position("w"), [10.0, 20.0, 25.0])
+
+    def test_malformed_field(self):
+        for line in ("<Idle|MPos:11.000,bad,31.000|FS:0,0>",
+                     "<Idle|MPos:11.000,21.000|FS:0,0>"):
+            self.parse(line)
+            self.assertTrue(CNC.vars["state"].startswith("Garbage"))
+            # no axis written from the malformed field
+            self.assertEqual(self.position("m"), [10.0, 20.0, 30.0])
+            self.assertEqual(self.position("w"), [9.0, 18.0, 27.0])
+        # the field is parsed again once valid
+        self.parse("<Idle|MPos:11.000,21.000,31.000|FS:0,0>")
+        self.assertEqual(self.position("m"), [11.0, 21.0, 31.0])
+        self.assertEqual(self.position("w"), [10.0, 19.0, 28.0])
+
+    def test_pins_appear_and_disappear(self):
+        self.parse("<Idle|MPos:10.000,20.000,30.000|FS:0,0|Pn:XZ>")
+        self.assertEqual(CNC.vars["pins"], "XZ")
+        self.parse("<Idle|MPos:10.000,20.000,30.000|FS:0,0>")
+        self.assertEqual(CNC.vars["pins"], "")
+        self.parse("<Idle|MPos:10.000,20.000,30.000|FS:0,0|Pn:XZ>")
+        self.assertEqual(CNC.vars["pins"], "XZ")
+        self.assertEqual(self.master.events, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
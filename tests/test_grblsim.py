@@ -0,0 +1,60 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import grblsim  # noqa: E402
+
+
+class SimulatorTest(unittest.TestCase):
+    """Check the GRBL model of the simulator"""
+
+    def setUp(self):
+        self.time = 0.0
+        self.sim = grblsim.Simulator(rx_size=128, blocks=4, speed=100.0,
+                                     clock=lambda: self.time)
+
+    def output(self):
+        out = bytes(self.sim.output)
+        del self.sim.output[:]
+        return out
+
+    def test_planner_holds_ok(self):
+        for i in range(6):
+            self.sim.receive(b"G1 X%d F60\n" % (i + 1))
+        # one second per block, only the planner blocks are acknowledged
+        self.assertEqual(self.output().count(b"ok"), 4)
+        self.sim.receive(b"?")
+        self.assertIn(b"|Bf:0,", self.output())
+        self.time += 0.1                # 10 seconds simulated
+        self.sim.receive(b"?")
+        out = self.output()
+        self.assertEqual(out.count(b"ok"), 2)
+        self.assertIn(b"<Idle|MPos:6.000,0.000,0.000|Bf:4,127", out)
+        self.assertEqual(self.sim.lines, 6)
+
+    def test_rx_overflow(self):
+        self.sim.receive(b"G4 P100\n")
+        self.sim.receive(b"X" * 200)
+        self.assertEqual(self.sim.overflows, 200 - 127)
+
+    def test_soft_limit_alarm(self):
+        self.sim.limits = [10.0, 10.0, 10.0]
+        self.sim.receive(b"G0 X20\n")
+        self.sim.receive(b"G0 X1\n")
+        self.assertEqual(self.output(), b"ALARM:2\r\nerror:9\r\n")
+        self.sim.receive(b"$X\nG0 X1\n?")
+        out = self.output()
+        self.assertIn(b"[MSG:Caution: Unlocked]", out)
+        self.assertNotIn(b"error", out)
+
+    def test_arc_time(self):
+        self.sim.speed = 1.0
+        self.sim.receive(b"G21 G2 X0 Y0 I10 F600\n")
+        duration = self.sim.planner[0][0]
+        self.assertAlmostEqual(duration, 2.0 * 3.14159265 * 10.0 / 10.0, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _path  # noqa: E402,F401
+
+import Utils  # noqa: E402
+Utils.loadConfiguration()
+from CNC import GCode  # noqa: E402
+
+
+class LoadParallelTest(unittest.TestCase):
+    """Stitching of the chunks loaded by the process pool"""
+
+    PROCESSES = 4
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, feedEveryBlock):
+        lines = ["G21 G90", "F500"]
+        for i in range(500):
+            lines.append("G0 Z5")
+            lines.append("G0 X%d Y%d" % (i, i % 7))
+            lines.append("G1 Z-1" + (" F%d" % (100 + i % 3) if feedEveryBlock else ""))
+            for j in range(8):
+                lines.append("G1 X%d Y%d" % (i + j, (i + j) % 11))
+        filename = os.path.join(self.dir, "test.nc")
+        f = open(filename, "w")
+        f.write("\n".join(lines) + "\n")
+        f.close()
+        return filename
+
+    def load(self, filename):
+        """Load in parallel
+        @return the gcode and the lines parsed by the main process"""
+        gcode = GCode()
+        gcode.filename = filename
+        parsed = []
+        addLine = gcode._addLine
+
+        def count(line):
+            parsed.append(line)
+            addLine(line)
+        gcode._addLine = count
+        self.assertTrue(gcode.loadParallel(self.PROCESSES))
+        return gcode, len(parsed)
+
+    def serial(self, filename):
+        gcode = GCode()
+        gcode.filename = filename
+        gcode.loadFile()
+        return gcode
+
+    def check(self, feedEveryBlock):
+        filename = self.write(feedEveryBlock)
+        gcode, parsed = self.load(filename)
+        # only the head of every chunk up to the first block boundary
+        self.assertLess(parsed, 20 * self.PROCESSES)
+        serial = self.serial(filename)
+        self.assertEqual([list(b) for b in gcode.blocks],
+                         [list(b) for b in serial.blocks])
+        # the toolpaths of the workers are reused
+        self.assertLess(gcode.simulate(), 2 * self.PROCESSES)
+        serial.simulate()
+        self.assertEqual([b.time for b in gcode.blocks],
+                         [b.time for b in serial.blocks])
+
+    def test_single_feed(self):
+        self.check(False)
+
+    def test_feed_every_block(self):
+        self.check(True)
+
+
+if __name__ == '__main__':
+    unittest.main()